@@ -0,0 +1,361 @@
+import json
+import os
+import shutil
+import time
+import uuid
+import xml.etree.ElementTree as ET
+
+from buildorchestra.result import DirArtifact, FileArtifact, StepResult
+
+from metaborg.releng.deploy import BintrayMetadata, MetaborgFileArtifact, NexusMetadata
+
+from metaborg.util.path import DiskUsage, FormatSize
+
+
+class CacheEntry(object):
+  def __init__(self, fingerprint, stepId, artifacts, installed, metadata, size, created):
+    self.fingerprint = fingerprint
+    self.stepId = stepId
+    # Descriptions of the artifacts, as created by _describe_artifact.
+    self.artifacts = artifacts
+    # Version directories relative to the local Maven repository.
+    self.installed = installed
+    # Repository metadata files of the artifact and group directories above the installed directories, relative to the
+    # local Maven repository. These are merged into the local repository on restore instead of being copied, since they
+    # also list versions and plugins that other steps installed.
+    self.metadata = metadata
+    self.size = size
+    self.created = created
+
+  def to_json(self):
+    return {
+      'fingerprint': self.fingerprint,
+      'stepId'     : self.stepId,
+      'artifacts'  : self.artifacts,
+      'installed'  : self.installed,
+      'metadata'   : self.metadata,
+      'size'       : self.size,
+      'created'    : self.created,
+    }
+
+  @staticmethod
+  def from_json(data):
+    return CacheEntry(data['fingerprint'], data['stepId'], data['artifacts'], data['installed'], data['metadata'],
+      data['size'], data['created'])
+
+
+class CacheStats(object):
+  def __init__(self, location, entries, size, oldest, newest):
+    self.location = location
+    self.entries = entries
+    self.size = size
+    self.oldest = oldest
+    self.newest = newest
+
+  def __str__(self):
+    def Format(timestamp):
+      return time.strftime('%Y-%m-%d %H:%M', time.localtime(timestamp)) if timestamp else '-'
+
+    return '\n'.join([
+      'Location       : {}'.format(self.location),
+      'Entries        : {}'.format(self.entries),
+      'Size           : {}'.format(FormatSize(self.size)),
+      'Least recently : {}'.format(Format(self.oldest)),
+      'Most recently  : {}'.format(Format(self.newest)),
+    ])
+
+
+class ArtifactCache(object):
+  """
+  Content-addressed cache of the outputs of build steps, keyed by the fingerprint of the inputs of a step. An entry
+  contains the artifacts that the step returned, and the versions of MetaBorg artifacts that it installed into the local
+  Maven repository. Entries are written to a temporary directory and renamed into place, such that multiple machines can
+  share a cache on a shared file system. Restoring an entry marks it as used, and the least recently used entries are
+  evicted when the cache exceeds its maximum size.
+  """
+
+  # Entries are described in JSON instead of pickled, since unpickling a file from a shared cache can execute arbitrary
+  # code, and pickles break when the artifact classes change.
+  metadataFile = 'entry.json'
+
+  def __init__(self, location, maxSize=None):
+    self.location = location
+    self.maxSize = maxSize
+
+  def __entries_dir(self):
+    return os.path.join(self.location, 'entries')
+
+  def __entry_dir(self, fingerprint):
+    return os.path.join(self.__entries_dir(), fingerprint[:2], fingerprint)
+
+  def __temporary_dir(self):
+    temporary = os.path.join(self.location, 'tmp', uuid.uuid4().hex)
+    os.makedirs(temporary)
+    return temporary
+
+  def __load(self, entryDir):
+    try:
+      with open(os.path.join(entryDir, self.metadataFile)) as file:
+        return CacheEntry.from_json(json.load(file))
+    except (OSError, ValueError, KeyError, TypeError):
+      return None
+
+  def __remove(self, entryDir):
+    # Rename first, such that other processes never see a partially removed entry.
+    try:
+      trash = os.path.join(self.__temporary_dir(), 'entry')
+      os.rename(entryDir, trash)
+    except OSError:
+      return
+    shutil.rmtree(os.path.dirname(trash), ignore_errors=True)
+
+  def contains(self, fingerprint):
+    return os.path.isfile(os.path.join(self.__entry_dir(fingerprint), self.metadataFile))
+
+  def restore(self, fingerprint, basedir, localRepo):
+    """
+    Restores the entry with given fingerprint: copies its artifacts to their locations in basedir, and its installed
+    artifacts into localRepo. Returns the step result and the installed directories, or None if there is no such entry
+    or it cannot be restored.
+    """
+    entryDir = self.__entry_dir(fingerprint)
+    entry = self.__load(entryDir)
+    if not entry:
+      return None
+    try:
+      artifacts = []
+      for index, description in enumerate(entry.artifacts):
+        artifact = _create_artifact(description, basedir)
+        if not artifact:
+          print('Cannot restore {} from the artifact cache: unknown artifact {}'.format(fingerprint, description))
+          return None
+        _copy(os.path.join(entryDir, 'artifacts', str(index)), _artifact_location(artifact))
+        artifacts.append(artifact)
+      for installed in entry.installed:
+        _copy(os.path.join(entryDir, 'installed', installed), os.path.join(localRepo, installed))
+      for metadata in entry.metadata:
+        _merge_metadata(os.path.join(entryDir, 'metadata', metadata), os.path.join(localRepo, metadata))
+      os.utime(os.path.join(entryDir, self.metadataFile))
+    except (OSError, KeyError, TypeError, ET.ParseError) as error:
+      print('Restoring {} from the artifact cache failed: {}'.format(fingerprint, error))
+      return None
+    return StepResult(artifacts), entry.installed
+
+  def store(self, fingerprint, stepId, result, installed, basedir, localRepo):
+    """
+    Stores the artifacts of given step result, and given directories installed into localRepo, under fingerprint.
+    Does nothing if an entry with that fingerprint already exists.
+    """
+    entryDir = self.__entry_dir(fingerprint)
+    if os.path.isdir(entryDir):
+      return
+    temporary = self.__temporary_dir()
+    try:
+      artifacts = []
+      for index, artifact in enumerate(result.artifacts if result else []):
+        description = _describe_artifact(artifact, basedir)
+        if not description:
+          print('Not storing {} in the artifact cache: cannot describe artifact {}'.format(fingerprint, artifact))
+          return
+        _copy(_artifact_location(artifact), os.path.join(temporary, 'artifacts', str(index)))
+        artifacts.append(description)
+      for directory in installed:
+        _copy(os.path.join(localRepo, directory), os.path.join(temporary, 'installed', directory))
+      metadata = _metadata_files(localRepo, installed)
+      for file in metadata:
+        _copy(os.path.join(localRepo, file), os.path.join(temporary, 'metadata', file))
+      entry = CacheEntry(fingerprint, stepId, artifacts, sorted(installed), metadata, DiskUsage(temporary), time.time())
+      with open(os.path.join(temporary, self.metadataFile), mode='w') as file:
+        json.dump(entry.to_json(), file, indent=2, sort_keys=True)
+      os.makedirs(os.path.dirname(entryDir), exist_ok=True)
+      os.rename(temporary, entryDir)
+    except OSError as error:
+      # Another process may have stored the same entry concurrently.
+      if not os.path.isdir(entryDir):
+        print('Storing {} in the artifact cache failed: {}'.format(fingerprint, error))
+      return
+    finally:
+      shutil.rmtree(temporary, ignore_errors=True)
+    if self.maxSize:
+      self.prune(self.maxSize)
+
+  def entries(self):
+    """
+    Returns (entry directory, entry, last used time) triples of all entries, least recently used first.
+    """
+    entries = []
+    entriesDir = self.__entries_dir()
+    if not os.path.isdir(entriesDir):
+      return entries
+    for prefix in os.scandir(entriesDir):
+      if not prefix.is_dir():
+        continue
+      for entryDir in os.scandir(prefix.path):
+        entry = self.__load(entryDir.path)
+        if not entry:
+          continue
+        try:
+          used = os.stat(os.path.join(entryDir.path, self.metadataFile)).st_mtime
+        except OSError:
+          continue
+        entries.append((entryDir.path, entry, used))
+    entries.sort(key=lambda triple: triple[2])
+    return entries
+
+  def stats(self):
+    entries = self.entries()
+    return CacheStats(self.location, len(entries), sum(entry.size for _, entry, _ in entries),
+      entries[0][2] if entries else None, entries[-1][2] if entries else None)
+
+  def prune(self, maxSize=None, maxAge=None):
+    """
+    Evicts the least recently used entries until the cache is at most maxSize bytes, and evicts entries that were not
+    used for maxAge seconds. Returns the number of evicted entries and their total size.
+    """
+    entries = self.entries()
+    total = sum(entry.size for _, entry, _ in entries)
+    now = time.time()
+    evicted, evictedSize = 0, 0
+    for entryDir, entry, used in entries:
+      if (maxSize is None or total <= maxSize) and (maxAge is None or now - used <= maxAge):
+        continue
+      self.__remove(entryDir)
+      total -= entry.size
+      evicted += 1
+      evictedSize += entry.size
+    return evicted, evictedSize
+
+
+def _artifact_location(artifact):
+  return artifact.srcDir if isinstance(artifact, DirArtifact) else artifact.srcFile
+
+
+def _describe_artifact(artifact, basedir):
+  """
+  Returns a JSON-serializable description of artifact, with its location relative to basedir if it is inside basedir,
+  or None if artifact is not of a known kind.
+  """
+  location = _artifact_location(artifact)
+  relative = os.path.relpath(location, basedir)
+  description = {
+    'name'    : artifact.name,
+    'relative': None if relative.startswith(os.pardir) else relative,
+    'location': location,
+  }
+  if type(artifact) is DirArtifact:
+    description.update(kind='dir', destination=artifact.dstDir)
+  elif type(artifact) is FileArtifact:
+    description.update(kind='file', destination=artifact.dstFile)
+  elif type(artifact) is MetaborgFileArtifact:
+    nexus = artifact.nexusMetadata
+    bintray = artifact.bintrayMetadata
+    description.update(kind='metaborg-file', destination=artifact.dstFile,
+      nexus={'groupId': nexus.groupId, 'artifactId': nexus.artifactId, 'packaging': nexus.packaging,
+             'classifier': nexus.classifier} if nexus else None,
+      bintray={'package': bintray.package} if bintray else None)
+  else:
+    return None
+  return description
+
+
+def _create_artifact(description, basedir):
+  """
+  Creates the artifact described by description, located in basedir if it was inside the base directory when it was
+  stored, or returns None if the description is of an unknown kind.
+  """
+  kind = description['kind']
+  name = description['name']
+  relative = description['relative']
+  location = os.path.join(basedir, relative) if relative else description['location']
+  destination = description['destination']
+  if kind == 'dir':
+    return DirArtifact(name, location, destination)
+  elif kind == 'file':
+    return FileArtifact(name, location, destination)
+  elif kind == 'metaborg-file':
+    nexus = description['nexus']
+    bintray = description['bintray']
+    return MetaborgFileArtifact(name, location, destination,
+      NexusMetadata(nexus['groupId'], nexus['artifactId'], nexus['packaging'], nexus['classifier']) if nexus else None,
+      BintrayMetadata(bintray['package']) if bintray else None)
+  return None
+
+
+def _copy(source, destination):
+  os.makedirs(os.path.dirname(destination), exist_ok=True)
+  if os.path.isdir(source):
+    shutil.copytree(source, destination, symlinks=True, dirs_exist_ok=True)
+  else:
+    shutil.copy2(source, destination)
+
+
+_metadataFileName = 'maven-metadata-local.xml'
+
+
+def _metadata_files(localRepo, installed):
+  """
+  Returns the locations, relative to localRepo, of the metadata files of the artifact directories and group directories
+  above given installed version directories.
+  """
+  files = set()
+  for directory in installed:
+    artifactDir = os.path.dirname(directory)
+    for metadataDir in (artifactDir, os.path.dirname(artifactDir)):
+      file = os.path.join(metadataDir, _metadataFileName)
+      if os.path.isfile(os.path.join(localRepo, file)):
+        files.add(file)
+  return sorted(files)
+
+
+def _merge_metadata(source, destination):
+  """
+  Merges the versions and plugins listed in Maven repository metadata file source into destination, keeping the versions
+  and plugins that destination already lists. Copies source if destination does not exist.
+  """
+  if not os.path.isfile(destination):
+    _copy(source, destination)
+    return
+  tree = ET.parse(destination)
+  root = tree.getroot()
+  sourceRoot = ET.parse(source).getroot()
+  # Newer versions of Maven write metadata in a namespace.
+  namespace = root.tag[1:root.tag.index('}')] if root.tag.startswith('{') else None
+  if namespace:
+    ET.register_namespace('', namespace)
+
+  def Tag(name):
+    return '{{{}}}{}'.format(namespace, name) if namespace else name
+
+  def Child(parent, name):
+    child = parent.find(Tag(name))
+    return child if child is not None else ET.SubElement(parent, Tag(name))
+
+  sourceNamespace = sourceRoot.tag[1:sourceRoot.tag.index('}')] if sourceRoot.tag.startswith('{') else None
+
+  def SourcePath(*names):
+    return '/'.join('{{{}}}{}'.format(sourceNamespace, name) if sourceNamespace else name for name in names)
+
+  sourceVersions = sourceRoot.findall(SourcePath('versioning', 'versions', 'version'))
+  if sourceVersions:
+    versioning = Child(root, 'versioning')
+    versions = Child(versioning, 'versions')
+    existing = set(version.text for version in versions.findall(Tag('version')))
+    for version in sourceVersions:
+      if version.text not in existing:
+        ET.SubElement(versions, Tag('version')).text = version.text
+    sourceUpdated = sourceRoot.findtext(SourcePath('versioning', 'lastUpdated'))
+    updated = Child(versioning, 'lastUpdated')
+    if sourceUpdated and (updated.text or '') < sourceUpdated:
+      updated.text = sourceUpdated
+
+  sourcePlugins = sourceRoot.findall(SourcePath('plugins', 'plugin'))
+  if sourcePlugins:
+    plugins = Child(root, 'plugins')
+    existing = set(plugin.findtext(Tag('artifactId')) for plugin in plugins.findall(Tag('plugin')))
+    for plugin in sourcePlugins:
+      if plugin.findtext(SourcePath('artifactId')) not in existing:
+        merged = ET.SubElement(plugins, Tag('plugin'))
+        for child in plugin:
+          ET.SubElement(merged, Tag(child.tag.rpartition('}')[2])).text = child.text
+
+  tree.write(destination, encoding='UTF-8', xml_declaration=True)
@@ -4,8 +4,8 @@ from datetime import datetime
 from os import path
 
 from metaborg.releng.build import RelengBuilder
-from metaborg.releng.versions import SetVersions
-from metaborg.util.git import PushAll
+from metaborg.releng.versions import SetVersionMappings, SetVersions
+from metaborg.util.git import PushAll, DirtySubmodules
 from metaborg.util.prompt import YesNo
 
 
@@ -25,11 +25,7 @@ def Bootstrap(repo, curVersion, curBaselineVersion):
       db['version'] = nextBaselineVersion
 
     def Step0():
-      dirtyRepos = []
-      for submodule in repo.submodules:
-        subrepo = submodule.module()
-        if subrepo.is_dirty():
-          dirtyRepos.append(submodule.name)
+      dirtyRepos = DirtySubmodules(repo)
       if len(dirtyRepos) > 0:
         print('You have uncommitted changes in submodules {}, are you sure you want to continue?'.format(dirtyRepos))
         if not YesNo():
@@ -72,8 +68,8 @@ def Bootstrap(repo, curVersion, curBaselineVersion):
       print(
         'Step 4: for each submodule: revert to previous version, and update baseline version to the next baseline '
         'version')
-      SetVersions(repo, nextBaselineVersion, curVersion, dryRun=False, commit=False)
-      SetVersions(repo, curBaselineVersion, nextBaselineVersion, dryRun=False, commit=True)
+      SetVersionMappings(repo, [(nextBaselineVersion, curVersion), (curBaselineVersion, nextBaselineVersion)],
+        dryRun=False, commit=True)
       print('Updating submodule revisions')
       repo.git.add('--all')
       repo.index.commit('Update submodule revisions')
@@ -1,17 +1,34 @@
 import glob
+import inspect
 import os
+import re
 import shutil
+import sys
+import tempfile
+import threading
+import time
+import xml.etree.ElementTree as ET
+from contextlib import contextmanager
+from copy import deepcopy
+from functools import partial
 
 from buildorchestra.build import Builder
-from buildorchestra.result import StepResult, FileArtifact, DirArtifact
+from buildorchestra.result import BuildResult, StepResult, FileArtifact, DirArtifact
 from eclipsegen.generate import Os, Arch
 from gradlepy.run import Gradle
 from mavenpy.run import Maven
 from pyfiglet import Figlet
 
+from metaborg.releng.artifactcache import ArtifactCache
+from metaborg.releng.buildstate import BuildState, DefaultBuildStateLocation, StepFingerprint
 from metaborg.releng.deploy import MetaborgFileArtifact, BintrayMetadata, NexusMetadata
 from metaborg.releng.eclipse import MetaborgEclipseGenerator
-from metaborg.util.git import create_qualifier
+from metaborg.releng.history import BuildHistory, HistoryEntry, HistoryLocation
+from metaborg.releng.telemetry import (BuildTelemetry, DefaultTelemetryLocation, OutputTimings, WriteGradleInitScript,
+  stepEnvironmentVariable)
+from metaborg.util.git import SubmoduleHeads, WorkingTreeFingerprint, create_qualifier
+from metaborg.util.parallel import PrefixedThreadOutput, RunGraph, RunParallel
+from metaborg.util.path import ParseSize
 
 
 class RelengBuilder(object):
@@ -48,47 +65,147 @@ class RelengBuilder(object):
     self.nexusDeployer = None
     self.bintrayDeployer = None
 
+    # Number of build steps to run concurrently, and the memory in bytes that concurrently running steps may use. The
+    # memory budget defaults to the physical memory of this machine.
+    self.jobs = 1
+    self.memoryBudget = None
+    self.logDir = None
+    # Whether to run adjacent independent Maven steps with the same settings in one aggregated Maven reactor. Only
+    # applies when steps are not run concurrently.
+    self.mavenReactor = False
+
+    # Whether to execute steps whose fingerprint did not change since their last successful execution.
+    self.force = False
+    self.buildStateLocation = DefaultBuildStateLocation(repo)
+    # Directory of the artifact cache to restore the outputs of steps from, and its maximum size in bytes. The cache is
+    # disabled when the directory is not set.
+    self.artifactCacheDir = None
+    self.artifactCacheSize = None
+    self.__buildState = None
+    self.__fingerprints = {}
+    self.__skipped = []
+    self.__restored = []
+    self.__installedBy = {}
+    # Steps that are executing, and steps that executed while another step was executing.
+    self.__executing = set()
+    self.__concurrent = set()
+    self.__executingLock = threading.Lock()
+    # Version directories that steps installed during this build.
+    self.__attributed = set()
+
+    # Directory to write a telemetry report and trace of each build to, and the history of build durations that
+    # `b history` reads. Telemetry is disabled when it is not set.
+    self.telemetryDir = DefaultTelemetryLocation(repo)
+    self.__telemetry = None
+    # Directory that the output of steps is written to when it is not printed directly, and the Gradle init script that
+    # prints task durations.
+    self.__logDir = None
+    self.__gradleInitScript = None
+
     builder = Builder(copyOptions=True, dependencyAnalysis=buildDeps)
     self.__builder = builder
 
+    # Submodules that each step reads, e.g. the submodules of the modules in the Maven build of that step.
+    stepSubmodules = {}
+    self.__stepSubmodules = stepSubmodules
+    # Tool that each step runs, which determines how much memory the step uses.
+    stepTools = {}
+    self.__stepTools = stepTools
+    # Build options that affect the outputs of each step. Defaults to the named parameters of the method of the step.
+    stepOptions = {}
+    self.__stepOptions = stepOptions
+    stepMethods = {}
+    self.__stepMethods = stepMethods
+
+    def add_step(identifier, depIds, method, submodules, tool='maven', options=None):
+      builder.add_build_step(identifier, depIds, partial(self.__execute_step, identifier, method))
+      stepMethods[identifier] = method
+      stepSubmodules[identifier] = submodules
+      stepTools[identifier] = tool
+      stepOptions[identifier] = options if options is not None else _method_options(method)
+      return identifier
+
     # Main targets
     mainTargets = []
 
-    def add_main_target(identifier, depIds, method):
-      builder.add_build_step(identifier, depIds, method)
+    def add_main_target(identifier, depIds, method, submodules, tool='maven', options=None):
+      add_step(identifier, depIds, method, submodules, tool, options)
       mainTargets.append(identifier)
       return identifier
 
-    poms = add_main_target('poms', [], RelengBuilder.__build_poms)
-    jars = add_main_target('jars', [poms], RelengBuilder.__build_premade_jars)
-    strategoxt = add_main_target('strategoxt', [poms, jars], RelengBuilder.__build_or_download_strategoxt)
-    java = add_main_target('java', [poms, jars, strategoxt], RelengBuilder.__build_java)
+    poms = add_main_target('poms', [], RelengBuilder.__build_poms, ['releng'])
+    jars = add_main_target('jars', [poms], RelengBuilder.__build_premade_jars, ['releng', 'jsglr'])
+    strategoxt = add_main_target('strategoxt', [poms, jars], RelengBuilder.__build_or_download_strategoxt,
+      ['strategoxt'], options=['basedir', 'buildStratego', 'bootstrapStratego', 'testStratego', 'skipTests',
+        'eclipseQualifier', 'maven', 'mavenDeployer'])
+    java = add_main_target('java', [poms, jars, strategoxt], RelengBuilder.__build_java,
+      ['releng', 'jsglr', 'mb-exec', 'mb-rep', 'nabl', 'runtime-libraries', 'sdf', 'spoofax', 'spoofax-maven',
+       'spoofax-sunshine', 'spt', 'strategoxt'])
     stdDeps = [poms, jars, strategoxt, java]
-    add_main_target('java-uber', stdDeps + [], RelengBuilder.__build_java_uber)
+    add_main_target('java-uber', stdDeps + [], RelengBuilder.__build_java_uber, ['spoofax'])
 
-    languagePrereq = add_main_target('language-prereqs', stdDeps + [], RelengBuilder.__build_language_prereqs)
-    languages = add_main_target('languages', stdDeps + [languagePrereq], RelengBuilder.__build_languages)
+    languagePrereq = add_main_target('language-prereqs', stdDeps + [], RelengBuilder.__build_language_prereqs,
+      ['releng'])
+    languages = add_main_target('languages', stdDeps + [languagePrereq], RelengBuilder.__build_languages,
+      ['releng', 'esv', 'mb-rep', 'metaborg-coq', 'nabl', 'runtime-libraries', 'sdf', 'spoofax', 'stratego', 'ts'])
     stdLangDeps = stdDeps + [languages]
-    dynsem = add_main_target('dynsem', stdLangDeps, RelengBuilder.__build_dynsem)
-    spt = add_main_target('spt', stdLangDeps, RelengBuilder.__build_spt)
+    dynsem = add_main_target('dynsem', stdLangDeps, RelengBuilder.__build_dynsem, ['releng', 'dynsem'])
+    spt = add_main_target('spt', stdLangDeps, RelengBuilder.__build_spt, ['releng', 'nabl', 'spt'])
     allLangDeps = stdLangDeps + [dynsem, spt]
 
-    eclipsePrereqs = add_main_target('eclipse-prereqs', allLangDeps + [], RelengBuilder.__build_eclipse_prereqs)
-    eclipse = add_main_target('eclipse', allLangDeps + [eclipsePrereqs], RelengBuilder.__build_eclipse)
+    eclipsePrereqs = add_main_target('eclipse-prereqs', allLangDeps + [], RelengBuilder.__build_eclipse_prereqs,
+      ['releng', 'spoofax-eclipse'])
+    eclipse = add_main_target('eclipse', allLangDeps + [eclipsePrereqs], RelengBuilder.__build_eclipse,
+      ['releng', 'dynsem', 'esv', 'mb-rep', 'metaborg-coq', 'nabl', 'runtime-libraries', 'sdf', 'spoofax',
+       'spoofax-eclipse', 'spt', 'stratego', 'ts'])
 
-    intellij = add_main_target('intellij', allLangDeps, RelengBuilder.__build_intellij)
-    spt_intellij = add_main_target('spt-intellij', [spt], RelengBuilder.__build_spt_intellij)
+    intellij = add_main_target('intellij', allLangDeps, RelengBuilder.__build_intellij, ['spoofax-intellij'],
+      'gradle')
+    spt_intellij = add_main_target('spt-intellij', [spt], RelengBuilder.__build_spt_intellij, ['spt'], 'gradle')
 
     builder.add_target('all', mainTargets)
+    stepSubmodules['all'] = []
+    stepTools['all'] = None
+    stepOptions['all'] = []
 
     # Additional targets
-    builder.add_build_step('java-libs', [java], RelengBuilder.__build_java_libs)
-    builder.add_build_step('eclipse-instances', [eclipse], RelengBuilder.__build_eclipse_instances)
+    add_step('java-libs', [java], RelengBuilder.__build_java_libs, ['releng'])
+    add_step('eclipse-instances', [eclipse], RelengBuilder.__build_eclipse_instances, ['spoofax-eclipse'],
+      'eclipsegen')
+
+    # Steps that consist of a single Maven build of a directory, which can be aggregated into one Maven reactor.
+    self.__reactorSteps = {poms, java, 'java-uber', 'java-libs', languagePrereq, languages, dynsem, spt, eclipsePrereqs,
+                           eclipse}
 
   @property
   def targets(self):
     return self.__builder.all_steps_ordered
 
+  def steps(self, *targets):
+    """
+    Returns the identifiers of given targets and the steps they transitively depend on.
+    """
+    visited = set()
+    queue = list(targets)
+    while queue:
+      identifier = queue.pop()
+      if identifier in visited:
+        continue
+      if identifier not in self.__stepSubmodules:
+        raise RuntimeError('Target {} does not exist'.format(identifier))
+      visited.add(identifier)
+      queue.extend(self.__builder.deps.get(identifier, []))
+    return visited
+
+  def submodules(self, *targets):
+    """
+    Returns the sorted names of the submodules that are read when building given targets and their dependencies.
+    """
+    submodules = set()
+    for identifier in self.steps(*targets):
+      submodules.update(self.__stepSubmodules[identifier])
+    return sorted(submodules)
+
   def build(self, *targets):
     basedir = self.__repo.working_tree_dir
 
@@ -145,9 +262,7 @@ class RelengBuilder(object):
       print(figlet.renderText('Cleaning local maven repository'))
       _clean_local_repo(self.mavenLocalRepo)
 
-    print(figlet.renderText('Building'))
-    result = self.__builder.build(
-      *targets,
+    options = dict(
       basedir=basedir,
       skipTests=self.skipTests,
       eclipseQualifier=qualifier,
@@ -162,6 +277,49 @@ class RelengBuilder(object):
       bintrayDeployer=self.bintrayDeployer
     )
 
+    # Deployments must include the artifacts of all steps, which are only produced by executing them.
+    if self.mavenDeployer or self.nexusDeployer or self.bintrayDeployer:
+      self.__buildState = None
+      self.__fingerprints = {}
+    else:
+      self.__buildState = BuildState.load(self.buildStateLocation)
+      self.__fingerprints = self.__compute_fingerprints(targets, options)
+    self.__skipped = []
+    self.__restored = []
+    self.__attributed = set()
+
+    print(figlet.renderText('Building'))
+    if self.jobs and self.jobs > 1:
+      build = self.__build_parallel
+    elif self.mavenReactor:
+      build = self.__build_reactor
+    else:
+      build = self.__builder.build
+    # Output of steps that run concurrently is streamed through a log file per step, to prefix it with the name of the
+    # step. Temporary log directories are removed after the build.
+    temporaryLogDir = None
+    if self.jobs and self.jobs > 1:
+      if self.logDir:
+        self.__logDir = self.logDir
+        os.makedirs(self.__logDir, exist_ok=True)
+      else:
+        self.__logDir = temporaryLogDir = tempfile.mkdtemp(prefix='releng-build-logs-')
+    else:
+      self.__logDir = None
+    self.__gradleInitScript = WriteGradleInitScript(self.telemetryDir) if self.telemetryDir else None
+
+    try:
+      result = self.__build_measured(build, targets, options, qualifier)
+    finally:
+      if temporaryLogDir:
+        shutil.rmtree(temporaryLogDir, ignore_errors=True)
+
+    if self.__skipped:
+      print('Skipped (up to date): {}'.format(', '.join(self.__skipped)))
+      print('Use --force to execute these steps regardless')
+    if self.__restored:
+      print('Restored from artifact cache: {}'.format(', '.join(self.__restored)))
+
     if not result:
       return
 
@@ -184,6 +342,360 @@ class RelengBuilder(object):
       copyTo = _make_abs(self.copyArtifactsTo, self.__repo.working_tree_dir)
       result.copy_to(copyTo)
 
+  def __build_measured(self, build, targets, options, qualifier):
+    """
+    Builds targets with given build function. When telemetry is enabled, measures the build, writes a report of it, and
+    appends its durations to the build history.
+    """
+    if self.telemetryDir:
+      metadata = {'targets': list(targets), 'qualifier': qualifier, 'jobs': self.jobs}
+      telemetry = BuildTelemetry(metadata)
+      self.__telemetry = telemetry
+      submodules = SubmoduleHeads(self.__repo)
+      succeeded = False
+      try:
+        with telemetry:
+          result = build(*targets, **options)
+        succeeded = True
+      finally:
+        self.__telemetry = None
+        reportLocation, traceLocation = telemetry.write(self.telemetryDir)
+        telemetry.print_slowest_modules(10)
+        print('Wrote build telemetry to {} and trace to {}'.format(reportLocation, traceLocation))
+        BuildHistory(HistoryLocation(self.telemetryDir)).append(
+          HistoryEntry(telemetry.to_json(), submodules, succeeded=succeeded))
+    else:
+      result = build(*targets, **options)
+    return result
+
+  def __compute_fingerprints(self, targets, options):
+    """
+    Computes the fingerprints of given targets and the steps they transitively depend on, from the working trees of
+    the submodules they read, the options that affect them, and the fingerprints of their dependencies. The fingerprint
+    of a step is None if one of its submodules is not in a repository, or if one of its dependencies has no fingerprint.
+    """
+    basedir = options['basedir']
+    stepIds = [stepId for stepId in self.__builder.all_steps_ordered if stepId in self.steps(*targets)]
+    submodules = sorted(set(submodule for stepId in stepIds for submodule in self.__stepSubmodules[stepId]))
+    submoduleFingerprints = RunParallel(
+      ((submodule, partial(WorkingTreeFingerprint, os.path.join(basedir, submodule))) for submodule in submodules))
+
+    fingerprints = {}
+    for stepId in stepIds:
+      stepSubmoduleFingerprints = {submodule: submoduleFingerprints[submodule] for submodule in
+                                   self.__stepSubmodules[stepId]}
+      depFingerprints = {depId: fingerprints[depId] for depId in self.__builder.deps.get(stepId, ())}
+      if None in stepSubmoduleFingerprints.values() or None in depFingerprints.values():
+        fingerprints[stepId] = None
+        continue
+      # The location of the checkout does not affect the outputs, and would differ between machines.
+      stepOptions = {option: _option_value(options[option]) for option in self.__stepOptions[stepId] if
+                     option != 'basedir'}
+      fingerprints[stepId] = StepFingerprint(stepId, stepSubmoduleFingerprints, stepOptions, depFingerprints)
+    return fingerprints
+
+  def __execute_step(self, stepId, method, **options):
+    """
+    Executes step stepId with given options, measuring it when telemetry is enabled. Processes that the step starts are
+    tagged with the name of the step, such that their resource usage is attributed to it.
+    """
+    telemetry = self.__telemetry
+    if not telemetry:
+      with self.__step_output(stepId, None, options['maven'], options['gradle']):
+        return self.__execute_incremental(stepId, method, None, **options)
+    options['maven'].env[stepEnvironmentVariable] = stepId
+    options['gradle'].env[stepEnvironmentVariable] = stepId
+    with telemetry.measure(stepId) as measurement, \
+        self.__step_output(stepId, measurement, options['maven'], options['gradle']):
+      if isinstance(options['maven'], _BuiltMaven):
+        # Maven already ran in a Maven reactor, which is measured separately.
+        measurement.status = 'reactor'
+      return self.__execute_incremental(stepId, method, measurement, **options)
+
+  @contextmanager
+  def __step_output(self, name, measurement, maven, gradle):
+    """
+    Extracts the durations of modules and tasks from the output of step name into measurement while inside the context.
+    When steps run concurrently, redirects the output of Maven and Gradle to the log file of the step, and prints it as
+    it is written, prefixed with the step name.
+    """
+    timings = OutputTimings(measurement) if measurement else None
+    if gradle and timings and self.__gradleInitScript:
+      gradle.extraArgs.extend(['--init-script', '"{}"'.format(self.__gradleInitScript)])
+    if not self.__logDir:
+      if timings:
+        with _OutputTee(timings.feed):
+          yield
+      else:
+        yield
+      return
+    logFile = os.path.join(self.__logDir, '{}.log'.format(name))
+    # Start with an empty log, the log directory may be reused between builds.
+    open(logFile, mode='w').close()
+    # Maven and Gradle are run through the shell, which appends their output to the log of the step.
+    redirect = ['>>', '"{}"'.format(logFile), '2>&1']
+    maven.extraArgs.extend(redirect)
+    if gradle:
+      gradle.extraArgs.extend(redirect)
+    with _LogTail(logFile, '[{}] '.format(name), timings.feed if timings else None):
+      yield
+
+  def __execute_incremental(self, stepId, method, measurement, **options):
+    """
+    Executes the method of step stepId with given options, unless the step was executed successfully before with the
+    same fingerprint and its outputs still exist, in which case the result of that execution is returned, or its
+    outputs can be restored from the artifact cache.
+    """
+    state = self.__buildState
+    fingerprint = self.__fingerprints.get(stepId)
+    if not state or not fingerprint:
+      return method(**options)
+
+    basedir = options['basedir']
+    tool = self.__stepTools.get(stepId)
+    localRepo = _local_repo(options['gradle'].mavenLocalRepo if tool == 'gradle' else options['maven'].localRepo)
+    cache = ArtifactCache(self.artifactCacheDir, self.artifactCacheSize) if self.artifactCacheDir else None
+    if not self.force:
+      record = state.up_to_date(stepId, fingerprint, localRepo)
+      if record:
+        print('Build step {} skipped (up to date)'.format(stepId))
+        self.__skipped.append(stepId)
+        if measurement:
+          measurement.status = 'skipped'
+        return record.result()
+      restored = cache.restore(fingerprint, basedir, localRepo) if cache else None
+      if restored:
+        result, outputs = restored
+        print('Build step {} restored from artifact cache'.format(stepId))
+        self.__restored.append(stepId)
+        if measurement:
+          measurement.status = 'restored'
+        state.record(stepId, fingerprint, result, outputs)
+        return result
+
+    # Forget the previous execution first, such that the step is executed again if it fails.
+    state.forget(stepId)
+    # File systems may store modification times at a granularity of up to a second.
+    start = time.time() - 1
+    with self.__executingLock:
+      if self.__executing:
+        self.__concurrent.update(self.__executing)
+        self.__concurrent.add(stepId)
+      self.__executing.add(stepId)
+    try:
+      result = method(**options)
+    finally:
+      with self.__executingLock:
+        self.__executing.remove(stepId)
+        concurrent = stepId in self.__concurrent
+        self.__concurrent.discard(stepId)
+    if stepId in self.__installedBy:
+      # Built in a Maven reactor, which already attributed the installed artifacts to the step.
+      outputs = self.__installedBy.pop(stepId)
+      if outputs is None:
+        print('Not recording build step {}, its modules in the Maven reactor could not be determined'.format(stepId))
+        return result
+    else:
+      outputs = _installed_since(localRepo, start) if tool in ('maven', 'gradle') else []
+    if not concurrent:
+      with self.__executingLock:
+        # The time window of the step may overlap with the installs of the step that executed just before it.
+        outputs = set(outputs) - self.__attributed
+        self.__attributed.update(outputs)
+    state.record(stepId, fingerprint, result, outputs)
+    # Artifacts installed while other steps were executing cannot be attributed to a step, so the outputs of the step
+    # may contain artifacts of other steps. These are only used to check whether the outputs still exist, but must not
+    # be restored from the artifact cache.
+    if cache and not concurrent:
+      cache.store(fingerprint, stepId, result, outputs, basedir, localRepo)
+    return result
+
+  def __reusable(self, stepId, options):
+    """
+    Returns whether step stepId will be skipped because it is up to date, or restored from the artifact cache.
+    """
+    state = self.__buildState
+    fingerprint = self.__fingerprints.get(stepId)
+    if not state or not fingerprint or self.force:
+      return False
+    localRepo = _local_repo(options['maven'].localRepo)
+    if state.up_to_date(stepId, fingerprint, localRepo):
+      return True
+    return bool(self.artifactCacheDir and ArtifactCache(self.artifactCacheDir).contains(fingerprint))
+
+  def __maven_invocation(self, stepId, options):
+    """
+    Returns the Maven invocation that step stepId performs with given options, without running Maven, or None if the
+    step cannot be aggregated into a Maven reactor.
+    """
+    if stepId not in self.__reactorSteps or self.__reusable(stepId, options):
+      return None
+    recordingOptions = dict(options, maven=_maven_as(_RecordingMaven, options['maven']))
+    try:
+      self.__stepMethods[stepId](**recordingOptions)
+    except _MavenInvocation as invocation:
+      return invocation if not invocation.buildFile else None
+    return None
+
+  def __run_reactor(self, stepIds, invocations, options):
+    """
+    Runs the Maven invocations of steps stepIds in one Maven reactor, then executes the steps without running Maven to
+    collect their results. If the reactor fails, executes the steps one by one, to attribute the failure to a step.
+    """
+    basedir = options['basedir']
+    print('Executing build steps {} in one Maven reactor'.format(', '.join(stepIds)))
+    reactorDir = tempfile.mkdtemp(prefix='.releng-reactor-', dir=basedir)
+    try:
+      with open(os.path.join(reactorDir, 'pom.xml'), mode='w') as file:
+        file.write(_reactor_pom([os.path.relpath(invocation.cwd, reactorDir) for invocation in invocations]))
+      first = invocations[0]
+      start = time.time()
+      failure = None
+      name = 'reactor({})'.format(', '.join(stepIds))
+      try:
+        if self.__telemetry:
+          first.maven.env[stepEnvironmentVariable] = name
+          with self.__telemetry.measure(name) as measurement, \
+              self.__step_output(name, measurement, first.maven, None):
+            first.maven.run(reactorDir, None, *first.targets, **first.properties)
+        else:
+          first.maven.run(reactorDir, None, *first.targets, **first.properties)
+      except RuntimeError as detail:
+        failure = detail
+    finally:
+      shutil.rmtree(reactorDir, ignore_errors=True)
+
+    if failure:
+      print('Maven reactor of build steps {} failed: {}'.format(', '.join(stepIds), failure))
+      print('Executing build steps {} one by one to find the failing step'.format(', '.join(stepIds)))
+      return {stepId: self.__execute(stepId, options) for stepId in stepIds}
+
+    # Attribute the artifacts that the reactor installed to the step whose modules built them, such that the record and
+    # cache entry of a step do not contain the artifacts of other steps in the reactor.
+    installed = _installed_since(_local_repo(options['maven'].localRepo), start - 1)
+    for stepId, invocation in zip(stepIds, invocations):
+      self.__installedBy[stepId] = _installed_by_modules(installed, invocation.cwd)
+
+    results = {}
+    for stepId in stepIds:
+      results[stepId] = self.__execute(stepId, dict(options, maven=_maven_as(_BuiltMaven, options['maven'])))
+    return results
+
+  def __execute(self, stepId, options):
+    step = self.__builder.steps[stepId]
+    print('Executing build step {}'.format(step))
+    result = step.execute(**deepcopy(options))
+    print('Executing build step {} completed'.format(step))
+    return result
+
+  def __build_reactor(self, *targets, **options):
+    """
+    Builds given targets like Builder.build, but runs adjacent Maven steps in one Maven reactor when they do not depend
+    on each other, and perform the same Maven invocation apart from the directory that is built. Results and failures
+    are still attributed to each step.
+    """
+    if not targets:
+      return None
+    stepIds = self.__steps_to_execute(targets)
+    print('Executing build steps: {}'.format(', '.join(stepIds)))
+
+    results = {}
+    batch, invocations = [], []
+
+    def run_batch():
+      if len(batch) == 1:
+        results[batch[0]] = self.__execute(batch[0], options)
+      elif batch:
+        results.update(self.__run_reactor(list(batch), list(invocations), options))
+      del batch[:]
+      del invocations[:]
+
+    for stepId in stepIds:
+      if not self.__builder.steps[stepId].shouldExecute:
+        continue
+      invocation = self.__maven_invocation(stepId, deepcopy(options))
+      independent = not set(self.__builder.deps.get(stepId, ())) & set(batch)
+      if invocation and invocations and independent and invocation.compatible(invocations[0]):
+        batch.append(stepId)
+        invocations.append(invocation)
+        continue
+      run_batch()
+      if invocation:
+        batch.append(stepId)
+        invocations.append(invocation)
+      else:
+        results[stepId] = self.__execute(stepId, options)
+    run_batch()
+
+    return self.__build_result(stepIds, results)
+
+  def __steps_to_execute(self, targets):
+    builder = self.__builder
+    if builder.dependencyAnalysis:
+      stepIds = self.steps(*targets)
+    else:
+      stepIds = set(targets)
+    return [stepId for stepId in builder.all_steps_ordered if stepId in stepIds]
+
+  @staticmethod
+  def __build_result(stepIds, results):
+    artifacts = []
+    for stepId in stepIds:
+      if results.get(stepId):
+        artifacts.extend(results[stepId].artifacts)
+    print('All done!')
+    if artifacts:
+      print('Produced artifacts:')
+      for artifact in artifacts:
+        print('Artifact {}'.format(artifact))
+    return BuildResult(artifacts)
+
+  def __step_memory(self, stepId, gradle):
+    """
+    Estimates the memory in bytes that given step uses: the maximum heap size of the JVM it runs, plus a quarter for
+    memory outside of the heap. Defaults to the default maximum heap size of the JVM, a quarter of physical memory.
+    """
+    tool = self.__stepTools.get(stepId)
+    if tool not in ('maven', 'gradle'):
+      return 0
+    opts = self.mavenOpts if tool == 'maven' else gradle.opts
+    heap = _max_heap_size(opts) or _max_heap_size(os.environ.get('GRADLE_OPTS' if tool == 'gradle' else 'MAVEN_OPTS'))
+    if not heap:
+      physicalMemory = _physical_memory()
+      heap = physicalMemory // 4 if physicalMemory else 0
+    return heap + heap // 4
+
+  def __build_parallel(self, *targets, **options):
+    """
+    Builds given targets like Builder.build, but runs at most self.jobs independent steps concurrently, within the
+    memory budget. The output of each step is written to a log file per step, and printed prefixed with the step.
+    """
+    if not targets:
+      return None
+    builder = self.__builder
+    stepIds = self.__steps_to_execute(targets)
+    deps = {stepId: set(builder.deps.get(stepId, ())) & set(stepIds) for stepId in stepIds}
+
+    budget = self.memoryBudget or _physical_memory()
+    costs = {stepId: self.__step_memory(stepId, options['gradle']) for stepId in stepIds}
+    print('Executing build steps: {}'.format(', '.join(stepIds)))
+    print('Running at most {} steps concurrently{}, logging to {}'.format(self.jobs,
+      ' within {:.1f} GiB of memory'.format(budget / 2 ** 30) if budget else '', self.__logDir))
+
+    def execute(stepId):
+      step = builder.steps[stepId]
+      if not step.shouldExecute:
+        return None
+      print('Executing build step {}'.format(step))
+      result = step.execute(**deepcopy(options))
+      print('Executing build step {} completed'.format(step))
+      return result
+
+    results = RunGraph(((stepId, lambda stepId=stepId: execute(stepId)) for stepId in stepIds), deps, jobs=self.jobs,
+      costs=costs, budget=budget)
+
+    return self.__build_result(stepIds, results)
+
   # Builders
 
   @staticmethod
@@ -412,6 +924,298 @@ class RelengBuilder(object):
 
 # Private helper functions
 
+class _LogTail(object):
+  """
+  Prints lines appended to a log file, prefixed with prefix, from a background thread while inside the context. Passes
+  each line to onLine if it is set.
+  """
+
+  def __init__(self, location, prefix, onLine=None):
+    self.location = location
+    self.prefix = prefix
+    self.onLine = onLine
+    self.stopped = threading.Event()
+    self.thread = threading.Thread(target=self.__run, daemon=True)
+
+  def __enter__(self):
+    self.thread.start()
+    return self
+
+  def __exit__(self, *_):
+    self.stopped.set()
+    self.thread.join()
+
+  def __run(self):
+    with PrefixedThreadOutput(self.prefix):
+      position = 0
+      while True:
+        stopped = self.stopped.is_set()
+        if os.path.isfile(self.location):
+          with open(self.location, 'rb') as file:
+            file.seek(position)
+            data = file.read()
+          # Only print complete lines, unless the step is done.
+          end = len(data) if stopped else data.rfind(b'\n') + 1
+          if end:
+            text = data[:end].decode('utf-8', errors='replace')
+            print(text, end='')
+            position += end
+            if self.onLine:
+              for line in text.splitlines():
+                self.onLine(line)
+        if stopped:
+          break
+        self.stopped.wait(0.2)
+
+
+class _OutputTee(object):
+  """
+  Passes each line that this process and its child processes write to standard output or error to onLine while inside
+  the context, by redirecting both to a pipe that a background thread copies to the original standard output. Standard
+  output and error are shared by all threads, so this may only be used when steps are executed one by one.
+  """
+
+  def __init__(self, onLine):
+    self.onLine = onLine
+    self.saved = None
+    self.thread = None
+
+  def __enter__(self):
+    sys.stdout.flush()
+    sys.stderr.flush()
+    try:
+      self.saved = os.dup(1), os.dup(2)
+    except OSError:
+      # No standard output to tee.
+      return self
+    read, write = os.pipe()
+    os.dup2(write, 1)
+    os.dup2(write, 2)
+    os.close(write)
+    self.thread = threading.Thread(target=self.__run, args=(read,), daemon=True)
+    self.thread.start()
+    return self
+
+  def __exit__(self, *_):
+    if not self.saved:
+      return
+    sys.stdout.flush()
+    sys.stderr.flush()
+    output, error = self.saved
+    os.dup2(output, 1)
+    os.dup2(error, 2)
+    os.close(error)
+    # Processes that outlive the step, such as daemons, may keep the pipe open.
+    self.thread.join(5)
+    if not self.thread.is_alive():
+      os.close(output)
+
+  def __run(self, read):
+    with os.fdopen(read, 'rb') as pipe:
+      for line in iter(pipe.readline, b''):
+        remaining = line
+        while remaining:
+          remaining = remaining[os.write(self.saved[0], remaining):]
+        self.onLine(line.decode('utf-8', errors='replace'))
+
+
+class _MavenInvocation(Exception):
+  def __init__(self, maven, cwd, buildFile, targets, properties):
+    super().__init__('Maven invocation in {}'.format(cwd))
+    self.maven = maven
+    self.cwd = cwd
+    self.buildFile = buildFile
+    self.targets = targets
+    self.properties = properties
+
+  def compatible(self, other):
+    """
+    Returns whether this invocation only differs from other invocation in the directory that is built.
+    """
+    return vars(self.maven) == vars(other.maven) and self.targets == other.targets and \
+           self.properties == other.properties
+
+
+class _RecordingMaven(Maven):
+  """
+  Maven that raises its invocation instead of running it, to find out what a build step would run.
+  """
+
+  def run(self, cwd, buildFile, *extraTargets, **extraProperties):
+    maven = _maven_as(Maven, self)
+    raise _MavenInvocation(maven, cwd, buildFile, extraTargets, extraProperties)
+
+
+class _BuiltMaven(Maven):
+  """
+  Maven that does not run, for build steps whose Maven invocation already ran in a Maven reactor.
+  """
+
+  def run(self, cwd, buildFile, *extraTargets, **extraProperties):
+    print('Maven build of {} already ran in the Maven reactor'.format(cwd))
+
+
+def _maven_as(cls, maven):
+  copied = cls()
+  copied.__dict__.update(deepcopy(maven.__dict__))
+  return copied
+
+
+def _reactor_pom(modules):
+  # Do not install or deploy the aggregator POM itself.
+  return '\n'.join([
+    '<?xml version="1.0" encoding="UTF-8"?>',
+    '<project xmlns="http://maven.apache.org/POM/4.0.0">',
+    '  <modelVersion>4.0.0</modelVersion>',
+    '  <groupId>releng.reactor</groupId>',
+    '  <artifactId>releng-reactor</artifactId>',
+    '  <version>1</version>',
+    '  <packaging>pom</packaging>',
+    '  <properties>',
+    '    <maven.install.skip>true</maven.install.skip>',
+    '    <maven.deploy.skip>true</maven.deploy.skip>',
+    '  </properties>',
+    '  <modules>',
+  ] + ['    <module>{}</module>'.format(module.replace(os.sep, '/')) for module in modules] + [
+    '  </modules>',
+    '</project>',
+    ''
+  ])
+
+
+def _method_options(method):
+  parameters = inspect.signature(method).parameters.values()
+  return [parameter.name for parameter in parameters if parameter.kind == parameter.POSITIONAL_OR_KEYWORD]
+
+
+def _option_value(value):
+  """
+  Returns the part of the value of a build option that affects the outputs of build steps, as a value that can be
+  serialized to JSON. Locations of local repositories and settings files are left out, since they differ between
+  machines, and only affect where dependencies are resolved from.
+  """
+  if isinstance(value, Maven):
+    return {
+      'targets'   : [target for target in value.targets if target != 'clean'],
+      'profiles'  : value.profiles,
+      'properties': value.properties,
+      'skipTests' : value.skipTests,
+    }
+  if isinstance(value, Gradle):
+    return {'targets': value.targets, 'properties': value.properties}
+  if value is None or isinstance(value, (str, bool, int, float, list, dict)):
+    return value
+  return type(value).__name__
+
+
+def _local_repo(localRepo):
+  if localRepo:
+    return localRepo
+  return os.path.join(os.path.expanduser('~'), '.m2', 'repository')
+
+
+def _installed_since(localRepo, since):
+  """
+  Returns the version directories (<groupPath>/<artifactId>/<version>), relative to given local Maven repository, of
+  MetaBorg artifacts that contain files which were modified since given time. Directories in which only repository
+  metadata was modified are left out, since Maven rewrites the metadata of the artifact and group directories above a
+  version directory on every install.
+  """
+  installed = set()
+  for root, _, files in os.walk(os.path.join(localRepo, 'org', 'metaborg')):
+    for file in files:
+      if _is_repository_metadata(file):
+        continue
+      try:
+        if os.stat(os.path.join(root, file)).st_mtime >= since:
+          installed.add(os.path.relpath(root, localRepo))
+          break
+      except OSError:
+        pass
+  return installed
+
+
+def _installed_by_modules(installed, directory):
+  """
+  Returns the version directories of given installed version directories whose artifact ID is the artifact ID of the
+  Maven project in directory or one of its modules. Returns None if not all modules could be found.
+  """
+  artifactIds = _module_artifact_ids(os.path.join(directory, 'pom.xml'), set())
+  if artifactIds is None:
+    return None
+  return set(version for version in installed if os.path.basename(os.path.dirname(version)) in artifactIds)
+
+
+_pomPropertyRegex = re.compile(r'\$\{([^}]+)\}')
+
+
+def _module_artifact_ids(pomFile, visited):
+  """
+  Returns the artifact IDs of the Maven project of pomFile and its modules, recursively. Properties in module paths,
+  such as ${repo.root} in the aggregator POMs of the build steps, are substituted with the properties of the project.
+  Returns None if a POM file cannot be read, or a module path contains an unknown property.
+  """
+  pomFile = os.path.normpath(pomFile)
+  if pomFile in visited:
+    return set()
+  visited.add(pomFile)
+  try:
+    project = ET.parse(pomFile).getroot()
+  except (ET.ParseError, OSError):
+    return None
+
+  def Children(element, name):
+    return [child for child in element if child.tag.rpartition('}')[2] == name]
+
+  pomDir = os.path.dirname(pomFile)
+  properties = {'basedir': pomDir, 'project.basedir': pomDir}
+  for element in Children(project, 'properties'):
+    for property in element:
+      properties[property.tag.rpartition('}')[2]] = (property.text or '').strip()
+
+  def Substitute(text, depth=0):
+    if depth > 10:
+      return None
+    unknown = [name for name in _pomPropertyRegex.findall(text) if name not in properties]
+    if unknown:
+      return None
+    substituted = _pomPropertyRegex.sub(lambda match: properties[match.group(1)], text)
+    return substituted if substituted == text else Substitute(substituted, depth + 1)
+
+  artifactIds = set((child.text or '').strip() for child in Children(project, 'artifactId'))
+  for modules in Children(project, 'modules'):
+    for module in Children(modules, 'module'):
+      path = Substitute((module.text or '').strip())
+      if path is None:
+        return None
+      location = os.path.join(pomDir, path)
+      if os.path.isdir(location):
+        location = os.path.join(location, 'pom.xml')
+      moduleArtifactIds = _module_artifact_ids(location, visited)
+      if moduleArtifactIds is None:
+        return None
+      artifactIds.update(moduleArtifactIds)
+  return artifactIds
+
+
+def _is_repository_metadata(fileName):
+  return fileName.startswith('maven-metadata') or fileName == 'resolver-status.properties'
+
+
+def _max_heap_size(opts):
+  if not opts:
+    return None
+  match = re.search(r'-Xmx(\d+[kKmMgGtT]?)(?:\s|$)', opts)
+  return ParseSize(match.group(1)) if match else None
+
+
+def _physical_memory():
+  try:
+    return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+  except (AttributeError, ValueError, OSError):
+    return None
+
+
 def _glob_one(path):
   globs = glob.glob(path)
   if not globs:
@@ -0,0 +1,106 @@
+import hashlib
+import json
+import os
+import pickle
+import threading
+
+from buildorchestra.result import StepResult
+
+
+def DefaultBuildStateLocation(repo):
+  return os.path.join(repo.git_dir, 'metaborg-build-state.pickle')
+
+
+def StepFingerprint(identifier, submodules, options, depFingerprints):
+  """
+  Computes the fingerprint of a build step from its identifier, the fingerprints of the submodules it reads, the values
+  of the options that affect it, and the fingerprints of the steps it depends on. All values must be serializable to
+  JSON, and must not depend on the machine, such that fingerprints can be used as keys of a shared artifact cache.
+  """
+  data = {
+    'step'      : identifier,
+    'submodules': submodules,
+    'options'   : options,
+    'deps'      : depFingerprints,
+  }
+  return hashlib.sha1(json.dumps(data, sort_keys=True, default=repr).encode('utf-8')).hexdigest()
+
+
+class StepRecord(object):
+  def __init__(self, fingerprint, artifacts, outputs):
+    self.fingerprint = fingerprint
+    self.artifacts = artifacts
+    # Directories relative to the local Maven repository.
+    self.outputs = outputs
+
+  def outputs_exist(self, localRepo):
+    """
+    Returns whether the directories that the step installed into localRepo, and the sources of its artifacts, still
+    exist.
+    """
+    locations = [os.path.join(localRepo, output) for output in self.outputs]
+    for artifact in self.artifacts:
+      locations.append(getattr(artifact, 'srcFile', None) or getattr(artifact, 'srcDir', None))
+    return all(location and os.path.exists(location) for location in locations)
+
+  def result(self):
+    return StepResult(list(self.artifacts))
+
+
+class BuildState(object):
+  """
+  Persistent record of the fingerprints of the last successful execution of each build step, together with the
+  artifacts that execution returned and the outputs it installed. Records are saved after every step, such that steps
+  that succeeded before a failing step are not executed again. Safe to use from multiple threads.
+  """
+
+  formatVersion = 2
+
+  def __init__(self, location, records=None):
+    self.location = location
+    self.records = records or {}
+    self.lock = threading.Lock()
+
+  @staticmethod
+  def load(location):
+    """
+    Loads the build state at location. Returns an empty state if it does not exist, is unreadable, or is of an old
+    format.
+    """
+    try:
+      with open(location, mode='rb') as file:
+        data = pickle.load(file)
+    except (OSError, pickle.PickleError, EOFError, AttributeError, ImportError):
+      return BuildState(location)
+    if not isinstance(data, dict) or data.get('format') != BuildState.formatVersion:
+      return BuildState(location)
+    return BuildState(location, data.get('records'))
+
+  def save(self):
+    with self.lock:
+      temporary = '{}.tmp'.format(self.location)
+      with open(temporary, mode='wb') as file:
+        pickle.dump({'format': self.formatVersion, 'records': self.records}, file)
+      os.replace(temporary, self.location)
+
+  def up_to_date(self, identifier, fingerprint, localRepo):
+    """
+    Returns the record of step identifier if it was last executed successfully with given fingerprint, and its outputs
+    still exist in localRepo. Returns None otherwise.
+    """
+    with self.lock:
+      record = self.records.get(identifier)
+    if record and record.fingerprint == fingerprint and record.outputs_exist(localRepo):
+      return record
+    return None
+
+  def record(self, identifier, fingerprint, result, outputs):
+    with self.lock:
+      self.records[identifier] = StepRecord(fingerprint, list(result.artifacts) if result else [], sorted(outputs))
+    self.save()
+
+  def forget(self, identifier):
+    with self.lock:
+      removed = self.records.pop(identifier, None)
+    if removed:
+      self.save()
@@ -1,23 +1,37 @@
+import json
 import os
+import socket
+import statistics
+import sys
+import time
 from os import path
 
 import jprops
 from eclipsegen.generate import Os, Arch
+from git.exc import GitCommandError
 from git.repo.base import Repo
 from plumbum import cli
 
+from metaborg.releng.artifactcache import ArtifactCache
 from metaborg.releng.bootstrap import Bootstrap
 from metaborg.releng.build import RelengBuilder
 from metaborg.releng.deploy import MetaborgBintrayDeployer, MetaborgMavenDeployer, MetaborgNexusDeployer
 from metaborg.releng.eclipse import MetaborgEclipseGenerator
+from metaborg.releng.history import (BuildHistory, CommitCount, Durations, FindRegressions, FormatTime, HistoryLocation,
+  Sparkline, SubmoduleChanges)
 from metaborg.releng.icon import GenerateIcons
 from metaborg.releng.maven import MetaborgMavenSettingsGeneratorGenerator
 from metaborg.releng.release import MetaborgRelease
-from metaborg.releng.versions import SetVersions
+from metaborg.releng.telemetry import DefaultTelemetryLocation
+from metaborg.releng.versions import (FindVersions, IsVersionMismatch, ParseVersionMapping, SetVersionMappings,
+  VersionKindOf, benchmark_pom_detection)
 from metaborg.util.git import (CheckoutAll, CleanAll, MergeAll, PushAll,
   RemoteType, ResetAll, SetRemoteAll, TagAll,
-  TrackAll, UpdateAll, create_now_qualifier, create_qualifier, repo_changed, FetchAll)
-from metaborg.util.path import CommonPrefix
+  TrackAll, UpdateAll, create_now_qualifier, create_qualifier, FetchAll, defaultRetries,
+  ParseCloneStrategies, benchmark_qualifier, repo_changes, remote_changes, Branch, StatusAll,
+  buildOutputDirectories, SubmodulePaths)
+from metaborg.util.parallel import ParallelError
+from metaborg.util.path import CommonPrefix, FormatSize, ParseSize
 from metaborg.util.prompt import YesNo, YesNoTrice, YesNoTwice
 
 
@@ -74,6 +88,11 @@ class MetaborgReleng(cli.Application):
     help="Load properties from file. If none are set, defaults to 'build.properties'"
   )
 
+  jobs = cli.SwitchAttr(
+    names=['-j', '--jobs'], argtype=cli.Range(1, 256), default=None,
+    help='Maximum number of submodules to process concurrently. Defaults to the number of processors'
+  )
+
   def main(self):
     if not self.nested_command:
       print('Error: no command given')
@@ -89,18 +108,58 @@ class MetaborgReleng(cli.Application):
     return 0
 
 
+class MetaborgUpdateShared(cli.Application):
+  depth = cli.SwitchAttr(names=['-d', '--depth'], default=None, argtype=int, mandatory=False,
+    help='Depth to update with')
+  referenceCache = cli.SwitchAttr(names=['--reference-cache'], argtype=str, default=None, mandatory=False,
+    help='Directory with bare mirrors of submodules to borrow objects from, created if it does not exist')
+  retries = cli.SwitchAttr(names=['--retries'], argtype=int, default=defaultRetries, mandatory=False,
+    help='Number of times to retry fetching a submodule after a network failure')
+  cloneStrategies = cli.SwitchAttr(names=['--clone'], argtype=str, list=True,
+    help="Strategy for initializing submodules: full, blobless, treeless, shallow-since:<date>, or depth:<n>. Prefix "
+         "with '<submodule>=' to set the strategy of a single submodule. Can be given multiple times")
+  forTargets = cli.Flag(names=['--for-targets'], default=False,
+    help='Only process the submodules that are required to build the build targets given as arguments')
+
+  def submodule_names(self, repo, targets):
+    """
+    Returns the names of the submodules to process, or None to process all submodules. Raises a RuntimeError when given
+    targets are invalid.
+    """
+    if not self.forTargets:
+      if targets:
+        raise RuntimeError('Unexpected arguments {}, use --for-targets to pass build targets'.format(targets))
+      return None
+    builder = RelengBuilder(repo)
+    if not targets:
+      raise RuntimeError(
+        'No targets specified, pass one or more of the following targets: {}'.format(', '.join(builder.targets)))
+    names = builder.submodules(*targets)
+    print('Processing submodules required by {}: {}'.format(', '.join(targets), ', '.join(names)))
+    return names
+
+
 @MetaborgReleng.subcommand("update")
-class MetaborgRelengUpdate(cli.Application):
+class MetaborgRelengUpdate(MetaborgUpdateShared):
   """
   Updates all submodules to the latest commit on the remote repository
   """
 
-  depth = cli.SwitchAttr(names=['-d', '--depth'], default=None, argtype=int, mandatory=False,
-    help='Depth to update with')
-
-  def main(self):
+  def main(self, *targets):
+    repo = self.parent.repo
+    try:
+      cloneStrategy, cloneStrategies = ParseCloneStrategies(self.cloneStrategies)
+      names = self.submodule_names(repo, targets)
+    except (ValueError, RuntimeError) as detail:
+      print(str(detail))
+      return 1
     print('Updating all submodules')
-    UpdateAll(self.parent.repo, depth=self.depth)
+    try:
+      UpdateAll(repo, depth=self.depth, referenceCache=self.referenceCache, retries=self.retries,
+        jobs=self.parent.jobs, cloneStrategy=cloneStrategy, cloneStrategies=cloneStrategies, names=names)
+    except ParallelError as detail:
+      print(str(detail))
+      return 1
     return 0
 
 
@@ -125,13 +184,17 @@ class MetaborgRelengSetRemote(cli.Application):
       toType = RemoteType.HTTP
 
     print('Setting remotes for all submodules')
-    # noinspection PyUnboundLocalVariable
-    SetRemoteAll(self.parent.repo, toType=toType)
+    try:
+      # noinspection PyUnboundLocalVariable
+      SetRemoteAll(self.parent.repo, toType=toType, jobs=self.parent.jobs)
+    except ParallelError as detail:
+      print(str(detail))
+      return 1
     return 0
 
 
 @MetaborgReleng.subcommand("clean-update")
-class MetaborgRelengCleanUpdate(cli.Application):
+class MetaborgRelengCleanUpdate(MetaborgUpdateShared):
   """
   Resets, cleans, and updates all submodules to the latest commit on the remote repository
   """
@@ -139,10 +202,14 @@ class MetaborgRelengCleanUpdate(cli.Application):
   confirmPrompt = cli.Flag(names=['-y', '--yes'], default=False,
     help='Answer warning prompts with yes automatically')
 
-  depth = cli.SwitchAttr(names=['-d', '--depth'], default=None, argtype=int, mandatory=False,
-    help='Depth to update with')
-
-  def main(self):
+  def main(self, *targets):
+    repo = self.parent.repo
+    try:
+      cloneStrategy, cloneStrategies = ParseCloneStrategies(self.cloneStrategies)
+      names = self.submodule_names(repo, targets)
+    except (ValueError, RuntimeError) as detail:
+      print(str(detail))
+      return 1
     if not self.confirmPrompt:
       print(
         'WARNING: This will DELETE UNCOMMITED CHANGES, DELETE UNPUSHED COMMITS, and DELETE UNTRACKED FILES. Do you '
@@ -150,13 +217,18 @@ class MetaborgRelengCleanUpdate(cli.Application):
       if not YesNoTrice():
         return 1
     print('Resetting, cleaning, and updating all submodules')
-    repo = self.parent.repo
-    FetchAll(repo)
-    CheckoutAll(repo)
-    ResetAll(repo, toRemote=True)
-    CheckoutAll(repo)
-    CleanAll(repo)
-    UpdateAll(repo, depth=self.depth)
+    jobs = self.parent.jobs
+    try:
+      FetchAll(repo, referenceCache=self.referenceCache, retries=self.retries, jobs=jobs, names=names)
+      CheckoutAll(repo, jobs=jobs, names=names)
+      ResetAll(repo, toRemote=True, jobs=jobs, names=names)
+      CheckoutAll(repo, jobs=jobs, names=names)
+      CleanAll(repo, jobs=jobs, names=names)
+      UpdateAll(repo, depth=self.depth, referenceCache=self.referenceCache, retries=self.retries, jobs=jobs,
+        cloneStrategy=cloneStrategy, cloneStrategies=cloneStrategies, names=names)
+    except ParallelError as detail:
+      print(str(detail))
+      return 1
     return 0
 
 
@@ -168,7 +240,11 @@ class MetaborgRelengTrack(cli.Application):
 
   def main(self):
     print('Setting tracking branch for each submodule')
-    TrackAll(self.parent.repo)
+    try:
+      TrackAll(self.parent.repo, jobs=self.parent.jobs)
+    except ParallelError as detail:
+      print(str(detail))
+      return 1
     return 0
 
 
@@ -190,7 +266,11 @@ class MetaborgRelengMerge(cli.Application):
       print('This will merge branches, changing the state of your repositories, do you want to continue?')
       if not YesNo():
         return 1
-    MergeAll(self.parent.repo, self.branch)
+    try:
+      MergeAll(self.parent.repo, self.branch, jobs=self.parent.jobs)
+    except ParallelError as detail:
+      print(str(detail))
+      return 1
     return 0
 
 
@@ -214,7 +294,11 @@ class MetaborgRelengTag(cli.Application):
       print('This creates tags, changing the state of your repositories, do you want to continue?')
       if not YesNo():
         return 1
-    TagAll(self.parent.repo, self.tag, self.description)
+    try:
+      TagAll(self.parent.repo, self.tag, self.description, jobs=self.parent.jobs)
+    except ParallelError as detail:
+      print(str(detail))
+      return 1
     return 0
 
 
@@ -233,7 +317,11 @@ class MetaborgRelengPush(cli.Application):
       print('This pushes commits to the remote repository, do you want to continue?')
       if not YesNo():
         return 1
-    PushAll(self.parent.repo)
+    try:
+      PushAll(self.parent.repo, jobs=self.parent.jobs)
+    except ParallelError as detail:
+      print(str(detail))
+      return 1
     return 0
 
 
@@ -254,7 +342,11 @@ class MetaborgRelengCheckout(cli.Application):
         'do you want to continue?')
       if not YesNo():
         return 1
-    CheckoutAll(self.parent.repo)
+    try:
+      CheckoutAll(self.parent.repo, jobs=self.parent.jobs)
+    except ParallelError as detail:
+      print(str(detail))
+      return 1
     return 0
 
 
@@ -266,14 +358,28 @@ class MetaborgRelengClean(cli.Application):
 
   confirmPrompt = cli.Flag(names=['-y', '--yes'], default=False,
     help='Answer warning prompts with yes automatically')
+  dryRun = cli.Flag(names=['-d', '--dryrun'], default=False,
+    help='Report how much space would be reclaimed in each submodule, without deleting anything')
+  buildOutputs = cli.Flag(names=['-b', '--build-outputs'], default=False,
+    help='Only delete untracked build output directories: {}'.format(', '.join(buildOutputDirectories)))
 
   def main(self):
-    print('Cleaning all submodules')
-    if not self.confirmPrompt:
-      print('WARNING: This will DELETE UNTRACKED FILES, do you want to continue?')
-      if not YesNoTwice():
-        return 1
-    CleanAll(self.parent.repo)
+    if self.dryRun:
+      print('Measuring untracked files in all submodules')
+    else:
+      print('Cleaning all submodules')
+      if not self.confirmPrompt:
+        if self.buildOutputs:
+          print('WARNING: This will DELETE UNTRACKED BUILD OUTPUT DIRECTORIES, do you want to continue?')
+        else:
+          print('WARNING: This will DELETE UNTRACKED FILES, do you want to continue?')
+        if not YesNoTwice():
+          return 1
+    try:
+      CleanAll(self.parent.repo, dryRun=self.dryRun, buildOutputsOnly=self.buildOutputs, jobs=self.parent.jobs)
+    except ParallelError as detail:
+      print(str(detail))
+      return 1
     return 0
 
 
@@ -300,7 +406,50 @@ class MetaborgRelengReset(cli.Application):
         print('WARNING: This will DELETE UNCOMMITED CHANGES, do you want to continue?')
         if not YesNoTwice():
           return 1
-    ResetAll(self.parent.repo, self.toRemote)
+    try:
+      ResetAll(self.parent.repo, self.toRemote, jobs=self.parent.jobs)
+    except ParallelError as detail:
+      print(str(detail))
+      return 1
+    return 0
+
+
+@MetaborgReleng.subcommand("status")
+class MetaborgRelengStatus(cli.Application):
+  """
+  Prints the branch, ahead/behind counts, and changed and untracked files of each submodule
+  """
+
+  printJson = cli.Flag(names=['-j', '--json'], default=False, help='Print the status as JSON')
+  noUntracked = cli.Flag(names=['-u', '--no-untracked'], default=False,
+    help='Do not look for untracked files, which is faster on large working trees')
+  fast = cli.Flag(names=['-f', '--fast'], default=False,
+    help="Enable git's untracked cache, speeding up repeated invocations that look for untracked files")
+
+  def main(self):
+    try:
+      statuses = StatusAll(self.parent.repo, untracked=not self.noUntracked, fast=self.fast, jobs=self.parent.jobs)
+    except ParallelError as detail:
+      print(str(detail))
+      return 1
+
+    if self.printJson:
+      print(json.dumps([status.to_json() for status in statuses], indent=2, sort_keys=True))
+      return 0
+
+    rows = [('SUBMODULE', 'BRANCH', 'AHEAD', 'BEHIND', 'CHANGED', 'UNTRACKED', 'CONFLICTED')]
+    for status in statuses:
+      if not status.initialized:
+        rows.append((status.name, '(not initialized)', '', '', '', '', ''))
+        continue
+      branch = status.branch or 'DETACHED {}'.format(status.sha[:8] if status.sha else '')
+      if status.branch and not status.upstream:
+        branch = '{} (no upstream)'.format(branch)
+      rows.append((status.name, branch, status.ahead or '', status.behind or '', status.changed or '',
+        status.untracked or '', status.conflicted or ''))
+    widths = [max(len(str(row[column])) for row in rows) for column in range(len(rows[0]))]
+    for row in rows:
+      print('  '.join(str(value).ljust(width) for value, width in zip(row, widths)).rstrip())
     return 0
 
 
@@ -310,10 +459,12 @@ class MetaborgRelengSetVersions(cli.Application):
   Sets Maven and Eclipse version numbers to given version number
   """
 
-  fromVersion = cli.SwitchAttr(names=['-f', '--from'], argtype=str, mandatory=True,
+  fromVersion = cli.SwitchAttr(names=['-f', '--from'], argtype=str, requires=['--to'],
     help='Maven version to change from')
-  toVersion = cli.SwitchAttr(names=['-t', '--to'], argtype=str, mandatory=True,
+  toVersion = cli.SwitchAttr(names=['-t', '--to'], argtype=str, requires=['--from'],
     help='Maven version to change from')
+  mappings = cli.SwitchAttr(names=['-m', '--map'], argtype=ParseVersionMapping, list=True,
+    help='Maven version mapping OLD=NEW. All mappings are applied simultaneously in a single pass')
 
   commit = cli.Flag(names=['-c', '--commit'], default=False,
     help='Commit changed files')
@@ -321,8 +472,27 @@ class MetaborgRelengSetVersions(cli.Application):
     help='Do not modify or commit files, just print operations')
   confirmPrompt = cli.Flag(names=['-y', '--yes'], default=False,
     help='Answer warning prompts with yes automatically')
+  rebuildIndex = cli.Flag(names=['--rebuild-index'], default=False,
+    help='Discard the index of version occurrences and rescan all files')
+  noIndex = cli.Flag(names=['--no-index'], default=False, excludes=['--rebuild-index'],
+    help='Do not use or update the index of version occurrences')
+  benchmark = cli.SwitchAttr(names=['--benchmark'], argtype=int, default=None, mandatory=False,
+    help='Instead of setting versions, compare streaming, cached, and full parsing POM file detection over given '
+         'number of runs')
 
   def main(self):
+    if self.benchmark:
+      numFiles, streamingTime, cachedTime, parseTime, same = benchmark_pom_detection(self.parent.repo, self.benchmark)
+      print('POM files           : {}'.format(numFiles))
+      print('Streaming detection : {:.1f}ms'.format(streamingTime * 1000))
+      print('Cached detection    : {:.1f}ms'.format(cachedTime * 1000))
+      print('Full parsing        : {:.1f}ms'.format(parseTime * 1000))
+      print('Speedup             : {:.1f}x'.format(parseTime / streamingTime if streamingTime else 0))
+      if not same:
+        print('ERROR: implementations detected different POM files')
+        return 1
+      return 0
+
     if self.confirmPrompt and not self.dryRun:
       if self.commit:
         print(
@@ -331,7 +501,79 @@ class MetaborgRelengSetVersions(cli.Application):
         print('WARNING: This will CHANGE pom.xml, MANIFEST.MF, and feature.xml files, do you want to continue?')
         if not YesNo():
           return 1
-    SetVersions(self.parent.repo, self.fromVersion, self.toVersion, self.dryRun, self.commit)
+    mappings = list(self.mappings)
+    if self.fromVersion:
+      mappings.insert(0, (self.fromVersion, self.toVersion))
+    if not mappings:
+      print('Either --from and --to, or at least one --map must be given')
+      return 1
+    try:
+      SetVersionMappings(self.parent.repo, mappings, self.dryRun, self.commit, jobs=self.parent.jobs,
+        useIndex=not self.noIndex, rebuildIndex=self.rebuildIndex)
+    except ValueError as detail:
+      print(str(detail))
+      return 1
+    return 0
+
+
+@MetaborgReleng.subcommand("check-versions")
+class MetaborgRelengCheckVersions(cli.Application):
+  """
+  Reports all Maven and Eclipse versions in files that set-versions changes, with counts per submodule and file type.
+  Returns 1 if versions that mismatch the expected version are found
+  """
+
+  expectedVersion = cli.SwitchAttr(names=['-e', '--expected'], argtype=str, mandatory=False,
+    help='Expected Maven version. Development versions and versions with the same major and minor version that differ '
+         'from this version, or from its Eclipse version, are reported as mismatches')
+  printJson = cli.Flag(names=['-j', '--json'], default=False, help='Print the report as JSON')
+
+  def main(self):
+    start = time.time()
+    try:
+      occurrences = FindVersions(self.parent.repo, jobs=self.parent.jobs)
+    except ParallelError as detail:
+      print(str(detail))
+      return 1
+    duration = time.time() - start
+
+    versions = {}
+    for occurrence in occurrences:
+      locations = versions.setdefault(occurrence.version, {})
+      key = (occurrence.submodule, occurrence.fileType.description)
+      locations[key] = locations.get(key, 0) + 1
+    mismatches = []
+    if self.expectedVersion:
+      mismatches = [occurrence for occurrence in occurrences
+        if IsVersionMismatch(occurrence.version, self.expectedVersion)]
+
+    if self.printJson:
+      print(json.dumps({
+        'expected': self.expectedVersion,
+        'versions': {version: {
+          'kind': VersionKindOf(version).value,
+          'count': sum(locations.values()),
+          'locations': [{'submodule': submodule, 'fileType': fileType, 'count': count}
+            for (submodule, fileType), count in sorted(locations.items())]
+        } for version, locations in versions.items()},
+        'mismatches': [occurrence.to_json() for occurrence in mismatches],
+      }, indent=2, sort_keys=True))
+      return 1 if mismatches else 0
+
+    numFiles = len(set(occurrence.file for occurrence in occurrences))
+    print('Found {} version strings in {} files in {:.1f}s'.format(len(occurrences), numFiles, duration))
+    for version, locations in sorted(versions.items(), key=lambda item: (-sum(item[1].values()), item[0])):
+      print('{} ({}): {}'.format(version, VersionKindOf(version).value, sum(locations.values())))
+      for (submodule, fileType), count in sorted(locations.items()):
+        print('  {:>5}  {}: {}'.format(count, submodule, fileType))
+
+    if self.expectedVersion:
+      if mismatches:
+        print('{} version strings do not match expected version {}:'.format(len(mismatches), self.expectedVersion))
+        for occurrence in mismatches:
+          print('  {}:{}: {}'.format(occurrence.file, occurrence.line, occurrence.version))
+        return 1
+      print('All versions match expected version {}'.format(self.expectedVersion))
     return 0
 
 
@@ -358,6 +600,55 @@ class MetaborgBuildShared(cli.Application):
     help='Pass quiet flag to builds',
     group='Build'
   )
+  force = cli.Flag(
+    names=['--force'], default=False,
+    help='Execute all build steps, even those whose submodules and options did not change since their last successful '
+         'execution',
+    group='Build'
+  )
+  cacheDir = cli.SwitchAttr(
+    names=['--cache-dir'], argtype=str, default=None,
+    help='Directory of the artifact cache, which may be on a shared file system. Steps whose inputs are in the cache '
+         'are restored from it instead of being executed. Disables the cache when not set',
+    group='Build'
+  )
+  cacheSize = cli.SwitchAttr(
+    names=['--cache-size'], argtype=ParseSize, default=ParseSize('50G'),
+    help='Maximum size of the artifact cache, e.g. 50G. The least recently used entries are evicted when it is exceeded. '
+         'Defaults to 50G',
+    group='Build'
+  )
+  telemetryDir = cli.SwitchAttr(
+    names=['--telemetry-dir'], argtype=str, default=None,
+    help='Directory to write a JSON telemetry report and Chrome trace of the build to, with the wall time, CPU time, '
+         'and peak memory of each build step, and to append its durations to the build history that `b history` '
+         'shows. Defaults to a directory in the .git directory of the repository',
+    group='Build'
+  )
+  noTelemetry = cli.Flag(
+    names=['--no-telemetry'], default=False,
+    excludes=['--telemetry-dir'],
+    help='Do not measure build steps',
+    group='Build'
+  )
+  buildJobs = cli.SwitchAttr(
+    names=['--build-jobs'], argtype=cli.Range(1, 256), default=1,
+    help='Maximum number of independent build steps to run concurrently. The output of each step is written to a log '
+         'file per step, and printed prefixed with the name of the step. Independent of the global --jobs switch, '
+         'since concurrent builds need far more memory than concurrent git operations',
+    group='Build'
+  )
+  buildMemoryBudget = cli.SwitchAttr(
+    names=['--memory-budget'], argtype=ParseSize, default=None,
+    help='Memory that concurrently running build steps may use together, e.g. 24G. Each step is assumed to use its '
+         'maximum JVM heap size plus a quarter. Defaults to the physical memory of this machine',
+    group='Build'
+  )
+  buildLogDir = cli.SwitchAttr(
+    names=['--log-dir'], argtype=str, default=None,
+    help='Directory to write the log files of concurrently running build steps to. Defaults to a temporary directory',
+    group='Build'
+  )
 
   strategoBootstrap = cli.Flag(
     names=['-b', '--stratego-bootstrap'], default=False,
@@ -418,6 +709,13 @@ class MetaborgBuildShared(cli.Application):
     group='Maven'
   )
 
+  mavenReactor = cli.Flag(
+    names=['--maven-reactor'], default=False,
+    help='Build adjacent Maven steps that do not depend on each other and use the same Maven settings in one Maven '
+         'reactor, paying the startup cost of Maven once. Only applies when build steps are not run concurrently',
+    group='Maven'
+  )
+
   mavenDeploy = cli.Flag(
     names=['-d', '--maven-deploy'], default=False,
     help='Deploy Maven artifacts',
@@ -531,6 +829,19 @@ class MetaborgBuildShared(cli.Application):
     builder.mavenLocalRepo = self.mavenLocalRepo
     builder.mavenCleanLocalRepo = self.mavenCleanRepo
     builder.mavenOpts = '-Xss{} -Xms{} -Xmx{}'.format(self.jvmStack, self.jvmMinHeap, self.jvmMaxHeap)
+    builder.mavenReactor = self.mavenReactor
+
+    builder.jobs = self.buildJobs
+    builder.force = self.force
+    if self.noTelemetry:
+      builder.telemetryDir = None
+    elif self.telemetryDir:
+      builder.telemetryDir = self.telemetryDir
+    builder.memoryBudget = self.buildMemoryBudget
+    builder.logDir = self.buildLogDir
+    builder.artifactCacheDir = buildProps.get('cache.dir', self.cacheDir)
+    cacheSize = buildProps.get('cache.size')
+    builder.artifactCacheSize = ParseSize(cacheSize) if cacheSize else self.cacheSize
 
     if buildProps.get_bool('maven.deploy.enable', self.mavenDeploy):
       mavenDeployIdentifier = buildProps.get('maven.deploy.id', self.mavenDeployIdentifier)
@@ -738,6 +1049,7 @@ class MetaborgRelengRelease(MetaborgBuildShared):
     release.interactive = not self.nonInteractive
     release.dryRun = self.dryRun
     release.createEclipseInstances = not self.noEclipseInstances
+    release.jobs = self.parent.jobs
 
     if self.revertRelease:
       print(
@@ -764,6 +1076,157 @@ class MetaborgRelengRelease(MetaborgBuildShared):
     return 0
 
 
+@MetaborgReleng.subcommand("cache")
+class MetaborgRelengCache(cli.Application):
+  """
+  Manages the artifact cache of build steps
+  """
+
+  cacheDir = cli.SwitchAttr(names=['-d', '--dir'], argtype=str, default=None,
+    help="Directory of the artifact cache. Defaults to the 'cache.dir' property")
+
+  def main(self):
+    if not self.nested_command:
+      print('Error: no command given')
+      self.help()
+      return 1
+    return 0
+
+  def cache(self):
+    cacheDir = self.cacheDir or self.parent.buildProps.get('cache.dir')
+    if not cacheDir:
+      print('Error: no artifact cache directory given, set --dir or the cache.dir property')
+      return None
+    return ArtifactCache(cacheDir)
+
+
+@MetaborgRelengCache.subcommand("stats")
+class MetaborgRelengCacheStats(cli.Application):
+  """
+  Shows the number of entries and size of the artifact cache
+  """
+
+  def main(self):
+    cache = self.parent.cache()
+    if not cache:
+      return 1
+    print(cache.stats())
+    return 0
+
+
+@MetaborgRelengCache.subcommand("prune")
+class MetaborgRelengCachePrune(cli.Application):
+  """
+  Evicts the least recently used entries from the artifact cache
+  """
+
+  maxSize = cli.SwitchAttr(names=['-s', '--max-size'], argtype=ParseSize, default=None,
+    help='Evict least recently used entries until the cache is at most this size, e.g. 20G')
+  maxAge = cli.SwitchAttr(names=['-a', '--max-age'], argtype=int, default=None,
+    help='Evict entries that were not used for this number of days')
+
+  def main(self):
+    cache = self.parent.cache()
+    if not cache:
+      return 1
+    if self.maxSize is None and self.maxAge is None:
+      print('Error: set --max-size or --max-age')
+      return 1
+    maxAge = self.maxAge * 24 * 60 * 60 if self.maxAge is not None else None
+    evicted, evictedSize = cache.prune(self.maxSize, maxAge)
+    print('Evicted {} entries, freeing {}'.format(evicted, FormatSize(evictedSize)))
+    print(cache.stats())
+    return 0
+
+
+@MetaborgReleng.subcommand("history")
+class MetaborgRelengHistory(cli.Application):
+  """
+  Shows the trends of the durations of build steps, and slowdowns with the submodule changes that coincide with them
+  """
+
+  telemetryDir = cli.SwitchAttr(names=['-d', '--dir'], argtype=str, default=None,
+    help='Telemetry directory that contains the build history. Defaults to a directory in the .git directory of the '
+         'repository')
+  builds = cli.SwitchAttr(names=['-n', '--builds'], argtype=cli.Range(1, 1000), default=20,
+    help='Number of most recent executions of each step to show the trend of')
+  modules = cli.Flag(names=['-m', '--modules'], default=False,
+    help='Also show trends and slowdowns of Maven modules and Gradle tasks')
+  host = cli.SwitchAttr(names=['-H', '--host'], argtype=str, default=None,
+    help='Only use builds on the host with this name. Defaults to this host')
+  allHosts = cli.Flag(names=['--all-hosts'], default=False, excludes=['--host'],
+    help='Use builds on all hosts, instead of only comparing builds on the same host')
+  window = cli.SwitchAttr(names=['-w', '--window'], argtype=cli.Range(2, 1000), default=10,
+    help='Number of executions of a step in the rolling baseline that recent executions are compared against')
+  recent = cli.SwitchAttr(names=['--recent'], argtype=cli.Range(1, 1000), default=3,
+    help='Number of consecutive executions of a step that must be slower than the baseline')
+  threshold = cli.SwitchAttr(names=['-t', '--threshold'], argtype=float, default=10.0,
+    help='Minimum slowdown, in percent, of the median of recent executions over the median of the baseline')
+  alpha = cli.SwitchAttr(names=['--alpha'], argtype=float, default=0.01,
+    help='Significance level of the test of whether recent executions are slower than the baseline')
+
+  def main(self):
+    repo = self.parent.repo
+    telemetryDir = self.telemetryDir or DefaultTelemetryLocation(repo)
+    hostname = None if self.allHosts else self.host or socket.gethostname()
+    entries = BuildHistory(HistoryLocation(telemetryDir)).entries(hostname)
+    if not entries:
+      print('No build history{} in {}'.format(' of host {}'.format(hostname) if hostname else '', telemetryDir))
+      return 0
+
+    print('Build history of {} builds{}, from {} to {}'.format(len(entries),
+      ' on {}'.format(hostname) if hostname else '', FormatTime(entries[0]['time']), FormatTime(entries[-1]['time'])))
+    print()
+
+    names = []
+    for entry in entries:
+      names.extend(('step', name) for name in entry['steps'] if ('step', name) not in names)
+      if self.modules:
+        names.extend(('module', name) for name in entry['modules'] if ('module', name) not in names)
+    if not names:
+      print('No executed steps')
+      return 0
+
+    width = max(len(name) for _, name in names)
+    print('{:<{width}}  {:>5}  {:>8}  {:>8}  {}'.format('Name', 'Runs', 'Last', 'Median', 'Trend', width=width))
+    regressions = []
+    for kind, name in names:
+      durations = [duration for _, duration in Durations(entries, kind, name)]
+      if not durations:
+        continue
+      recent = durations[-self.builds:]
+      print('{:<{width}}  {:>5}  {:>7.1f}s  {:>7.1f}s  {}'.format(name, len(durations), durations[-1],
+        statistics.median(recent), Sparkline(recent), width=width))
+      regressions.extend(FindRegressions(entries, kind, name, self.window, self.recent, self.threshold / 100,
+        self.alpha))
+
+    print()
+    if not regressions:
+      print('No slowdowns found')
+      return 0
+
+    paths = dict(SubmodulePaths(repo))
+    regressions.sort(key=lambda regression: entries[regression.entryIndex]['time'])
+    print('Slowdowns:')
+    for regression in regressions:
+      entry = entries[regression.entryIndex]
+      print('  {} {} {}: {:.1f}s -> {:.1f}s (+{:.0f}%, p={:.3f}), qualifier {}'.format(FormatTime(entry['time']),
+        regression.kind, regression.name, regression.baselineMedian, regression.recentMedian,
+        regression.slowdown * 100, regression.pValue, entry['qualifier']))
+      changes = SubmoduleChanges(entries[regression.previousIndex], entry)
+      if not changes:
+        print('    No submodule SHA changes')
+        continue
+      print('    Coinciding submodule changes:')
+      for name, oldSha, newSha in changes:
+        count = None
+        if oldSha and newSha and name in paths:
+          count = CommitCount(os.path.join(repo.working_tree_dir, paths[name]), oldSha, newSha)
+        print('      {:<24} {}..{}{}'.format(name, oldSha[:7] if oldSha else 'added', newSha[:7] if newSha else 'removed',
+          ' ({} commits)'.format(count) if count is not None else ''))
+    return 0
+
+
 @MetaborgReleng.subcommand("bootstrap")
 class MetaborgRelengBootstrap(cli.Application):
   """
@@ -1020,25 +1483,77 @@ class MetaborgRelengQualifier(cli.Application):
   Prints the current qualifier based on the current branch and latest commit date in all submodules.
   """
 
+  benchmark = cli.SwitchAttr(names=['--benchmark'], argtype=int, default=None, mandatory=False,
+    help='Instead of printing the qualifier, compare the fast and the GitPython implementation over given number of '
+         'runs')
+
   def main(self):
-    print(create_qualifier(self.parent.repo))
+    repo = self.parent.repo
+    if self.benchmark:
+      fastTime, slowTime, same = benchmark_qualifier(repo, self.benchmark)
+      print('Fast implementation     : {:.1f}ms'.format(fastTime * 1000))
+      print('GitPython implementation: {:.1f}ms'.format(slowTime * 1000))
+      print('Speedup                 : {:.1f}x'.format(slowTime / fastTime if fastTime else 0))
+      if not same:
+        print('ERROR: implementations produced different qualifiers')
+        return 1
+      return 0
+    print(create_qualifier(repo))
 
 
 @MetaborgReleng.subcommand("changed")
 class MetaborgRelengChanged(cli.Application):
   """
   Returns 0 and prints the qualifer if repository has changed since last invocation of this command, based on the
-  current branch and latest commit date in all submodules. Returns 1 otherwise.
+  current branch and the commits checked out in the repository and all submodules. Returns 1 otherwise.
   """
 
   destination = cli.SwitchAttr(names=['-d', '--destination'], argtype=str, mandatory=False,
-    default='.qualifier', help='Path to read/write the last qualifier to')
+    default='.qualifier', help='Path to read/write the fingerprint of the last invocation to')
 
   forceChange = cli.Flag(names=['-f', '--force-change'], default=False, help='Force a change, always return 0')
+  printJson = cli.Flag(names=['-j', '--json'], default=False,
+    help='Print the qualifier and which submodules changed as JSON, whether or not the repository changed')
+
+  remote = cli.Flag(names=['--remote'], default=False,
+    help='Query the remote branch tips of the repository and all submodules with git ls-remote instead of inspecting '
+         'the working tree, and print the branches that changed instead of a qualifier')
+  branches = cli.SwitchAttr(names=['-b', '--branch'], argtype=str, list=True, requires=['--remote'],
+    help='Branch of the repository to query. Defaults to the current branch')
+  remoteDestination = cli.SwitchAttr(names=['--remote-destination'], argtype=str, mandatory=False,
+    default='.qualifier-remote', requires=['--remote'],
+    help='Path to read/write the remote fingerprints of the last invocation to')
 
   def main(self):
-    changed, qualifier = repo_changed(self.parent.repo, self.destination)
-    if self.forceChange or changed:
-      print(qualifier)
-      return 0
-    return 1
+    if self.remote:
+      return self.main_remote()
+    changes = repo_changes(self.parent.repo, self.destination)
+    changed = self.forceChange or changes.changed
+    if self.printJson:
+      print(json.dumps(changes.to_json(), indent=2, sort_keys=True))
+    elif changed:
+      if changes.changed_submodules:
+        print('Changed submodules: {}'.format(', '.join(changes.changed_submodules)), file=sys.stderr)
+      print(changes.qualifier)
+    return 0 if changed else 1
+
+  def main_remote(self):
+    repo = self.parent.repo
+    branches = self.branches or [Branch(repo)]
+    try:
+      changesPerBranch = remote_changes(repo, branches, self.remoteDestination, self.destination,
+        jobs=self.parent.jobs)
+    except (RuntimeError, GitCommandError) as detail:
+      print(str(detail), file=sys.stderr)
+      return 2
+    changedBranches = [branch for branch in branches if self.forceChange or changesPerBranch[branch].changed]
+    if self.printJson:
+      print(json.dumps({branch: changes.to_json() for branch, changes in changesPerBranch.items()}, indent=2,
+        sort_keys=True))
+    else:
+      for branch in changedBranches:
+        changedSubmodules = changesPerBranch[branch].changed_submodules
+        if changedSubmodules:
+          print('Changed submodules on {}: {}'.format(branch, ', '.join(changedSubmodules)), file=sys.stderr)
+        print(branch)
+    return 0 if changedBranches else 1
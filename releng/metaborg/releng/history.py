@@ -0,0 +1,239 @@
+import json
+import math
+import os
+import platform
+import socket
+import statistics
+import subprocess
+import time
+
+historyFileName = 'history.jsonl'
+
+
+def HistoryLocation(telemetryDir):
+  return os.path.join(telemetryDir, historyFileName)
+
+
+def HostInfo():
+  """
+  Returns a description of this machine, used to only compare builds that ran on the same machine.
+  """
+  try:
+    memory = os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+  except (AttributeError, ValueError, OSError):
+    memory = None
+  return {
+    'hostname' : socket.gethostname(),
+    'platform' : platform.platform(),
+    'processor': platform.machine(),
+    'cpus'     : os.cpu_count(),
+    'memory'   : memory,
+  }
+
+
+def HistoryEntry(report, submodules, host=None, succeeded=True):
+  """
+  Creates a history entry from the telemetry report of a build, the (name, path, SHA) tuples of the submodules that it
+  built, and the host it ran on. Only keeps the durations of steps and modules, which keeps the history small enough to
+  append to after every build.
+  """
+  metadata = report.get('metadata', {})
+  steps = {}
+  modules = {}
+  for step in report.get('steps', []):
+    steps[step['name']] = {'status': step['status'], 'duration': step['duration'], 'userTime': step['userTime'],
+                           'peakRss': step['peakRss']}
+    for module in step.get('modules', []):
+      if module['duration'] is not None and module['status'] == 'SUCCESS':
+        modules['{}/{}'.format(step['name'], module['name'])] = module['duration']
+  return {
+    'time'      : report['start'],
+    'duration'  : report['duration'],
+    'succeeded' : succeeded,
+    'targets'   : metadata.get('targets'),
+    'qualifier' : metadata.get('qualifier'),
+    'jobs'      : metadata.get('jobs'),
+    'host'      : host or HostInfo(),
+    'submodules': {name: sha for name, _, sha in submodules},
+    'steps'     : steps,
+    'modules'   : modules,
+  }
+
+
+class BuildHistory(object):
+  """
+  Append-only history of the durations of build steps and modules, stored as one JSON object per line. Each build
+  appends a single line in one write, such that concurrent builds do not corrupt the history.
+  """
+
+  def __init__(self, location):
+    self.location = location
+
+  def append(self, entry):
+    os.makedirs(os.path.dirname(self.location) or '.', exist_ok=True)
+    line = json.dumps(entry, sort_keys=True) + '\n'
+    with open(self.location, mode='a') as file:
+      file.write(line)
+
+  def entries(self, hostname=None):
+    """
+    Returns all entries, oldest first, skipping lines that cannot be parsed. Only returns entries of builds on the host
+    with given hostname, if set.
+    """
+    entries = []
+    try:
+      with open(self.location) as file:
+        for line in file:
+          try:
+            entry = json.loads(line)
+          except ValueError:
+            continue
+          if hostname and entry.get('host', {}).get('hostname') != hostname:
+            continue
+          entries.append(entry)
+    except FileNotFoundError:
+      return entries
+    entries.sort(key=lambda e: e['time'])
+    return entries
+
+
+def Durations(entries, kind, name):
+  """
+  Returns (entry index, duration) pairs of all entries in which step or module name was executed successfully. Steps
+  that were skipped, restored from the artifact cache, or whose Maven build ran in a Maven reactor (status 'reactor')
+  are left out, since their duration says nothing about how long the step takes to build.
+  """
+  durations = []
+  for index, entry in enumerate(entries):
+    if kind == 'step':
+      step = entry['steps'].get(name)
+      if step and step['status'] == 'executed':
+        durations.append((index, step['duration']))
+    else:
+      duration = entry['modules'].get(name)
+      if duration is not None:
+        durations.append((index, duration))
+  return durations
+
+
+def MannWhitneyGreater(samples, baseline):
+  """
+  Returns the p-value of the one-sided Mann-Whitney U test of whether samples tend to be greater than baseline, using
+  the normal approximation with a correction for ties. Build times are not normally distributed, and have outliers
+  caused by other load on the machine, which the rank-based test is robust against.
+  """
+  n1, n2 = len(samples), len(baseline)
+  combined = sorted([(value, 0) for value in samples] + [(value, 1) for value in baseline])
+  ranks = [0.0] * len(combined)
+  tieTerm = 0
+  i = 0
+  while i < len(combined):
+    j = i
+    while j + 1 < len(combined) and combined[j + 1][0] == combined[i][0]:
+      j += 1
+    for k in range(i, j + 1):
+      ranks[k] = (i + j) / 2 + 1
+    ties = j - i + 1
+    tieTerm += ties ** 3 - ties
+    i = j + 1
+  rankSum = sum(rank for rank, (_, group) in zip(ranks, combined) if group == 0)
+  u = rankSum - n1 * (n1 + 1) / 2
+  n = n1 + n2
+  variance = n1 * n2 / 12 * ((n + 1) - tieTerm / (n * (n - 1)))
+  if variance <= 0:
+    return 1.0
+  z = (u - n1 * n2 / 2 - 0.5) / math.sqrt(variance)
+  return 0.5 * math.erfc(z / math.sqrt(2))
+
+
+class Regression(object):
+  def __init__(self, kind, name, entryIndex, previousIndex, baseline, recent, pValue):
+    self.kind = kind
+    self.name = name
+    # Index of the first slow build, and of the last build in the baseline before it.
+    self.entryIndex = entryIndex
+    self.previousIndex = previousIndex
+    self.baseline = baseline
+    self.recent = recent
+    self.pValue = pValue
+
+  @property
+  def baselineMedian(self):
+    return statistics.median(self.baseline)
+
+  @property
+  def recentMedian(self):
+    return statistics.median(self.recent)
+
+  @property
+  def slowdown(self):
+    return self.recentMedian / self.baselineMedian - 1
+
+
+def FindRegressions(entries, kind, name, window=10, recent=3, threshold=0.1, alpha=0.01):
+  """
+  Finds slowdowns of step or module name in entries. Compares the durations of each run of recent consecutive builds
+  against a rolling baseline of the window builds before them, and reports a regression when the recent builds are
+  significantly slower according to a Mann-Whitney U test at significance level alpha, and their median is at least
+  threshold slower than the median of the baseline. After a regression, the baseline is rebuilt from the slower builds,
+  such that a single slowdown is reported once.
+  """
+  durations = Durations(entries, kind, name)
+  regressions = []
+  i = window
+  while i + recent <= len(durations):
+    baseline = [duration for _, duration in durations[i - window:i]]
+    samples = [duration for _, duration in durations[i:i + recent]]
+    baselineMedian = statistics.median(baseline)
+    if baselineMedian > 0 and statistics.median(samples) >= baselineMedian * (1 + threshold):
+      pValue = MannWhitneyGreater(samples, baseline)
+      if pValue < alpha:
+        regressions.append(Regression(kind, name, durations[i][0], durations[i - 1][0], baseline, samples, pValue))
+        i += window
+        continue
+    i += 1
+  return regressions
+
+
+def SubmoduleChanges(before, after):
+  """
+  Returns (name, old SHA, new SHA) triples of submodules whose SHA differs between history entries before and after.
+  The old or new SHA is None for submodules that were added or removed.
+  """
+  changes = []
+  oldShas = before['submodules']
+  newShas = after['submodules']
+  for name in sorted(set(oldShas) | set(newShas)):
+    if oldShas.get(name) != newShas.get(name):
+      changes.append((name, oldShas.get(name), newShas.get(name)))
+  return changes
+
+
+def CommitCount(workingDir, oldSha, newSha):
+  """
+  Returns the number of commits between oldSha and newSha in the repository at workingDir, or None if it cannot be
+  determined, for example because either commit has not been fetched.
+  """
+  try:
+    output = subprocess.check_output(['git', 'rev-list', '--count', '{}..{}'.format(oldSha, newSha)], cwd=workingDir,
+      stderr=subprocess.DEVNULL)
+  except (subprocess.CalledProcessError, OSError):
+    return None
+  return int(output.decode('utf-8').strip())
+
+
+def Sparkline(values):
+  """
+  Returns values as a string of block characters, scaled between the smallest and largest value.
+  """
+  blocks = '▁▂▃▄▅▆▇█'
+  if not values:
+    return ''
+  low, high = min(values), max(values)
+  if high == low:
+    return blocks[0] * len(values)
+  return ''.join(blocks[int((value - low) / (high - low) * (len(blocks) - 1))] for value in values)
+
+
+def FormatTime(timestamp):
+  return time.strftime('%Y-%m-%d %H:%M', time.localtime(timestamp))
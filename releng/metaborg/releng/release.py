@@ -5,7 +5,8 @@ from os import path
 import git
 
 from metaborg.releng.versions import SetVersions
-from metaborg.util.git import CheckoutAll, UpdateAll, TagAll, PushAll
+from metaborg.util.git import CheckoutAll, UpdateAll, TagAll, PushAll, Deepen, DirtySubmodules, InvalidateSnapshot
+from metaborg.util.parallel import ParallelError
 from metaborg.util.prompt import YesNo
 
 
@@ -23,6 +24,7 @@ class MetaborgRelease(object):
 
     self.dryRun = False
     self.interactive = True
+    self.jobs = None
 
   def release(self):
     with shelve.open(self.__shelve_location()) as db:
@@ -39,11 +41,11 @@ class MetaborgRelease(object):
 
         try:
           developBranch.checkout()
-          CheckoutAll(self.repo)
+          CheckoutAll(self.repo, jobs=self.jobs)
           self.repo.remotes.origin.pull()
-          CheckoutAll(self.repo)  # Check out again in case .gitmodules was changed.
-          UpdateAll(self.repo)
-        except git.exc.GitCommandError as detail:
+          CheckoutAll(self.repo, jobs=self.jobs)  # Check out again in case .gitmodules was changed.
+          UpdateAll(self.repo, jobs=self.jobs)
+        except (git.exc.GitCommandError, ParallelError) as detail:
           print('ERROR: preparing development branch failed')
           print(str(detail))
           if not self.interactive:
@@ -63,11 +65,11 @@ class MetaborgRelease(object):
 
         try:
           releaseBranch.checkout()
-          CheckoutAll(self.repo)
+          CheckoutAll(self.repo, jobs=self.jobs)
           self.repo.remotes.origin.pull()
-          CheckoutAll(self.repo)  # Check out again in case .gitmodules was changed.
-          UpdateAll(self.repo)
-        except git.exc.GitCommandError as detail:
+          CheckoutAll(self.repo, jobs=self.jobs)  # Check out again in case .gitmodules was changed.
+          UpdateAll(self.repo, jobs=self.jobs)
+        except (git.exc.GitCommandError, ParallelError) as detail:
           print('ERROR: preparing release branch failed')
           print(str(detail))
           if not self.interactive:
@@ -121,6 +123,7 @@ class MetaborgRelease(object):
           if not self.interactive:
             raise Exception('Error while in non-interactive mode, stopping')
 
+        InvalidateSnapshot(self.repo)
         db['state'] = 3
         if self.interactive:
           print('Please fix any conflicts and commit all changes (if any) in the root repository, then continue')
@@ -149,6 +152,7 @@ class MetaborgRelease(object):
             else:
               submoduleRelBranch = submoduleRelBranches[submodule.name]
 
+            Deepen(submodule.name, subrepo)
             print('Merging branch {} into submodule {}'.format(submoduleDevBranch, submodule.name))
             # Use merging strategy 3 from http://stackoverflow.com/a/27338013/499240 to make release branch identical to
             # development branch, while keeping correct parent order.
@@ -163,6 +167,7 @@ class MetaborgRelease(object):
             print(str(detail))
             if not self.interactive:
               raise Exception('Error while in non-interactive mode, stopping')
+        InvalidateSnapshot(self.repo)
         db['state'] = 4
 
         if self.interactive:
@@ -171,11 +176,7 @@ class MetaborgRelease(object):
           Step4()
 
       def Step4():
-        dirtyRepos = []
-        for submodule in self.repo.submodules:
-          subrepo = submodule.module()
-          if subrepo.is_dirty():
-            dirtyRepos.append(submodule.name)
+        dirtyRepos = DirtySubmodules(self.repo)
         if len(dirtyRepos) > 0:
           print('ERROR: uncommitted changes in submodules {}'.format(dirtyRepos))
           if not self.interactive:
@@ -189,7 +190,8 @@ class MetaborgRelease(object):
 
         print('Setting versions')
         try:
-          SetVersions(self.repo, self.curDevelopVersion, self.nextReleaseVersion, dryRun=False, commit=True)
+          SetVersions(self.repo, self.curDevelopVersion, self.nextReleaseVersion, dryRun=False, commit=True,
+            jobs=self.jobs)
         except Exception as detail:
           print('ERROR: Setting versions failed')
           print(str(detail))
@@ -243,9 +245,9 @@ class MetaborgRelease(object):
 
         print('Creating tag {}'.format(tagName))
         try:
-          TagAll(self.repo, tagName, tagDescription)
+          TagAll(self.repo, tagName, tagDescription, jobs=self.jobs)
           self.repo.create_tag(path=tagName, message=tagDescription)
-        except git.exc.GitCommandError as detail:
+        except (git.exc.GitCommandError, ParallelError) as detail:
           print('ERROR: creating tag failed')
           print(str(detail))
           if not self.interactive:
@@ -261,14 +263,14 @@ class MetaborgRelease(object):
         try:
           if not self.dryRun:
             print('Pushing changes')
-            PushAll(self.repo)
-            PushAll(self.repo, tags=True)
+            PushAll(self.repo, jobs=self.jobs)
+            PushAll(self.repo, jobs=self.jobs, tags=True)
             remote = self.repo.remote('origin')
             remote.push()
             remote.push(tags=True)
           else:
             print('Performing dry run, not pushing')
-        except git.exc.GitCommandError as detail:
+        except (git.exc.GitCommandError, ParallelError) as detail:
           print('ERROR: pushing changes failed')
           print(str(detail))
           if not self.interactive:
@@ -283,8 +285,8 @@ class MetaborgRelease(object):
 
         try:
           developBranch.checkout()
-          CheckoutAll(self.repo)
-        except git.exc.GitCommandError as detail:
+          CheckoutAll(self.repo, jobs=self.jobs)
+        except (git.exc.GitCommandError, ParallelError) as detail:
           print('ERROR: switching to development branch failed')
           print(str(detail))
           if not self.interactive:
@@ -300,7 +302,8 @@ class MetaborgRelease(object):
             'Step 10: for each submodule: set version from the current development version to the next development version')
 
           print('Setting versions')
-          SetVersions(self.repo, self.curDevelopVersion, self.nextDevelopVersion, dryRun=False, commit=True)
+          SetVersions(self.repo, self.curDevelopVersion, self.nextDevelopVersion, dryRun=False, commit=True,
+            jobs=self.jobs)
 
           print('Updating submodule revisions')
           try:
@@ -328,12 +331,12 @@ class MetaborgRelease(object):
         try:
           if not self.dryRun:
             print('Pushing changes')
-            PushAll(self.repo)
+            PushAll(self.repo, jobs=self.jobs)
             remote = self.repo.remote('origin')
             remote.push()
           else:
             print('Performing dry run, not pushing')
-        except git.exc.GitCommandError as detail:
+        except (git.exc.GitCommandError, ParallelError) as detail:
           print('ERROR: pushing changes failed')
           print(str(detail))
           if not self.interactive:
@@ -374,7 +377,7 @@ class MetaborgRelease(object):
 
     releaseBranch = self.repo.heads[self.releaseBranchName]
     releaseBranch.checkout()
-    CheckoutAll(self.repo)
+    CheckoutAll(self.repo, jobs=self.jobs)
     for submodule in self.repo.submodules:
       module = submodule.module()
       resetRepo(module, submodule.name)
@@ -382,7 +385,7 @@ class MetaborgRelease(object):
 
     developBranch = self.repo.heads[self.developBranchName]
     developBranch.checkout()
-    CheckoutAll(self.repo)
+    CheckoutAll(self.repo, jobs=self.jobs)
     for submodule in self.repo.submodules:
       module = submodule.module()
       resetRepo(module, submodule.name)
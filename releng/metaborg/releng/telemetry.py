@@ -0,0 +1,377 @@
+import json
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+  import resource
+except ImportError:
+  resource = None
+
+# Environment variable that tags the child processes of a build step with the name of that step.
+stepEnvironmentVariable = 'RELENG_BUILD_STEP'
+
+_procDir = '/proc'
+
+# Gradle init script that prints the duration of each task, since Gradle does not print them itself.
+_gradleTaskPrefix = 'releng-task-time'
+_gradleInitScript = '''
+def relengTaskStarts = [:]
+gradle.taskGraph.beforeTask { task -> relengTaskStarts[task.path] = System.nanoTime() }
+gradle.taskGraph.afterTask { task, state ->
+  def start = relengTaskStarts.remove(task.path)
+  if(start != null) {
+    def status = state.failure ? 'FAILED' : state.skipped ? 'SKIPPED' : state.upToDate ? 'UP-TO-DATE' : 'SUCCESS'
+    println "%s ${task.path} ${(System.nanoTime() - start).intdiv(1000000)} ${status}"
+  }
+}
+''' % _gradleTaskPrefix
+_gradleTaskRegex = re.compile(r'^{} (\S+) (\d+) (\S+)$'.format(_gradleTaskPrefix))
+
+_mavenSummaryStartRegex = re.compile(r'^\[INFO\] Reactor Summary')
+_mavenSummaryEndRegex = re.compile(r'^\[INFO\] BUILD (SUCCESS|FAILURE)')
+_mavenModuleRegex = re.compile(r'^\[INFO\] (\S.*?)\s\.*\s*(SUCCESS|FAILURE|SKIPPED)(?: \[\s*([^\]]+)\])?\s*$')
+
+
+def DefaultTelemetryLocation(repo):
+  return os.path.join(repo.git_dir, 'metaborg-build-telemetry')
+
+
+class StepMeasurement(object):
+  def __init__(self, name, thread):
+    self.name = name
+    self.thread = thread
+    self.status = 'executed'
+    self.start = time.time()
+    self.end = None
+    self.userTime = None
+    self.systemTime = None
+    self.peakRss = None
+    # Whether another measurement ran during this measurement, which makes resource usage of children ambiguous.
+    self.overlapped = False
+    # Last observed (user, system) CPU time of each process of this step, keyed by (pid, start time).
+    self.processes = {}
+    # Maven modules and Gradle tasks that the step built.
+    self.modules = []
+
+  @property
+  def duration(self):
+    return (self.end or time.time()) - self.start
+
+  def to_json(self):
+    return {
+      'name'      : self.name,
+      'status'    : self.status,
+      'start'     : self.start,
+      'end'       : self.end,
+      'duration'  : self.duration,
+      'userTime'  : self.userTime,
+      'systemTime': self.systemTime,
+      'peakRss'   : self.peakRss,
+      'modules'   : [module.to_json() for module in self.modules],
+    }
+
+
+class ModuleTiming(object):
+  def __init__(self, name, tool, status, duration):
+    self.name = name
+    self.tool = tool
+    self.status = status
+    self.duration = duration
+
+  def to_json(self):
+    return {'name': self.name, 'tool': self.tool, 'status': self.status, 'duration': self.duration}
+
+
+class OutputTimings(object):
+  """
+  Extracts the durations of Maven modules from the reactor summary, and of Gradle tasks from the output of the
+  Gradle init script, from the output lines of a build step as they are streamed. Adds them to the modules of given
+  measurement.
+  """
+
+  def __init__(self, measurement):
+    self.measurement = measurement
+    self.inMavenSummary = False
+
+  def feed(self, line):
+    line = line.rstrip()
+    if self.inMavenSummary:
+      if _mavenSummaryEndRegex.match(line):
+        self.inMavenSummary = False
+        return
+      match = _mavenModuleRegex.match(line)
+      if match:
+        name, status, duration = match.groups()
+        self.measurement.modules.append(ModuleTiming(name, 'maven', status, ParseMavenDuration(duration)))
+    elif _mavenSummaryStartRegex.match(line):
+      self.inMavenSummary = True
+    else:
+      match = _gradleTaskRegex.match(line)
+      if match:
+        path, milliseconds, status = match.groups()
+        self.measurement.modules.append(ModuleTiming(path, 'gradle', status, int(milliseconds) / 1000))
+
+
+def ParseMavenDuration(text):
+  """
+  Parses a duration from a Maven reactor summary into seconds, in the formats of Maven 3.0 to 3.3 (12.345s, 1:02.345s)
+  and later (12.345 s, 01:02 min, 01:02 h). Returns None if text is None or in an unknown format.
+  """
+  if not text:
+    return None
+  match = re.match(r'^([\d:.]+)\s*(s|min|h)$', text.strip())
+  if not match:
+    return None
+  value, unit = match.groups()
+  try:
+    parts = [float(part) for part in value.split(':')]
+  except ValueError:
+    return None
+  seconds = 0
+  for part in parts:
+    seconds = seconds * 60 + part
+  if unit == 'min' and len(parts) == 1:
+    seconds *= 60
+  elif unit == 'h':
+    seconds *= 60 if len(parts) > 1 else 60 * 60
+  return seconds
+
+
+def WriteGradleInitScript(directory):
+  """
+  Writes the Gradle init script that prints the duration of each task to directory, creating it if it does not exist,
+  and returns its location.
+  """
+  os.makedirs(directory, exist_ok=True)
+  location = os.path.join(directory, 'releng-task-times.gradle')
+  with open(location, mode='w') as file:
+    file.write(_gradleInitScript)
+  return location
+
+
+class BuildTelemetry(object):
+  """
+  Measures the wall time, and the CPU time and peak resident set size of the child process trees, of build steps. Child
+  processes are attributed to a step by the stepEnvironmentVariable environment variable of the topmost child process,
+  which steps set in the environment of the processes they start. Process trees are sampled from /proc at an interval
+  from a background thread, which is cheap enough to always enable. Sampling misses the CPU time that a process uses
+  after the last sample before it exits, so when no other step ran concurrently, the exact CPU time of children is
+  taken from getrusage instead.
+  """
+
+  def __init__(self, metadata=None, interval=0.5):
+    # Description of the build, such as its targets, written to the report.
+    self.metadata = metadata or {}
+    self.interval = interval
+    self.start = time.time()
+    self.end = None
+    self.measurements = []
+    self.memorySamples = []
+    self.lock = threading.Lock()
+    self.active = []
+    self.threads = {}
+    self.stopped = threading.Event()
+    self.sampler = None
+    self.clockTicks = _sysconf('SC_CLK_TCK')
+    self.pageSize = _sysconf('SC_PAGE_SIZE')
+
+  def __enter__(self):
+    if os.path.isdir(_procDir) and self.clockTicks and self.pageSize:
+      self.sampler = threading.Thread(target=self.__run, daemon=True)
+      self.sampler.start()
+    return self
+
+  def __exit__(self, *_):
+    self.stopped.set()
+    if self.sampler:
+      self.sampler.join()
+    self.end = time.time()
+
+  @contextmanager
+  def measure(self, name):
+    """
+    Measures the step with given name while inside the context. Yields the measurement, whose status can be changed to
+    describe how the step was executed. The status becomes 'failed' when the context raises an exception.
+    """
+    thread = threading.get_ident()
+    with self.lock:
+      measurement = StepMeasurement(name, self.threads.setdefault(thread, len(self.threads)))
+      for other in self.active:
+        other.overlapped = True
+      measurement.overlapped = bool(self.active)
+      self.active.append(measurement)
+      self.measurements.append(measurement)
+    usageBefore = _children_usage()
+    try:
+      yield measurement
+    except BaseException:
+      measurement.status = 'failed'
+      raise
+    finally:
+      usageAfter = _children_usage()
+      with self.lock:
+        self.active.remove(measurement)
+        measurement.end = time.time()
+        if measurement.processes:
+          measurement.userTime = sum(user for user, _ in measurement.processes.values())
+          measurement.systemTime = sum(system for _, system in measurement.processes.values())
+        if usageBefore and usageAfter and not measurement.overlapped:
+          measurement.userTime = usageAfter.ru_utime - usageBefore.ru_utime
+          measurement.systemTime = usageAfter.ru_stime - usageBefore.ru_stime
+        measurement.processes = {}
+
+  def __run(self):
+    # Environment variables of processes never change, cache them by pid and start time.
+    tags = {}
+    while not self.stopped.wait(self.interval):
+      with self.lock:
+        active = {measurement.name: measurement for measurement in self.active}
+      if not active:
+        continue
+      processes = _process_tree(os.getpid())
+      rss = {}
+      for key, (topmost, user, system, residentPages) in processes.items():
+        # The environment of a process is only known after it executed its program, retry until it is tagged.
+        if not tags.get(topmost):
+          tags[topmost] = _process_tag(topmost[0])
+        measurement = active.get(tags[topmost])
+        if not measurement:
+          continue
+        measurement.processes[key] = (user / self.clockTicks, system / self.clockTicks)
+        rss[measurement.name] = rss.get(measurement.name, 0) + residentPages * self.pageSize
+      with self.lock:
+        for name, value in rss.items():
+          measurement = active[name]
+          measurement.peakRss = max(measurement.peakRss or 0, value)
+        self.memorySamples.append((time.time(), rss))
+
+  def to_json(self):
+    return {
+      'metadata'  : self.metadata,
+      'start'     : self.start,
+      'end'       : self.end,
+      'duration'  : (self.end or time.time()) - self.start,
+      'steps'     : [measurement.to_json() for measurement in self.measurements],
+    }
+
+  def to_trace(self):
+    """
+    Returns the measurements as Chrome trace events, which can be opened in chrome://tracing or Perfetto. Steps that
+    ran concurrently are shown on separate rows, and the memory usage of steps is shown as a counter.
+    """
+
+    def Microseconds(timestamp):
+      return int((timestamp - self.start) * 1000000)
+
+    events = []
+    for thread in self.threads.values():
+      events.append({'name': 'thread_name', 'ph': 'M', 'pid': 1, 'tid': thread,
+                     'args': {'name': 'Build lane {}'.format(thread)}})
+    for measurement in self.measurements:
+      events.append({
+        'name': measurement.name,
+        'cat' : measurement.status,
+        'ph'  : 'X',
+        'ts'  : Microseconds(measurement.start),
+        'dur' : Microseconds(measurement.end or time.time()) - Microseconds(measurement.start),
+        'pid' : 1,
+        'tid' : measurement.thread,
+        'args': {key: value for key, value in measurement.to_json().items() if key not in ('name', 'start', 'end')},
+      })
+    for timestamp, rss in self.memorySamples:
+      events.append({'name': 'Resident memory (MiB)', 'ph': 'C', 'ts': Microseconds(timestamp), 'pid': 1,
+                     'args': {name: value / 2 ** 20 for name, value in rss.items()}})
+    return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+  def slowest_modules(self, count=10):
+    """
+    Returns (step, module) pairs of the count Maven modules and Gradle tasks that took the longest.
+    """
+    modules = [(measurement.name, module) for measurement in self.measurements for module in measurement.modules if
+               module.duration is not None]
+    modules.sort(key=lambda pair: pair[1].duration, reverse=True)
+    return modules[:count]
+
+  def print_slowest_modules(self, count=10):
+    modules = self.slowest_modules(count)
+    if not modules:
+      return
+    print('Top {} slowest modules:'.format(len(modules)))
+    for step, module in modules:
+      print('  {:>8.1f}s  {:<8}  {:<16}  {}'.format(module.duration, module.status, step, module.name))
+
+  def write(self, directory):
+    """
+    Writes the JSON report and Chrome trace to directory, named after the start time of the build. Returns the locations
+    of the report and the trace.
+    """
+    os.makedirs(directory, exist_ok=True)
+    name = 'build-{}'.format(time.strftime('%Y%m%d-%H%M%S', time.localtime(self.start)))
+    reportLocation = os.path.join(directory, '{}.json'.format(name))
+    traceLocation = os.path.join(directory, '{}.trace.json'.format(name))
+    with open(reportLocation, mode='w') as file:
+      json.dump(self.to_json(), file, indent=2)
+    with open(traceLocation, mode='w') as file:
+      json.dump(self.to_trace(), file)
+    return reportLocation, traceLocation
+
+
+def _sysconf(name):
+  try:
+    return os.sysconf(name)
+  except (AttributeError, ValueError, OSError):
+    return None
+
+
+def _children_usage():
+  if not resource:
+    return None
+  return resource.getrusage(resource.RUSAGE_CHILDREN)
+
+
+def _process_tree(rootPid):
+  """
+  Returns the descendant processes of rootPid, as a dictionary from (pid, start time) to the (pid, start time) of their
+  topmost ancestor below rootPid, their user and system CPU time in clock ticks, and their resident set size in pages.
+  """
+  stats = {}
+  for entry in os.listdir(_procDir):
+    if not entry.isdigit():
+      continue
+    try:
+      with open(os.path.join(_procDir, entry, 'stat')) as file:
+        stat = file.read()
+      with open(os.path.join(_procDir, entry, 'statm')) as file:
+        residentPages = int(file.read().split()[1])
+    except (OSError, IndexError, ValueError):
+      continue
+    # The command name is in parentheses and may contain spaces, fields after it are separated by spaces.
+    fields = stat[stat.rfind(')') + 2:].split()
+    stats[int(entry)] = (int(fields[1]), int(fields[11]), int(fields[12]), int(fields[19]), residentPages)
+
+  processes = {}
+  for pid, (ppid, user, system, started, residentPages) in stats.items():
+    child, parent = pid, ppid
+    while parent in stats and parent != rootPid:
+      child, parent = parent, stats[parent][0]
+    if parent != rootPid:
+      continue
+    topmost = (child, stats[child][3])
+    processes[(pid, started)] = (topmost, user, system, residentPages)
+  return processes
+
+
+def _process_tag(pid):
+  try:
+    with open(os.path.join(_procDir, str(pid), 'environ'), mode='rb') as file:
+      environment = file.read()
+  except OSError:
+    return None
+  prefix = '{}='.format(stepEnvironmentVariable).encode('ascii')
+  for variable in environment.split(b'\0'):
+    if variable.startswith(prefix):
+      return variable[len(prefix):].decode('utf-8', errors='replace')
+  return None
@@ -0,0 +1,133 @@
+import json
+import os
+import re
+import subprocess
+from functools import partial
+
+from metaborg.util.git import ChangedFilesBetween, HeadSha, WorkingDirs
+from metaborg.util.parallel import RunParallel
+
+# Runs of characters that versions consist of. Every occurrence of a version is contained in one such run, so a file can
+# only contain a version if one of its tokens contains it.
+_tokenRegex = re.compile(rb'[0-9A-Za-z_.+\-]+')
+_versionLikeRegex = re.compile(rb'[0-9]\.[0-9]')
+_indexableRegex = re.compile(r'^[0-9A-Za-z_.+\-]*[0-9]\.[0-9][0-9A-Za-z_.+\-]*$')
+
+
+def _ScanTokens(file):
+  with open(file, 'rb') as fileHandle:
+    data = fileHandle.read()
+  tokens = set(token for token in _tokenRegex.findall(data) if _versionLikeRegex.search(token))
+  return sorted(token.decode('ascii') for token in tokens)
+
+
+def DefaultVersionIndexLocation(repo):
+  return os.path.join(repo.git_dir, 'metaborg-version-index.json')
+
+
+class VersionIndex(object):
+  """
+  Persistent index of the version-like strings that files contain, used by SetVersionMappings to only open files that
+  can contain the versions being replaced. Files are grouped per repository, keyed by the HEAD SHA of the repository
+  and by their modification time and size. When the HEAD of a repository moves, files that changed between the indexed
+  and current HEAD are rescanned, as are files whose modification time or size changed. Like git's racy index
+  handling, files modified at or after the time the index was written are always rescanned, since a change within the
+  granularity of modification times would otherwise go unnoticed.
+  """
+
+  formatVersion = 1
+
+  def __init__(self, location, repositories=None, written=None):
+    self.location = location
+    self.repositories = repositories or {}
+    # Modification time of the index file in nanoseconds, or None if it has not been written.
+    self.written = written
+
+  @staticmethod
+  def load(location):
+    """
+    Loads the index at location. Returns an empty index if it does not exist, is unreadable, or is of an old format.
+    """
+    try:
+      with open(location) as file:
+        data = json.load(file)
+        written = os.fstat(file.fileno()).st_mtime_ns
+    except (OSError, ValueError):
+      return VersionIndex(location)
+    if not isinstance(data, dict) or data.get('format') != VersionIndex.formatVersion:
+      return VersionIndex(location)
+    return VersionIndex(location, data.get('repositories'), written)
+
+  def save(self):
+    temporary = '{}.tmp'.format(self.location)
+    with open(temporary, mode='w') as file:
+      json.dump({'format': self.formatVersion, 'repositories': self.repositories}, file, separators=(',', ':'))
+    os.replace(temporary, self.location)
+    self.written = os.stat(self.location).st_mtime_ns
+
+  def update(self, repo, files, jobs=None):
+    """
+    Brings the index up to date for given files of repo, rescanning stale files concurrently, and dropping files that
+    are not given. Returns the number of rescanned files.
+    """
+    rootDir = repo.working_tree_dir
+    # Longest working directories first, such that files are assigned to the innermost repository.
+    workingDirs = sorted(WorkingDirs(repo), key=len, reverse=True)
+
+    oldRepositories = self.repositories
+    self.repositories = {}
+    for workingDir in workingDirs:
+      key = os.path.relpath(workingDir, rootDir)
+      head = HeadSha(workingDir)
+      entry = oldRepositories.get(key)
+      if entry and entry.get('head') != head:
+        try:
+          for changed in ChangedFilesBetween(workingDir, entry['head'], head):
+            entry['files'].pop(changed, None)
+        except (subprocess.CalledProcessError, TypeError):
+          entry = None
+      self.repositories[key] = {'head': head, 'files': {}, 'indexed': entry['files'] if entry else {}}
+
+    stale = []
+    for file in files:
+      for workingDir in workingDirs:
+        if file.startswith(os.path.join(workingDir, '')):
+          break
+      else:
+        continue
+      entry = self.repositories[os.path.relpath(workingDir, rootDir)]
+      path = os.path.relpath(file, workingDir).replace(os.sep, '/')
+      try:
+        stat = os.stat(file)
+      except OSError:
+        continue
+      indexed = entry['indexed'].get(path)
+      racy = self.written is None or stat.st_mtime_ns >= self.written
+      if indexed and indexed[0] == stat.st_mtime_ns and indexed[1] == stat.st_size and not racy:
+        entry['files'][path] = indexed
+      else:
+        stale.append((file, entry, path, stat))
+
+    tokens = RunParallel(((file, partial(_ScanTokens, file)) for file, _, _, _ in stale), jobs=jobs)
+    for file, entry, path, stat in stale:
+      entry['files'][path] = [stat.st_mtime_ns, stat.st_size, tokens[file]]
+    for entry in self.repositories.values():
+      del entry['indexed']
+    return len(stale)
+
+  def may_contain(self, repo, file, pattern):
+    """
+    Returns whether file may contain pattern. Returns True for files that are not indexed, and for patterns that do not
+    look like a version and can therefore not be answered by the index.
+    """
+    if not _indexableRegex.match(pattern):
+      return True
+    rootDir = repo.working_tree_dir
+    for key in sorted(self.repositories, key=len, reverse=True):
+      workingDir = os.path.normpath(os.path.join(rootDir, key))
+      if file.startswith(os.path.join(workingDir, '')):
+        indexed = self.repositories[key]['files'].get(os.path.relpath(file, workingDir).replace(os.sep, '/'))
+        if indexed is None:
+          return True
+        return any(pattern in token for token in indexed[2])
+    return True
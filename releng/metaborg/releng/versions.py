@@ -1,9 +1,15 @@
+import mmap
 import os
 import re
+import time
+from enum import Enum, unique
+from functools import lru_cache, partial
 import xml.etree.ElementTree as ET
-from os import path
 
-from metaborg.util.path import CommonPrefix
+from metaborg.releng.versionindex import DefaultVersionIndexLocation, VersionIndex
+from metaborg.util.git import CommitFiles, InvalidateSnapshot, TrackedFiles, WorkingDirs
+from metaborg.util.parallel import RunParallel
+from metaborg.util.path import PathTrie
 
 
 def ToEclipseVersion(mavenVersion):
@@ -15,153 +21,412 @@ def ToEclipseVersion(mavenVersion):
   return version.replace('SNAPSHOT', 'qualifier')
 
 
-def SetVersions(repo, oldMavenVersion, newMavenVersion, dryRun=False, commit=False):
-  baseDir = repo.working_tree_dir
-  ignoreDirs = ['eclipse-installations', 'target', '_attic', 'metaborg-sl']
+def ClassifyFiles(root, files, patterns, ignoreDirs):
+  """
+  Classifies given files under root in one pass, skipping files inside directories named in ignoreDirs, and files
+  that do not exist on disk. Returns a dictionary from each pattern to the list of files whose name ends with that
+  pattern, in the order they were given.
+  """
+  classified = {pattern: [] for pattern in patterns}
+  ignoreDirs = set(ignoreDirs)
+  for file in files:
+    name = os.path.basename(file)
+    matches = [pattern for pattern in patterns if name.endswith(pattern)]
+    if not matches:
+      continue
+    if not ignoreDirs.isdisjoint(os.path.relpath(file, root).split(os.sep)[:-1]) or not os.path.isfile(file):
+      continue
+    for pattern in matches:
+      classified[pattern].append(file)
+  return classified
 
-  oldEclipseVersion = ToEclipseVersion(oldMavenVersion)
-  newEclipseVersion = ToEclipseVersion(newMavenVersion)
-  if oldEclipseVersion == oldMavenVersion:
-    oldVersionString = oldMavenVersion
-  else:
-    oldVersionString = '{} / {}'.format(oldMavenVersion, oldEclipseVersion)
-  if newEclipseVersion == newMavenVersion:
-    newVersionString = newMavenVersion
-  else:
-    newVersionString = '{} / {}'.format(newMavenVersion, newEclipseVersion)
-
-  changedFiles = []
-
-  print('Old version {}'.format(oldVersionString))
-  print('New version {}'.format(newVersionString))
-
-  def FindFiles(root, pattern):
-    allFiles = []
-    for rootDir, dirs, files in os.walk(root):
-      for ignoreDir in ignoreDirs:
-        if ignoreDir in dirs:
-          dirs.remove(ignoreDir)
-      for file in files:
-        if file.endswith(pattern):
-          allFiles.append(os.path.join(rootDir, file))
-    return allFiles
-
-  def ReplaceInFile(replaceFile, pattern, replacement):
-    with open(replaceFile) as fileHandle:
-      text = fileHandle.read()
-    if pattern in text:
-      print('Setting version in {}'.format(replaceFile))
-      text = text.replace(pattern, replacement)
-      changedFiles.append(replaceFile)
-      if dryRun:
-        return
-      with open(replaceFile, "w") as fileHandle:
-        fileHandle.write(text)
-
-  def IsMavenPomFile(pomFile):
-    try:
-      xmlRoot = ET.parse(pomFile)
-    except ET.ParseError:
-      return False
-    project = xmlRoot.getroot()
-    if project is None or project.tag != '{http://maven.apache.org/POM/4.0.0}project':
+
+# Files at least this large are memory mapped instead of read when searching for patterns.
+_mmapThreshold = 64 * 1024
+
+
+@lru_cache(maxsize=None)
+def _PatternRegex(patterns):
+  # Longest patterns first, such that a pattern that is a prefix of another pattern does not shadow it.
+  return re.compile(b'|'.join(re.escape(pattern) for pattern in sorted(patterns, key=len, reverse=True)))
+
+
+def _ReplaceInFile(replaceFile, replacements, dryRun):
+  patterns = tuple(sorted(set(pattern for pattern, _, _ in replacements)))
+  regex = _PatternRegex(patterns)
+  with open(replaceFile, 'rb') as fileHandle:
+    size = os.fstat(fileHandle.fileno()).st_size
+    if size == 0:
       return False
+    if size < _mmapThreshold:
+      data = fileHandle.read()
+      found = set(match.group(0) for match in regex.finditer(data))
+    else:
+      with mmap.mmap(fileHandle.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        found = set(match.group(0) for match in regex.finditer(data))
+  if not found:
+    return False
+
+  # Conditions are only checked for files that contain a pattern, so that unchanged files are never parsed.
+  active = {}
+  checked = {}
+  for pattern, replacement, condition in replacements:
+    if pattern not in found or pattern in active:
+      continue
+    if condition is not None:
+      if condition not in checked:
+        checked[condition] = condition(replaceFile)
+      if not checked[condition]:
+        continue
+    active[pattern] = replacement
+  if not active:
+    return False
+  if dryRun:
     return True
 
-  def IsGeneratedManifestFile(manifestFile):
-    with open(manifestFile) as fileHandle:
-      text = fileHandle.read()
-    return 'Bnd-LastModified' in text
+  with open(replaceFile, 'rb') as fileHandle:
+    data = fileHandle.read()
+  # All patterns are replaced in a single pass, such that a replacement is never matched by another pattern.
+  data = _PatternRegex(tuple(sorted(active))).sub(lambda match: active[match.group(0)], data)
+  with open(replaceFile, 'wb') as fileHandle:
+    fileHandle.write(data)
+  return True
 
 
-  # Java property file versions
-  print('Setting versions in Java property files; {} -> {}'.format(oldMavenVersion, newMavenVersion))
-  for file in FindFiles(baseDir, '.properties'):
-    ReplaceInFile(file, oldMavenVersion, newMavenVersion)
+def ReplaceInFiles(replacements, dryRun=False, jobs=None):
+  """
+  Replaces patterns in files concurrently. Replacements is a list of (file, pattern, replacement, condition) tuples,
+  where condition is None or a function that is given the file, and must return True for the replacement to apply.
+  Files are searched as bytes, all patterns of a file at once, and are only decoded by conditions. Returns the list of
+  changed files, or of files that would change if dryRun is set, in the order they were first given.
+  """
+  byFile = {}
+  for replaceFile, pattern, replacement, condition in replacements:
+    byFile.setdefault(replaceFile, []).append((pattern.encode('utf-8'), replacement.encode('utf-8'), condition))
+  results = RunParallel(((replaceFile, partial(_ReplaceInFile, replaceFile, fileReplacements, dryRun))
+    for replaceFile, fileReplacements in byFile.items()), jobs=jobs)
+  return [replaceFile for replaceFile in byFile if results[replaceFile]]
 
-  # Maven versions
-  print('Setting versions in Maven POM files; {} -> {}'.format(oldMavenVersion, newMavenVersion))
-  for file in FindFiles(baseDir, 'pom.xml'):
-    if IsMavenPomFile(file):
-      ReplaceInFile(file, oldMavenVersion, newMavenVersion)
 
-  print('Setting versions in Maven extension files; {} -> {}'.format(oldMavenVersion, newMavenVersion))
-  for file in FindFiles(baseDir, 'extensions.xml'):
-    ReplaceInFile(file, oldMavenVersion, newMavenVersion)
+def _VersionString(mavenVersion):
+  eclipseVersion = ToEclipseVersion(mavenVersion)
+  if eclipseVersion == mavenVersion:
+    return mavenVersion
+  return '{} / {}'.format(mavenVersion, eclipseVersion)
 
-  # Gradle versions
-  print('Setting versions in Gradle build files; {} -> {}'.format(oldMavenVersion, newMavenVersion))
-  for file in FindFiles(baseDir, 'build.gradle'):
-    ReplaceInFile(file, oldMavenVersion, newMavenVersion)
 
-  print('Setting versions in Gradle settings files; {} -> {}'.format(oldMavenVersion, newMavenVersion))
-  for file in FindFiles(baseDir, 'settings.gradle'):
-    ReplaceInFile(file, oldMavenVersion, newMavenVersion)
+def _MappingsString(mappings):
+  return ', '.join('{} -> {}'.format(old, new) for old, new in mappings)
 
-  # Spoofax Core versions
-  '''
-  Special handling of org.metaborg.core.MetaborgConstants Java class. Need to set the METABORG_VERSION constant to the
-  Maven version.
-  '''
-  print('Setting version in MetaborgConstants Java class; {} -> {}'.format(oldMavenVersion, newMavenVersion))
-  ReplaceInFile(os.path.join(baseDir, 'spoofax', 'org.metaborg.core', 'src', 'main', 'java', 'org', 'metaborg', 'core',
-    'MetaborgConstants.java'), oldMavenVersion, newMavenVersion)
-
-  print('Setting versions in metaborg.yaml files; {} -> {}'.format(oldMavenVersion, newMavenVersion))
-  for file in FindFiles(baseDir, 'metaborg.yaml'):
-    ReplaceInFile(file, oldMavenVersion, newMavenVersion)
-
-  # Eclipse version
-  '''
-  Special handling for org.metaborg.spoofax.eclipse.updatesite project. Need to set the version in the pom file to the
-  Eclipse version instead of the Maven version, otherwise Tycho will fail the build.
-  '''
-  print('Setting version in org.metaborg.spoofax.eclipse.updatesite POM file; {} -> {}'.format(oldEclipseVersion,
-    newEclipseVersion))
-  ReplaceInFile(os.path.join(baseDir, 'spoofax-eclipse', 'org.metaborg.spoofax.eclipse.updatesite', 'pom.xml'),
-    oldEclipseVersion, newEclipseVersion)
-
-  print('Setting versions in MANIFEST.MF files; {} -> {}'.format(oldEclipseVersion, newEclipseVersion))
-  for file in FindFiles(baseDir, 'MANIFEST.MF'):
-    if not IsGeneratedManifestFile(file):
-      ReplaceInFile(file, oldEclipseVersion, newEclipseVersion)
-
-  print('Setting versions in feature.xml files; {} -> {}'.format(oldEclipseVersion, newEclipseVersion))
-  for file in FindFiles(baseDir, 'feature.xml'):
-    ReplaceInFile(file, oldEclipseVersion, newEclipseVersion)
-
-  print('Setting versions in site.xml files; {} -> {}'.format(oldEclipseVersion, newEclipseVersion))
-  for file in FindFiles(baseDir, 'site.xml'):
-    ReplaceInFile(file, oldEclipseVersion, newEclipseVersion)
 
+def ParseVersionMapping(mapping):
+  """
+  Parses a version mapping of the form OLD=NEW into an (old, new) tuple of Maven versions.
+  """
+  old, separator, new = mapping.partition('=')
+  if not separator or not old or not new:
+    raise ValueError('Invalid version mapping {}, expected OLD=NEW'.format(mapping))
+  return old, new
+
+
+_pomProjectTag = '{http://maven.apache.org/POM/4.0.0}project'
+# Cache of IsMavenPomFile results, from file to (modification time, size, result).
+_pomFileCache = {}
+
+
+def _ParseIsMavenPomFile(pomFile):
+  try:
+    xmlRoot = ET.parse(pomFile)
+  except ET.ParseError:
+    return False
+  project = xmlRoot.getroot()
+  if project is None or project.tag != _pomProjectTag:
+    return False
+  return True
+
+
+def IsMavenPomFile(pomFile):
+  """
+  Returns whether pomFile is a Maven POM file, by checking the tag of its root element. Reads and parses the file in
+  small chunks, stopping at the root element instead of parsing the entire file, and caches the result until the file
+  changes.
+  """
+  stat = os.stat(pomFile)
+  cached = _pomFileCache.get(pomFile)
+  if cached and cached[0] == stat.st_mtime_ns and cached[1] == stat.st_size:
+    return cached[2]
+
+  result = False
+  parser = ET.XMLPullParser(events=('start',))
+  try:
+    with open(pomFile, 'rb') as fileHandle:
+      while True:
+        chunk = fileHandle.read(4096)
+        if not chunk:
+          break
+        parser.feed(chunk)
+        element = next((element for _, element in parser.read_events()), None)
+        if element is not None:
+          result = element.tag == _pomProjectTag
+          break
+  except ET.ParseError:
+    result = False
+  _pomFileCache[pomFile] = (stat.st_mtime_ns, stat.st_size, result)
+  return result
+
+
+def benchmark_pom_detection(repo, runs):
+  """
+  Times detecting Maven POM files among all tracked pom.xml files of repo with IsMavenPomFile, with and without its
+  cache, and by fully parsing each file, over given number of runs. Returns the number of files, the mean duration of
+  the three, and whether they agreed on all files.
+  """
+  files = [file for file in TrackedFiles(repo) if os.path.basename(file) == 'pom.xml' and os.path.isfile(file)]
+  streamingTimes, cachedTimes, parseTimes = [], [], []
+  same = True
+  for _ in range(runs):
+    _pomFileCache.clear()
+    start = time.perf_counter()
+    streaming = [IsMavenPomFile(file) for file in files]
+    streamingTimes.append(time.perf_counter() - start)
+    start = time.perf_counter()
+    cached = [IsMavenPomFile(file) for file in files]
+    cachedTimes.append(time.perf_counter() - start)
+    start = time.perf_counter()
+    parsed = [_ParseIsMavenPomFile(file) for file in files]
+    parseTimes.append(time.perf_counter() - start)
+    same = same and streaming == cached == parsed
+  return len(files), sum(streamingTimes) / runs, sum(cachedTimes) / runs, sum(parseTimes) / runs, same
+
+
+def IsNotGeneratedManifestFile(manifestFile):
+  with open(manifestFile) as fileHandle:
+    text = fileHandle.read()
+  return 'Bnd-LastModified' not in text
+
+
+@unique
+class VersionKind(Enum):
+  maven = 'Maven'
+  eclipse = 'Eclipse'
+
+
+class VersionFileType(object):
+  """
+  Type of file that contains versions of given kind. Files of the type are either all tracked files whose name ends
+  with pattern inside directory (relative to the repository root, or anywhere if None), or the single file at location.
+  Only files for which condition returns True, if given, contain versions.
+  """
+
+  def __init__(self, description, kind, pattern=None, directory=None, location=None, condition=None):
+    self.description = description
+    self.kind = kind
+    self.pattern = pattern
+    self.directory = directory
+    self.location = location
+    self.condition = condition
+
+
+_versionFileTypes = [
+  # Java property file versions
+  VersionFileType('Java property files', VersionKind.maven, '.properties'),
+  # Maven versions
+  VersionFileType('Maven POM files', VersionKind.maven, 'pom.xml', condition=IsMavenPomFile),
+  VersionFileType('Maven extension files', VersionKind.maven, 'extensions.xml'),
+  # Gradle versions
+  VersionFileType('Gradle build files', VersionKind.maven, 'build.gradle'),
+  VersionFileType('Gradle settings files', VersionKind.maven, 'settings.gradle'),
+  # Spoofax Core versions
+  # Special handling of org.metaborg.core.MetaborgConstants Java class. Need to set the METABORG_VERSION constant to the
+  # Maven version.
+  VersionFileType('MetaborgConstants Java class', VersionKind.maven, location=os.path.join('spoofax',
+    'org.metaborg.core', 'src', 'main', 'java', 'org', 'metaborg', 'core', 'MetaborgConstants.java')),
+  VersionFileType('metaborg.yaml files', VersionKind.maven, 'metaborg.yaml'),
+  # Eclipse versions
+  # Special handling for org.metaborg.spoofax.eclipse.updatesite project. Need to set the version in the pom file to the
+  # Eclipse version instead of the Maven version, otherwise Tycho will fail the build.
+  VersionFileType('org.metaborg.spoofax.eclipse.updatesite POM file', VersionKind.eclipse,
+    location=os.path.join('spoofax-eclipse', 'org.metaborg.spoofax.eclipse.updatesite', 'pom.xml')),
+  VersionFileType('MANIFEST.MF files', VersionKind.eclipse, 'MANIFEST.MF', condition=IsNotGeneratedManifestFile),
+  VersionFileType('feature.xml files', VersionKind.eclipse, 'feature.xml'),
+  VersionFileType('site.xml files', VersionKind.eclipse, 'site.xml'),
   # IntelliJ versions
-  print('Setting versions in IntelliJ plugin.xml files; {} -> {}'.format(oldMavenVersion, newMavenVersion))
-  for file in FindFiles(
-      os.path.join(baseDir, 'spoofax-intellij', 'org.metaborg.intellij', 'src', 'main', 'resources', 'META-INF'),
-      'plugin.xml'):
-    ReplaceInFile(file, oldMavenVersion, newMavenVersion)
+  VersionFileType('IntelliJ plugin.xml files', VersionKind.maven, 'plugin.xml',
+    directory=os.path.join('spoofax-intellij', 'org.metaborg.intellij', 'src', 'main', 'resources', 'META-INF')),
+  VersionFileType('IntelliJ text files', VersionKind.maven, '.txt',
+    directory=os.path.join('spoofax-intellij', 'org.metaborg.spoofax-common', 'src', 'main', 'resources')),
+  VersionFileType('IntelliJ updatePlugins.xml files', VersionKind.maven, 'updatePlugins.xml',
+    directory=os.path.join('spoofax-intellij', 'repository')),
+]
+_ignoreDirs = ['eclipse-installations', 'target', '_attic', 'metaborg-sl']
+
+
+def VersionFiles(repo, jobs=None):
+  """
+  Lists the files that contain versions, as a list of (VersionFileType, files) tuples. Only files tracked by git are
+  considered, listed once for all file types, and files at fixed locations are left out if they do not exist, such as in
+  sparse workspaces. Conditions of file types are not checked.
+  """
+  baseDir = repo.working_tree_dir
+  patterns = sorted(set(fileType.pattern for fileType in _versionFileTypes if fileType.pattern))
+  classifiedFiles = ClassifyFiles(baseDir, TrackedFiles(repo, jobs=jobs), patterns, _ignoreDirs)
+  versionFiles = []
+  for fileType in _versionFileTypes:
+    if fileType.location:
+      location = os.path.join(baseDir, fileType.location)
+      files = [location] if os.path.isfile(location) else []
+    else:
+      root = os.path.join(baseDir, fileType.directory or '', '')
+      files = [file for file in classifiedFiles[fileType.pattern] if file.startswith(root)]
+    versionFiles.append((fileType, files))
+  return versionFiles
+
+
+def SetVersions(repo, oldMavenVersion, newMavenVersion, dryRun=False, commit=False, jobs=None, useIndex=True,
+    rebuildIndex=False):
+  SetVersionMappings(repo, [(oldMavenVersion, newMavenVersion)], dryRun=dryRun, commit=commit, jobs=jobs,
+    useIndex=useIndex, rebuildIndex=rebuildIndex)
 
-  print('Setting versions in IntelliJ text files; {} -> {}'.format(oldMavenVersion, newMavenVersion))
-  for file in FindFiles(
-      os.path.join(baseDir, 'spoofax-intellij', 'org.metaborg.spoofax-common', 'src', 'main', 'resources'), '.txt'):
-    ReplaceInFile(file, oldMavenVersion, newMavenVersion)
 
-  print('Setting versions in IntelliJ updatePlugins.xml files; {} -> {}'.format(oldMavenVersion, newMavenVersion))
-  for file in FindFiles(os.path.join(baseDir, 'spoofax-intellij', 'repository'), 'updatePlugins.xml'):
-    ReplaceInFile(file, oldMavenVersion, newMavenVersion)
+def SetVersionMappings(repo, mappings, dryRun=False, commit=False, jobs=None, useIndex=True, rebuildIndex=False):
+  """
+  Sets versions according to given list of (old, new) Maven version mappings, in a single pass over all files. All
+  mappings are applied simultaneously, such that text produced by one mapping is never replaced by another mapping.
+  Changes are committed once per submodule if commit is set. Unless useIndex is false, the persistent VersionIndex is
+  used to only open files that can contain an old version; rebuildIndex discards the index and rescans all files.
+  """
+  mavenMappings = [(old, new) for old, new in mappings if old != new]
+  eclipseMappings = [(ToEclipseVersion(old), ToEclipseVersion(new)) for old, new in mavenMappings]
+  for versionMappings in [mavenMappings, eclipseMappings]:
+    olds = [old for old, _ in versionMappings]
+    duplicates = sorted(set(old for old in olds if olds.count(old) > 1))
+    if duplicates:
+      raise ValueError('Versions {} are mapped more than once'.format(', '.join(duplicates)))
+  mavenMappingsString = _MappingsString(mavenMappings)
+  eclipseMappingsString = _MappingsString(eclipseMappings)
+  if len(mavenMappings) == 1:
+    commitMessage = 'Set version to {}'.format(_VersionString(mavenMappings[0][1]))
+  else:
+    commitMessage = 'Set versions {}'.format(mavenMappingsString)
+
+  replacements = []
+
+  for old, new in mavenMappings:
+    print('Old version {}'.format(_VersionString(old)))
+    print('New version {}'.format(_VersionString(new)))
+
+  for fileType, files in VersionFiles(repo, jobs=jobs):
+    if fileType.kind == VersionKind.maven:
+      versionMappings, mappingsString = mavenMappings, mavenMappingsString
+    else:
+      versionMappings, mappingsString = eclipseMappings, eclipseMappingsString
+    print('Setting versions in {}; {}'.format(fileType.description, mappingsString))
+    for file in files:
+      for old, new in versionMappings:
+        replacements.append((file, old, new, fileType.condition))
+
+  if useIndex:
+    indexLocation = DefaultVersionIndexLocation(repo)
+    index = VersionIndex(indexLocation) if rebuildIndex else VersionIndex.load(indexLocation)
+    indexedFiles = sorted(set(file for file, _, _, _ in replacements if os.path.isfile(file)))
+    rescanned = index.update(repo, indexedFiles, jobs=jobs)
+    numReplacements = len(replacements)
+    replacements = [replacement for replacement in replacements if index.may_contain(repo, *replacement[:2])]
+    print('Version index: rescanned {} of {} files, skipping {} of {} replacements'.format(rescanned,
+      len(indexedFiles), numReplacements - len(replacements), numReplacements))
+
+  changedFiles = ReplaceInFiles(replacements, dryRun=dryRun, jobs=jobs)
+  for file in changedFiles:
+    print('Setting version in {}'.format(file))
 
   # Commit changed files
   if commit:
     print('Committing changed files')
-    for submodule in repo.submodules:
-      print('Submodule {}'.format(submodule.name))
-      subrepo = submodule.module()
-      subrepoPath = subrepo.working_dir
-      filesToAdd = [path.relpath(f, subrepoPath) for f in changedFiles if CommonPrefix([subrepoPath, f]) == subrepoPath]
-      if len(filesToAdd) != 0:
-        if dryRun:
-          print('Changed files {}'.format(filesToAdd))
-        else:
-          print('Adding files {} and committing'.format(filesToAdd))
-          if len(subrepo.index.add(filesToAdd)) != 0:
-            subrepo.index.commit('Set version to {}'.format(newVersionString))
+    CommitFiles(repo, changedFiles, commitMessage, dryRun=dryRun, jobs=jobs)
+
+  if changedFiles and not dryRun:
+    InvalidateSnapshot(repo)
+
+  if useIndex:
+    if changedFiles and not dryRun:
+      index.update(repo, indexedFiles, jobs=jobs)
+    index.save()
+
+
+# Maven (1.2.3, 1.2.3-SNAPSHOT) and Eclipse (1.2.3.qualifier) version strings, not preceded by other version characters.
+_versionRegex = re.compile(rb'(?<![\w.\-])\d+\.\d+\.\d+(?:[.\-][A-Za-z0-9][A-Za-z0-9_.\-]*)?')
+_eclipseVersionRegex = re.compile(r'^\d+\.\d+\.\d+\.')
+_developmentVersionRegex = re.compile(r'SNAPSHOT|qualifier|baseline')
+
+
+def VersionKindOf(version):
+  return VersionKind.eclipse if _eclipseVersionRegex.match(version) else VersionKind.maven
+
+
+class VersionOccurrence(object):
+  """
+  Occurrence of a version string at a line of a file of given VersionFileType, inside given submodule.
+  """
+
+  def __init__(self, file, line, version, fileType, submodule):
+    self.file = file
+    self.line = line
+    self.version = version
+    self.fileType = fileType
+    self.submodule = submodule
+
+  def to_json(self):
+    return {'file': self.file, 'line': self.line, 'version': self.version, 'kind': VersionKindOf(self.version).value,
+      'fileType': self.fileType.description, 'submodule': self.submodule}
+
+
+def _ScanVersions(file, fileType, submodule):
+  if fileType.condition is not None and not fileType.condition(file):
+    return []
+  with open(file, 'rb') as fileHandle:
+    data = fileHandle.read()
+  occurrences = []
+  line, position = 1, 0
+  for match in _versionRegex.finditer(data):
+    line += data.count(b'\n', position, match.start())
+    position = match.start()
+    version = match.group(0).rstrip(b'.-').decode('ascii')
+    occurrences.append(VersionOccurrence(file, line, version, fileType, submodule))
+  return occurrences
+
+
+def FindVersions(repo, jobs=None):
+  """
+  Finds all Maven and Eclipse version strings in files that SetVersions changes, scanning files concurrently. Returns a
+  list of VersionOccurrence objects, ordered by file type and file.
+  """
+  rootDir = repo.working_tree_dir
+  trie = PathTrie()
+  for workingDir in WorkingDirs(repo, recursive=True):
+    trie.insert(workingDir, os.path.relpath(workingDir, rootDir))
+
+  versionFiles = VersionFiles(repo, jobs=jobs)
+  # Files at fixed locations, such as the updatesite POM file, are also matched by the generic file types. Only report
+  # their versions once, for the file type of their location.
+  claimed = set(file for fileType, files in versionFiles if fileType.location for file in files)
+  tasks = []
+  for fileType, files in versionFiles:
+    for file in files:
+      if fileType.location or file not in claimed:
+        tasks.append(((fileType.description, file), partial(_ScanVersions, file, fileType, trie.longest_prefix(file))))
+  results = RunParallel(tasks, jobs=jobs)
+  return [occurrence for key, _ in tasks for occurrence in results[key]]
+
+
+def IsVersionMismatch(version, expectedMavenVersion):
+  """
+  Returns whether version is likely a stray MetaBorg version that should have been expectedMavenVersion: a development
+  version (snapshot, qualifier, or baseline), or a version with the same major and minor version, that is neither the
+  expected Maven nor the expected Eclipse version.
+  """
+  if version in (expectedMavenVersion, ToEclipseVersion(expectedMavenVersion)):
+    return False
+  if _developmentVersionRegex.search(version):
+    return True
+  majorMinor = '.'.join(expectedMavenVersion.split('.')[:2]) + '.'
+  return version.startswith(majorMinor)
@@ -1,61 +1,674 @@
 import datetime
+import hashlib
+import json
 import os
 import re
+import shutil
+import subprocess
+import sys
+import threading
 import time
 from enum import Enum, unique
+from functools import partial
+
+from git.cmd import Git
+from git.exc import GitCommandError
+from git.index.fun import S_IFGITLINK
+from git.index.typ import BaseIndexEntry
+from git.repo.base import Repo
+
+from metaborg.util.parallel import RunParallel
+from metaborg.util.path import DiskUsage, FormatSize, PathTrie
+
+
+class SubmoduleStatus(object):
+  """
+  Status of a single submodule at the time its SubmoduleSnapshot was taken. All fields except name and path are None or
+  False if the submodule has not been initialized.
+  """
+
+  def __init__(self, name, path, initialized=False, sha=None, branch=None, detached=False, committedDate=None,
+      dirty=False, remoteUrl=None):
+    self.name = name
+    self.path = path
+    self.initialized = initialized
+    self.sha = sha
+    self.branch = branch
+    self.detached = detached
+    self.committedDate = committedDate
+    self.dirty = dirty
+    self.remoteUrl = remoteUrl
+
+
+def _CollectStatus(submodule):
+  if not submodule.module_exists():
+    return SubmoduleStatus(submodule.name, submodule.path)
+  subrepo = submodule.module()
+  head = subrepo.head
+  detached = head.is_detached
+  commit = head.commit
+  branch = None if detached else head.reference.name
+  remoteUrl = subrepo.remotes[0].url if subrepo.remotes else None
+  return SubmoduleStatus(submodule.name, submodule.path, True, commit.hexsha, branch, detached,
+    commit.committed_date, subrepo.is_dirty(), remoteUrl)
+
+
+class SubmoduleSnapshot(object):
+  """
+  Status of the root repository and all its submodules, shared by all helpers during a command invocation. The status
+  of submodules is collected concurrently on first use. Get the shared snapshot with Snapshot, and call
+  InvalidateSnapshot after changing submodules.
+  """
+
+  def __init__(self, repo, jobs=None):
+    self.repo = repo
+    self.jobs = jobs
+    head = repo.head
+    self.branch = 'DETACHED' if head.is_detached else head.reference.name
+    self.__statuses = None
+    self.__lock = threading.Lock()
+
+  @property
+  def statuses(self):
+    with self.__lock:
+      if self.__statuses is None:
+        submodules = list(self.repo.submodules)
+        statuses = RunParallel(((submodule.name, partial(_CollectStatus, submodule)) for submodule in submodules),
+          jobs=self.jobs)
+        self.__statuses = [statuses[submodule.name] for submodule in submodules]
+      return self.__statuses
+
+  @property
+  def collected(self):
+    return self.__statuses is not None
+
+  def get(self, name):
+    for status in self.statuses:
+      if status.name == name:
+        return status
+    return None
+
+  def latest_date(self):
+    dates = [status.committedDate for status in self.statuses if status.initialized]
+    return datetime.datetime.fromtimestamp(max(dates, default=0))
+
+  def dirty(self):
+    return [status.name for status in self.statuses if status.dirty]
+
+
+_snapshots = {}
+_snapshotsLock = threading.Lock()
+
+
+def Snapshot(repo, jobs=None):
+  """
+  Returns the snapshot of repo, taking a new one if there is none or if it has been invalidated.
+  """
+  with _snapshotsLock:
+    key = repo.working_tree_dir
+    snapshot = _snapshots.get(key)
+    if snapshot is None:
+      snapshot = SubmoduleSnapshot(repo, jobs=jobs)
+      _snapshots[key] = snapshot
+    return snapshot
+
+
+def InvalidateSnapshot(repo):
+  """
+  Discards the snapshot of repo. Must be called after changing branches, commits, or files of repo or its submodules.
+  """
+  with _snapshotsLock:
+    _snapshots.pop(repo.working_tree_dir, None)
 
 
 def LatestDate(repo):
-  date = 0
-  for submodule in repo.submodules:
-    subrepo = submodule.module()
-    head = subrepo.head
-    if head.is_detached:
-      commitDate = head.commit.committed_date
+  return Snapshot(repo).latest_date()
+
+
+def Branch(repo):
+  return Snapshot(repo).branch
+
+
+def DirtySubmodules(repo):
+  return Snapshot(repo).dirty()
+
+
+def _GitDir(workingDir):
+  dotGit = os.path.join(workingDir, '.git')
+  if os.path.isdir(dotGit):
+    return dotGit
+  if os.path.isfile(dotGit):
+    with open(dotGit) as file:
+      content = file.read().strip()
+    if content.startswith('gitdir:'):
+      return os.path.normpath(os.path.join(workingDir, content[len('gitdir:'):].strip()))
+  return None
+
+
+def _ResolveRef(gitDir, ref):
+  refDirs = [gitDir]
+  commonDirFile = os.path.join(gitDir, 'commondir')
+  if os.path.isfile(commonDirFile):
+    with open(commonDirFile) as file:
+      refDirs.append(os.path.normpath(os.path.join(gitDir, file.read().strip())))
+  for refDir in refDirs:
+    refFile = os.path.join(refDir, ref)
+    if os.path.isfile(refFile):
+      with open(refFile) as file:
+        value = file.read().strip()
+      if value.startswith('ref:'):
+        return _ResolveRef(gitDir, value[len('ref:'):].strip())
+      return value
+    packedRefsFile = os.path.join(refDir, 'packed-refs')
+    if os.path.isfile(packedRefsFile):
+      with open(packedRefsFile) as file:
+        for line in file:
+          parts = line.split()
+          if len(parts) == 2 and parts[1] == ref:
+            return parts[0]
+  return None
+
+
+def HeadSha(workingDir):
+  """
+  Returns the SHA of the HEAD commit of the repository at workingDir, or None if it has not been initialized or its HEAD
+  cannot be resolved.
+  """
+  gitDir = _GitDir(workingDir)
+  if not gitDir or not os.path.isfile(os.path.join(gitDir, 'HEAD')):
+    return None
+  with open(os.path.join(gitDir, 'HEAD')) as file:
+    head = file.read().strip()
+  sha = _ResolveRef(gitDir, head[len('ref:'):].strip()) if head.startswith('ref:') else head
+  if not sha:
+    try:
+      sha = subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=workingDir, stderr=subprocess.DEVNULL)
+    except (subprocess.CalledProcessError, OSError):
+      return None
+    sha = sha.decode('utf-8').strip()
+  return sha
+
+
+def SubmodulePaths(repo):
+  """
+  Returns a list of (name, path) tuples of all submodules of repo, in the order of the .gitmodules file in the working
+  tree, using a single git invocation.
+  """
+  return _SubmodulePathsAt(repo.working_tree_dir)
+
+
+def _SubmodulePathsAt(rootDir):
+  gitmodules = os.path.join(rootDir, '.gitmodules')
+  if not os.path.isfile(gitmodules):
+    return []
+  output = subprocess.check_output(
+    ['git', 'config', '--file', gitmodules, '--null', '--get-regexp', r'^submodule\..*\.path$'], cwd=rootDir)
+  paths = []
+  for entry in output.decode('utf-8').split('\0'):
+    if not entry:
+      continue
+    key, _, path = entry.partition('\n')
+    paths.append((key[len('submodule.'):-len('.path')], path))
+  return paths
+
+
+def SubmoduleHeads(repo):
+  """
+  Returns a list of (name, path, HEAD SHA) tuples of all initialized submodules of repo, in the order of .gitmodules.
+  Reads HEADs and refs directly from the file system instead of loading GitPython objects, falling back to rev-parse
+  for anything it cannot resolve.
+  """
+  heads = []
+  for name, path in SubmodulePaths(repo):
+    sha = HeadSha(os.path.join(repo.working_tree_dir, path))
+    if sha:
+      heads.append((name, path, sha))
+  return heads
+
+
+def _TrackedFiles(workingDir, recurse=True):
+  """
+  Lists the absolute paths of files tracked in the index of the repository at workingDir, recursing into initialized
+  nested submodules if recurse is set.
+  """
+  output = subprocess.check_output(['git', 'ls-files', '-z', '--stage'], cwd=workingDir)
+  files = []
+  for entry in output.decode('utf-8', errors='surrogateescape').split('\0'):
+    if not entry:
+      continue
+    info, _, path = entry.partition('\t')
+    location = os.path.join(workingDir, path)
+    if info.startswith('160000 '):
+      if recurse and _GitDir(location):
+        files.extend(_TrackedFiles(location))
     else:
-      commitDate = head.ref.commit.committed_date
+      files.append(location)
+  return files
+
+
+def WorkingDirs(repo, recursive=False):
+  """
+  Returns the working directories of repo and its initialized submodules, starting with the one of repo. If recursive
+  is set, initialized nested submodules are included as well, after the submodule that contains them.
+  """
+  rootDir = repo.working_tree_dir
+  workingDirs = [rootDir]
+  pending = [rootDir]
+  while pending:
+    parentDir = pending.pop(0)
+    for _, path in _SubmodulePathsAt(parentDir):
+      location = os.path.join(parentDir, path)
+      if _GitDir(location):
+        workingDirs.append(location)
+        if recursive:
+          pending.append(location)
+  return workingDirs
+
+
+def ChangedFilesBetween(workingDir, oldSha, newSha):
+  """
+  Returns the set of paths, relative to workingDir, of files that differ between commits oldSha and newSha of the
+  repository at workingDir. Raises a CalledProcessError if either commit does not exist.
+  """
+  output = subprocess.check_output(['git', 'diff', '--name-only', '--no-renames', '-z', oldSha, newSha],
+    cwd=workingDir, stderr=subprocess.DEVNULL)
+  return set(path for path in output.decode('utf-8', errors='surrogateescape').split('\0') if path)
+
+
+def WorkingTreeFingerprint(directory):
+  """
+  Returns a fingerprint of the contents of directory, which is a repository or a directory inside a repository: the
+  SHA of its tree in the HEAD commit, combined with its uncommitted changes and untracked files, and the fingerprints of
+  its nested submodules, if it is dirty. Ignored files, such as build outputs, do not affect the fingerprint. Returns
+  None if directory is not in a repository.
+  """
+  def Git(*args, **kwargs):
+    return subprocess.check_output(['git'] + list(args), cwd=directory, stderr=subprocess.DEVNULL, **kwargs)
+
+  try:
+    tree = Git('rev-parse', 'HEAD:./').decode('utf-8').strip()
+    status = Git('status', '--porcelain', '-z', '--untracked-files=all', '--ignore-submodules=none', '--', '.')
+  except (subprocess.CalledProcessError, OSError):
+    return None
+  if not status:
+    return tree
+
+  digest = hashlib.sha1(tree.encode('utf-8'))
+  digest.update(Git('diff', 'HEAD', '--binary', '--no-ext-diff', '--submodule=short', '--', '.'))
+  # The diff only marks nested submodules with uncommitted changes as dirty, so add the fingerprints of their contents.
+  for entry in Git('ls-files', '--stage', '-z', '--', '.').split(b'\0'):
+    if not entry.startswith(b'160000 '):
+      continue
+    path = entry.partition(b'\t')[2].decode('utf-8', errors='surrogateescape')
+    fingerprint = WorkingTreeFingerprint(os.path.join(directory, path))
+    if not fingerprint:
+      return None
+    digest.update(path.encode('utf-8', errors='surrogateescape') + b'\0' + fingerprint.encode('utf-8'))
+  untracked = Git('ls-files', '--others', '--exclude-standard', '-z', '--', '.').split(b'\0')
+  untracked = [path for path in untracked if path]
+  if untracked:
+    digest.update(b'\0'.join(untracked))
+    digest.update(Git('hash-object', '--stdin-paths', input=b'\n'.join(untracked)))
+  return digest.hexdigest()
+
+
+def TrackedFiles(repo, jobs=None):
+  """
+  Lists the absolute paths of files tracked by repo and its initialized submodules, using one git ls-files invocation
+  per repository, run concurrently. Untracked and ignored files, such as build outputs, are never visited.
+  """
+  rootDir = repo.working_tree_dir
+  workingDirs = WorkingDirs(repo)
+  # Submodules are listed concurrently, do not recurse into them from the root repository.
+  tasks = [(rootDir, partial(_TrackedFiles, rootDir, False))]
+  tasks.extend((location, partial(_TrackedFiles, location)) for location in workingDirs[1:])
+  results = RunParallel(tasks, jobs=jobs)
+  return [file for workingDir in workingDirs for file in results[workingDir]]
+
+
+class WorkingStatus(object):
+  """
+  Branch and working tree status of a single submodule, parsed from git status --porcelain=v2 --branch.
+  """
+
+  def __init__(self, name, path, initialized=False):
+    self.name = name
+    self.path = path
+    self.initialized = initialized
+    self.sha = None
+    self.branch = None
+    self.upstream = None
+    self.ahead = 0
+    self.behind = 0
+    self.changed = 0
+    self.conflicted = 0
+    self.untracked = 0
+
+  @property
+  def clean(self):
+    return not self.changed and not self.conflicted and not self.untracked
+
+  def to_json(self):
+    return dict(self.__dict__, clean=self.clean)
+
+
+def WorkingTreeStatus(name, workingDir, untracked=True, fast=False):
+  """
+  Returns the WorkingStatus of the repository at workingDir. When fast is set, the untracked cache of git is enabled,
+  which makes repeated invocations that look for untracked files on large working trees much faster. The built-in file
+  system monitor is not enabled, since it is not available on Linux before git 2.43.
+  """
+  status = WorkingStatus(name, workingDir)
+  if not _GitDir(workingDir):
+    return status
+  status.initialized = True
+  args = ['git']
+  if fast:
+    args.extend(['-c', 'core.untrackedCache=true'])
+  args.extend(['status', '--porcelain=v2', '--branch', '-z',
+               '--untracked-files={}'.format('normal' if untracked else 'no')])
+  output = subprocess.check_output(args, cwd=workingDir).decode('utf-8', errors='replace')
+  entries = iter(output.split('\0'))
+  for entry in entries:
+    if entry.startswith('# branch.oid '):
+      oid = entry[len('# branch.oid '):]
+      status.sha = oid if oid != '(initial)' else None
+    elif entry.startswith('# branch.head '):
+      head = entry[len('# branch.head '):]
+      status.branch = head if head != '(detached)' else None
+    elif entry.startswith('# branch.upstream '):
+      status.upstream = entry[len('# branch.upstream '):]
+    elif entry.startswith('# branch.ab '):
+      ahead, behind = entry[len('# branch.ab '):].split()
+      status.ahead = int(ahead)
+      status.behind = -int(behind)
+    elif entry.startswith('1 '):
+      status.changed += 1
+    elif entry.startswith('2 '):
+      status.changed += 1
+      # Renames and copies are followed by an entry with the original path.
+      next(entries, None)
+    elif entry.startswith('u '):
+      status.conflicted += 1
+    elif entry.startswith('? '):
+      status.untracked += 1
+  return status
+
+
+def StatusAll(repo, untracked=True, fast=False, jobs=None):
+  """
+  Returns the WorkingStatus of all submodules of repo in the order of .gitmodules, collected concurrently.
+  """
+  paths = SubmodulePaths(repo)
+  statuses = RunParallel(((name, partial(WorkingTreeStatus, name, os.path.join(repo.working_tree_dir, path),
+    untracked, fast)) for name, path in paths), jobs=jobs)
+  result = []
+  for name, path in paths:
+    status = statuses[name]
+    status.path = path
+    result.append(status)
+  return result
+
+
+def FastLatestDate(repo, heads=None):
+  """
+  Returns the same date as LatestDate, but reads the committer dates of all submodule HEADs with a single git
+  invocation, which borrows the object databases of all submodules through GIT_ALTERNATE_OBJECT_DIRECTORIES. Pass
+  heads from SubmoduleHeads to avoid reading them again.
+  """
+  rootDir = repo.working_tree_dir
+  if heads is None:
+    heads = SubmoduleHeads(repo)
+  if not heads:
+    return datetime.datetime.fromtimestamp(0)
+  objectDirs = [os.path.join(_GitDir(os.path.join(rootDir, path)), 'objects') for _, path, _ in heads]
+  env = dict(os.environ)
+  env['GIT_ALTERNATE_OBJECT_DIRECTORIES'] = os.pathsep.join(objectDirs)
+  output = subprocess.check_output(['git', 'show', '--no-patch', '--format=%ct'] + [sha for _, _, sha in heads],
+    cwd=rootDir, env=env)
+  dates = [int(line) for line in output.decode('utf-8').split()]
+  return datetime.datetime.fromtimestamp(max(dates, default=0))
+
+
+def ForEachSubmodule(repo, func, jobs=None, names=None):
+  """
+  Runs func on each submodule of repo concurrently, using at most jobs worker threads. Raises a ParallelError with all
+  failures once every submodule has been processed. If names is given, only submodules with those names are processed.
+  """
+  submodules = [submodule for submodule in repo.submodules if names is None or submodule.name in names]
+  return RunParallel(((submodule.name, partial(func, submodule)) for submodule in submodules), jobs=jobs)
+
+
+# Fragments of git error messages that indicate a transient network failure, which is worth retrying.
+_transientErrors = [
+  'Could not resolve host',
+  'Connection reset',
+  'Connection refused',
+  'Connection timed out',
+  'Operation timed out',
+  'The remote end hung up',
+  'early EOF',
+  'RPC failed',
+  'unexpected disconnect',
+  'returned error: 5',
+  'Temporary failure',
+  'cannot lock ref',
+]
+
+defaultRetries = 3
+
+
+def _IsTransient(error):
+  message = '{}\n{}'.format(error.stderr, error.stdout)
+  return any(fragment in message for fragment in _transientErrors)
+
+
+def _Retry(description, func, retries=defaultRetries, backoff=2):
+  attempt = 0
+  while True:
+    try:
+      return func()
+    except GitCommandError as detail:
+      attempt += 1
+      if attempt > retries or not _IsTransient(detail):
+        raise
+      delay = backoff ** attempt
+      print('{} failed with a network error, retrying in {}s ({}/{})'.format(description, delay, attempt, retries))
+      time.sleep(delay)
+
+
+def _PrintTimings(description, timings, elapsed):
+  timings = [(name, duration) for name, duration in timings.items() if duration is not None]
+  print('{} {} submodules in {:.1f}s'.format(description, len(timings), elapsed))
+  for name, duration in sorted(timings, key=lambda timing: timing[1], reverse=True):
+    print('  {:>7.1f}s  {}'.format(duration, name))
+
+
+def ReferenceCache(submodule, cacheDir, retries=defaultRetries):
+  """
+  Creates or updates a bare mirror of submodule in cacheDir, and returns its location. Automatic garbage collection is
+  disabled in the mirror, since submodules borrow its objects through git alternates. The mirror is never pruned for
+  the same reason.
+  """
+  location = os.path.join(os.path.abspath(cacheDir), '{}.git'.format(submodule.name))
+  if not os.path.isdir(location):
+    print('Creating reference cache for {} at {}'.format(submodule.name, location))
+    temporary = '{}.tmp'.format(location)
+    git = Git()
+    shutil.rmtree(temporary, ignore_errors=True)
+    _Retry('Cloning {} into reference cache'.format(submodule.name),
+      lambda: git.clone('--mirror', submodule.url, temporary), retries)
+    Git(temporary).config('gc.auto', '0')
+    os.rename(temporary, location)
+  else:
+    print('Updating reference cache for {}'.format(submodule.name))
+    cache = Git(location)
+    _Retry('Updating reference cache of {}'.format(submodule.name), lambda: cache.fetch('origin'), retries)
+  return location
+
+
+def _AddAlternate(subrepo, reference):
+  objects = os.path.join(reference, 'objects')
+  alternatesFile = os.path.join(subrepo.git_dir, 'objects', 'info', 'alternates')
+  alternates = []
+  if os.path.isfile(alternatesFile):
+    with open(alternatesFile) as file:
+      alternates = file.read().splitlines()
+  if objects in alternates:
+    return
+  os.makedirs(os.path.dirname(alternatesFile), exist_ok=True)
+  with open(alternatesFile, 'a') as file:
+    file.write('{}\n'.format(objects))
 
-    if commitDate > date:
-      date = commitDate
 
-  return datetime.datetime.fromtimestamp(date)
+def Fetch(submodule, referenceCache=None, retries=defaultRetries):
+  if not submodule.module_exists():
+    return None
+  start = time.time()
+  subrepo = submodule.module()
+  if referenceCache:
+    _AddAlternate(subrepo, ReferenceCache(submodule, referenceCache, retries))
+  print('Fetching {}'.format(submodule.name))
+  _Retry('Fetching {}'.format(submodule.name), lambda: subrepo.git.fetch(), retries)
+  return time.time() - start
 
 
-def Branch(repo):
-  head = repo.head
-  if head.is_detached:
-    return "DETACHED"
-  return head.reference.name
+def FetchAll(repo, referenceCache=None, retries=defaultRetries, jobs=None, names=None):
+  start = time.time()
+  timings = ForEachSubmodule(repo, lambda submodule: Fetch(submodule, referenceCache, retries), jobs=jobs,
+    names=names)
+  _PrintTimings('Fetched', timings, time.time() - start)
 
 
-def Fetch(submodule):
-  if not submodule.module_exists():
+@unique
+class CloneMode(Enum):
+  FULL = 'full'
+  BLOBLESS = 'blobless'
+  TREELESS = 'treeless'
+  SHALLOW_SINCE = 'shallow-since'
+  DEPTH = 'depth'
+
+
+class CloneStrategy(object):
+  """
+  Determines how much history and which objects are fetched when a submodule is initialized. Parsed from 'full',
+  'blobless', 'treeless', 'shallow-since:<date>', or 'depth:<n>'. Blobless and treeless clones require Git 2.36 or
+  higher.
+  """
+
+  def __init__(self, mode, argument=None):
+    self.mode = mode
+    self.argument = argument
+
+  @staticmethod
+  def parse(text):
+    modeName, _, argument = text.partition(':')
+    try:
+      mode = CloneMode(modeName)
+    except ValueError:
+      raise ValueError('Unknown clone strategy {}, choose from: {}'.format(modeName,
+        ', '.join(mode.value for mode in CloneMode)))
+    if mode in (CloneMode.SHALLOW_SINCE, CloneMode.DEPTH) and not argument:
+      raise ValueError('Clone strategy {} requires an argument, e.g. {}:{}'.format(modeName, modeName,
+        '2017-01-01' if mode is CloneMode.SHALLOW_SINCE else '1'))
+    return CloneStrategy(mode, argument or None)
+
+  def update_arguments(self):
+    if self.mode is CloneMode.BLOBLESS:
+      return ['--filter=blob:none']
+    if self.mode is CloneMode.TREELESS:
+      return ['--filter=tree:0']
+    if self.mode is CloneMode.DEPTH:
+      return ['--depth', self.argument]
+    if self.mode is CloneMode.SHALLOW_SINCE:
+      # Submodule update does not support --shallow-since, clone minimal history and deepen it after cloning.
+      return ['--depth', '1']
+    return []
+
+  def after_clone(self, name, subrepo, retries=defaultRetries):
+    if self.mode is CloneMode.SHALLOW_SINCE:
+      print('Fetching history of {} since {}'.format(name, self.argument))
+      _Retry('Fetching history of {}'.format(name),
+        lambda: subrepo.git.fetch('--shallow-since={}'.format(self.argument)), retries)
+
+  def __str__(self):
+    if self.argument:
+      return '{}:{}'.format(self.mode.value, self.argument)
+    return self.mode.value
+
+
+def ParseCloneStrategies(specs):
+  """
+  Parses clone strategy specifications of the form '<strategy>' for all submodules, or '<submodule>=<strategy>' for a
+  single submodule. Returns the strategy for all submodules, or None if it was not given, and a dictionary from
+  submodule name to strategy.
+  """
+  default = None
+  strategies = {}
+  for spec in specs or []:
+    name, separator, strategy = spec.rpartition('=')
+    if separator:
+      strategies[name] = CloneStrategy.parse(strategy)
+    else:
+      default = CloneStrategy.parse(strategy)
+  return default, strategies
+
+
+def IsShallow(subrepo):
+  return os.path.isfile(os.path.join(subrepo.git_dir, 'shallow'))
+
+
+def Deepen(name, subrepo, retries=defaultRetries):
+  """
+  Fetches the full history and all branches of subrepo if it was cloned shallowly, for operations such as merging that
+  require the full history.
+  """
+  if not IsShallow(subrepo):
     return
-  print('Fetching {}'.format(submodule.name))
-  subrepo = submodule.module()
-  subrepo.git.fetch()
+  print('Fetching full history of {}'.format(name))
+  remote = subrepo.remote()
+  subrepo.git.config('remote.{}.fetch'.format(remote.name), '+refs/heads/*:refs/remotes/{}/*'.format(remote.name))
+  _Retry('Fetching full history of {}'.format(name), lambda: subrepo.git.fetch('--unshallow', remote.name), retries)
 
 
-def FetchAll(repo):
-  for submodule in repo.submodules:
-    Fetch(submodule)
+# Serializes operations that write to the configuration of the parent repository, such as initializing submodules.
+_parentLock = threading.Lock()
 
 
-def Update(repo, submodule, remote=True, recursive=True, depth=None):
+def Update(repo, submodule, remote=True, recursive=True, depth=None, referenceCache=None, retries=defaultRetries,
+    lock=True, cloneStrategy=None):
+  """
+  Initializes or updates submodule. Initialization writes to the configuration of repo, so updates are serialized by
+  default. Pass lock=False when the submodule has already been registered with InitAll, to update concurrently. The
+  clone strategy is only used when the submodule is initialized, and replaces depth if it limits the depth itself.
+  """
+  start = time.time()
   args = ['update', '--init']
 
+  initialize = not submodule.module_exists()
+  strategyArgs = cloneStrategy.update_arguments() if initialize and cloneStrategy else []
+
   if recursive:
     args.append('--recursive')
   if remote:
     args.append('--remote')
-  if depth:
+  if depth and '--depth' not in strategyArgs:
     args.append('--depth')
     args.append(depth)
 
-  if not submodule.module_exists():
-    print('Initializing {}'.format(submodule.name))
+  if initialize:
+    if referenceCache:
+      args.append('--reference')
+      args.append(ReferenceCache(submodule, referenceCache, retries))
+    if cloneStrategy:
+      args.extend(strategyArgs)
+      print('Initializing {} with {} clone'.format(submodule.name, cloneStrategy))
+    else:
+      print('Initializing {}'.format(submodule.name))
   else:
     subrepo = submodule.module()
+    if referenceCache:
+      _AddAlternate(subrepo, ReferenceCache(submodule, referenceCache, retries))
     remote = subrepo.remote()
     head = subrepo.head
     if head.is_detached:
@@ -67,21 +680,64 @@ def Update(repo, submodule, remote=True, recursive=True, depth=None):
   args.append('--')
   args.append(submodule.name)
 
-  repo.git.submodule(args)
-
-
-def UpdateAll(repo, remote=True, recursive=True, depth=None):
-  for submodule in repo.submodules:
-    Update(repo, submodule, remote=remote, recursive=recursive, depth=depth)
-
-
-def Checkout(repo, submodule):
+  def Run():
+    if lock:
+      with _parentLock:
+        repo.git.submodule(args)
+    else:
+      repo.git.submodule(args)
+
+  _Retry('Updating {}'.format(submodule.name), Run, retries)
+  if initialize and cloneStrategy:
+    cloneStrategy.after_clone(submodule.name, submodule.module(), retries)
+  return time.time() - start
+
+
+def InitAll(repo, names=None):
+  """
+  Registers all submodules, or the submodules with given names, in the configuration of repo, such that they can be
+  updated concurrently afterwards.
+  """
+  args = ['init']
+  if names is not None:
+    paths = [submodule.path for submodule in repo.submodules if submodule.name in names]
+    if not paths:
+      return
+    args.append('--')
+    args.extend(paths)
+  with _parentLock:
+    repo.git.submodule(args)
+
+
+def UpdateAll(repo, remote=True, recursive=True, depth=None, referenceCache=None, retries=defaultRetries, jobs=None,
+    cloneStrategy=None, cloneStrategies=None, names=None):
+  """
+  Initializes or updates all submodules concurrently, or only the submodules with given names. Submodules that are
+  initialized are cloned with the strategy from cloneStrategies for their name, falling back to cloneStrategy.
+  """
+  start = time.time()
+  cloneStrategies = cloneStrategies or {}
+  InitAll(repo, names)
+  try:
+    timings = ForEachSubmodule(repo, lambda submodule: Update(repo, submodule, remote=remote, recursive=recursive,
+      depth=depth, referenceCache=referenceCache, retries=retries, lock=False,
+      cloneStrategy=cloneStrategies.get(submodule.name, cloneStrategy)), jobs=jobs, names=names)
+  finally:
+    InvalidateSnapshot(repo)
+  _PrintTimings('Updated', timings, time.time() - start)
+
+
+def Checkout(repo, submodule, snapshot=None):
   if not submodule.module_exists():
     Update(repo, submodule)
 
   branch = submodule.branch
-  print('Switching {} to {}'.format(submodule.name, branch.name))
-  branch.checkout()
+  status = snapshot.get(submodule.name) if snapshot else None
+  if status and status.initialized and status.branch == branch.name:
+    print('{} is already on {}'.format(submodule.name, branch.name))
+  else:
+    print('Switching {} to {}'.format(submodule.name, branch.name))
+    branch.checkout()
 
   if not submodule.module_exists():
     print('Cannot recursively checkout, {} has not been initialized yet.'.format(submodule.name))
@@ -92,24 +748,115 @@ def Checkout(repo, submodule):
     Checkout(subrepo, submodule)
 
 
-def CheckoutAll(repo):
-  for submodule in repo.submodules:
-    Checkout(repo, submodule)
-
-
-def Clean(submodule):
+def CheckoutAll(repo, jobs=None, names=None):
+  # Only use a snapshot that was already taken, collecting one just for skipping checkouts costs more than it saves.
+  with _snapshotsLock:
+    snapshot = _snapshots.get(repo.working_tree_dir)
+  if snapshot and not snapshot.collected:
+    snapshot = None
+  try:
+    ForEachSubmodule(repo, lambda submodule: Checkout(repo, submodule, snapshot), jobs=jobs, names=names)
+  finally:
+    InvalidateSnapshot(repo)
+
+
+_cleanExcludes = ['.project', '.classpath', '.settings', 'META-INF']
+buildOutputDirectories = ['target', 'build', '.eclipsegen']
+
+
+class CleanResult(object):
+  """
+  Paths that were (or in a dry run, would be) removed from a submodule, the number of bytes they occupied, and how long
+  cleaning took.
+  """
+
+  def __init__(self, name, paths, size, duration):
+    self.name = name
+    self.paths = paths
+    self.size = size
+    self.duration = duration
+
+
+def _CleanCandidates(subrepo, buildOutputsOnly):
+  args = ['-dfxn']
+  for exclude in _cleanExcludes:
+    args.extend(['-e', exclude])
+  output = subrepo.git(c='core.quotePath=false').clean(*args)
+  paths = []
+  for line in output.splitlines():
+    if not line.startswith('Would remove '):
+      continue
+    path = line[len('Would remove '):]
+    if not buildOutputsOnly:
+      paths.append(path)
+    elif path.endswith('/'):
+      paths.extend(_BuildOutputDirs(subrepo.working_tree_dir, path))
+  return paths
+
+
+def _BuildOutputDirs(workingDir, untrackedDir):
+  """
+  Returns untrackedDir if it is a build output directory, or otherwise the build output directories inside it, relative
+  to workingDir and ending in a slash like the paths that git clean reports.
+  """
+  if os.path.basename(untrackedDir[:-1]) in buildOutputDirectories:
+    return [untrackedDir]
+  outputDirs = []
+  for root, dirs, _ in os.walk(os.path.join(workingDir, untrackedDir)):
+    for directory in [d for d in dirs if d in buildOutputDirectories]:
+      dirs.remove(directory)
+      outputDirs.append(os.path.relpath(os.path.join(root, directory), workingDir) + '/')
+  return sorted(outputDirs)
+
+
+def Clean(submodule, dryRun=False, buildOutputsOnly=False):
+  """
+  Removes untracked and ignored files from submodule, or only untracked build output directories if buildOutputsOnly
+  is set. Measures the size of everything that is removed beforehand, and removes nothing if dryRun is set. Returns a
+  CleanResult, or None if the submodule has not been initialized.
+  """
   if not submodule.module_exists():
     print('Cannot clean, {} has not been initialized yet.'.format(submodule.name))
-    return
+    return None
 
+  start = time.time()
   subrepo = submodule.module()
-  print('Cleaning {}'.format(submodule.name))
-  subrepo.git.clean('-dfx', '-e', '.project', '-e', '.classpath', '-e', '.settings', '-e', 'META-INF')
-
-
-def CleanAll(repo):
-  for submodule in repo.submodules:
-    Clean(submodule)
+  paths = _CleanCandidates(subrepo, buildOutputsOnly)
+  size = sum(DiskUsage(os.path.join(subrepo.working_tree_dir, path)) for path in paths)
+  if not dryRun and paths:
+    print('Cleaning {}'.format(submodule.name))
+    if buildOutputsOnly:
+      for path in paths:
+        shutil.rmtree(os.path.join(subrepo.working_tree_dir, path))
+    else:
+      args = ['-dfx']
+      for exclude in _cleanExcludes:
+        args.extend(['-e', exclude])
+      subrepo.git.clean(*args)
+  return CleanResult(submodule.name, paths, size, time.time() - start)
+
+
+def _PrintCleanReport(results, elapsed, dryRun):
+  results = [result for result in results.values() if result is not None]
+  total = sum(result.size for result in results)
+  print('{} {} in {} paths from {} submodules in {:.1f}s'.format('Would reclaim' if dryRun else 'Reclaimed',
+    FormatSize(total), sum(len(result.paths) for result in results), len(results), elapsed))
+  for result in sorted(results, key=lambda result: result.size, reverse=True):
+    if result.paths:
+      print('  {:>10}  {:>5} paths  {:>6.1f}s  {}'.format(FormatSize(result.size), len(result.paths), result.duration,
+        result.name))
+
+
+def CleanAll(repo, dryRun=False, buildOutputsOnly=False, jobs=None, names=None):
+  """
+  Cleans all submodules concurrently, and prints how much space was (or would be) reclaimed in each. Returns a
+  dictionary from submodule name to CleanResult.
+  """
+  start = time.time()
+  results = ForEachSubmodule(repo, lambda submodule: Clean(submodule, dryRun, buildOutputsOnly), jobs=jobs,
+    names=names)
+  _PrintCleanReport(results, time.time() - start, dryRun)
+  return results
 
 
 def Reset(submodule, toRemote):
@@ -132,9 +879,11 @@ def Reset(submodule, toRemote):
     subrepo.git.reset('--hard')
 
 
-def ResetAll(repo, toRemote):
-  for submodule in repo.submodules:
-    Reset(submodule, toRemote)
+def ResetAll(repo, toRemote, jobs=None, names=None):
+  try:
+    ForEachSubmodule(repo, lambda submodule: Reset(submodule, toRemote), jobs=jobs, names=names)
+  finally:
+    InvalidateSnapshot(repo)
 
 
 def Merge(submodule, branchName):
@@ -143,12 +892,16 @@ def Merge(submodule, branchName):
     return
 
   subrepo = submodule.module()
+  Deepen(submodule.name, subrepo)
+  print('Merging {} into {}'.format(branchName, submodule.name))
   subrepo.git.merge(branchName)
 
 
-def MergeAll(repo, branchName):
-  for submodule in repo.submodules:
-    Merge(submodule, branchName)
+def MergeAll(repo, branchName, jobs=None):
+  try:
+    ForEachSubmodule(repo, lambda submodule: Merge(submodule, branchName), jobs=jobs)
+  finally:
+    InvalidateSnapshot(repo)
 
 
 def Tag(submodule, tagName, tagDescription):
@@ -156,14 +909,73 @@ def Tag(submodule, tagName, tagDescription):
     print('Cannot tag, {} has not been initialized yet.'.format(submodule.name))
     return
 
-  print('Creating tag {} in {}'.format(tagName, submodule.name))
   subrepo = submodule.module()
+  Deepen(submodule.name, subrepo)
+  print('Creating tag {} in {}'.format(tagName, submodule.name))
   subrepo.create_tag(path=tagName, message=tagDescription)
 
 
-def TagAll(repo, tagName, tagDescription):
-  for submodule in repo.submodules:
-    Tag(submodule, tagName, tagDescription)
+def TagAll(repo, tagName, tagDescription, jobs=None):
+  ForEachSubmodule(repo, lambda submodule: Tag(submodule, tagName, tagDescription), jobs=jobs)
+
+
+def _CommitFiles(workingDir, name, paths, message, dryRun):
+  if dryRun:
+    print('Changed files in {}: {}'.format(name, paths))
+    return False
+  print('Adding files {} to {} and committing'.format(paths, name))
+  subrepo = Repo(workingDir)
+  items = []
+  for path in paths:
+    location = os.path.join(workingDir, path)
+    if _GitDir(location):
+      # Nested submodule, stage its new revision instead of the files inside it.
+      items.append(BaseIndexEntry((S_IFGITLINK, Repo(location).head.commit.binsha, 0, path)))
+    else:
+      items.append(path)
+  subrepo.index.add(items)
+  # Files may have been changed back to their committed version, in which case there is nothing to commit.
+  if not subrepo.is_dirty(index=True, working_tree=False, untracked_files=False):
+    return False
+  subrepo.index.commit(message)
+  return True
+
+
+def CommitFiles(repo, files, message, dryRun=False, jobs=None):
+  """
+  Commits given files in the submodules that contain them, with one git add and one commit per submodule. Files are
+  assigned to the innermost (nested) submodule that contains them. Nested submodules are committed before their parent,
+  which then also commits their new revision. Submodules at the same nesting depth are committed concurrently. Files
+  that are not inside a submodule are not committed. Returns the working directories of committed submodules.
+  """
+  rootDir = repo.working_tree_dir
+  workingDirs = WorkingDirs(repo, recursive=True)[1:]
+  trie = PathTrie()
+  for workingDir in workingDirs:
+    trie.insert(workingDir, workingDir)
+
+  paths = {}
+  for file in files:
+    owner = trie.longest_prefix(file)
+    if owner:
+      paths.setdefault(owner, []).append(os.path.relpath(file, owner))
+
+  def Depth(workingDir):
+    return len(os.path.relpath(workingDir, rootDir).split(os.sep))
+
+  committed = []
+  for depth in sorted(set(Depth(workingDir) for workingDir in workingDirs), reverse=True):
+    level = [workingDir for workingDir in workingDirs if Depth(workingDir) == depth and workingDir in paths]
+    results = RunParallel(((workingDir, partial(_CommitFiles, workingDir, os.path.relpath(workingDir, rootDir),
+      paths[workingDir], message, dryRun)) for workingDir in level), jobs=jobs)
+    for workingDir in level:
+      if not results[workingDir]:
+        continue
+      committed.append(workingDir)
+      parent = trie.longest_prefix(os.path.dirname(workingDir))
+      if parent:
+        paths.setdefault(parent, []).append(os.path.relpath(workingDir, parent))
+  return committed
 
 
 def Push(submodule, **kwargs):
@@ -177,9 +989,8 @@ def Push(submodule, **kwargs):
   remote.push(**kwargs)
 
 
-def PushAll(repo, **kwargs):
-  for submodule in repo.submodules:
-    Push(submodule, **kwargs)
+def PushAll(repo, jobs=None, **kwargs):
+  ForEachSubmodule(repo, lambda submodule: Push(submodule, **kwargs), jobs=jobs)
 
 
 def Track(submodule):
@@ -196,9 +1007,8 @@ def Track(submodule):
   subrepo.git.branch('-u', remoteBranchName, localBranchName)
 
 
-def TrackAll(repo):
-  for submodule in repo.submodules:
-    Track(submodule)
+def TrackAll(repo, jobs=None):
+  ForEachSubmodule(repo, Track, jobs=jobs)
 
 
 @unique
@@ -207,9 +1017,11 @@ class RemoteType(Enum):
   HTTP = 2
 
 
-def SetRemoteAll(repo, toType=RemoteType.SSH):
-  for submodule in repo.submodules:
-    SetRemote(submodule, toType)
+def SetRemoteAll(repo, toType=RemoteType.SSH, jobs=None):
+  try:
+    ForEachSubmodule(repo, lambda submodule: SetRemote(submodule, toType), jobs=jobs)
+  finally:
+    InvalidateSnapshot(repo)
 
 
 def SetRemote(submodule, toType):
@@ -245,8 +1057,15 @@ def SetRemote(submodule, toType):
   origin.config_writer.set('url', newUrl)
 
 
+def _QualifierDate(repo, heads=None):
+  try:
+    return FastLatestDate(repo, heads)
+  except (subprocess.CalledProcessError, OSError):
+    return LatestDate(repo)
+
+
 def create_qualifier(repo, branch=None):
-  timestamp = LatestDate(repo)
+  timestamp = _QualifierDate(repo)
   if not branch:
     branch = Branch(repo)
   return _format_qualifier(timestamp, branch)
@@ -259,25 +1078,259 @@ def create_now_qualifier(repo, branch=None):
   return _format_qualifier(timestamp, branch)
 
 
+def benchmark_qualifier(repo, runs):
+  """
+  Times the fast and the GitPython implementation of computing the qualifier over given number of runs. Returns the
+  mean duration of both, and whether they produced the same qualifiers.
+  """
+  branch = Branch(repo)
+  fastTimes, slowTimes, fastQualifiers, slowQualifiers = [], [], set(), set()
+  for _ in range(runs):
+    start = time.perf_counter()
+    fastQualifiers.add(_format_qualifier(FastLatestDate(repo), branch))
+    fastTimes.append(time.perf_counter() - start)
+    InvalidateSnapshot(repo)
+    start = time.perf_counter()
+    slowQualifiers.add(_format_qualifier(LatestDate(repo), branch))
+    slowTimes.append(time.perf_counter() - start)
+  return sum(fastTimes) / runs, sum(slowTimes) / runs, fastQualifiers == slowQualifiers
+
+
 def _format_qualifier(timestamp, branch):
   return '{}-{}'.format(timestamp.strftime('%Y%m%d-%H%M%S'), branch.replace('/', '_'))
 
 
-def repo_changed(repo, qualifierLocation):
-  timestamp = LatestDate(repo)
-  branch = Branch(repo)
-  changed = False
-  if not os.path.isfile(qualifierLocation):
-    changed = True
-  else:
-    with open(qualifierLocation, mode='r') as qualifierFile:
-      storedTimestampStr = qualifierFile.readline().replace('\n', '')
-      storedBranch = qualifierFile.readline().replace('\n', '')
-      if not storedTimestampStr or not storedBranch:
-        raise RuntimeError('Invalid qualifier file {}, please delete this file and retry'.format(qualifierLocation))
-      storedTimestamp = datetime.datetime.fromtimestamp(int(storedTimestampStr))
-      changed = (timestamp > storedTimestamp) or (branch != storedBranch)
-  with open(qualifierLocation, mode='w') as timestampFile:
-    timestampStr = str(int(time.mktime(timestamp.timetuple())))
-    timestampFile.write('{}\n{}\n'.format(timestampStr, branch))
-  return changed, _format_qualifier(timestamp, branch)
+class Fingerprint(object):
+  """
+  Identifies the state of a repository by the SHA of its HEAD, the SHA of the HEAD of each initialized submodule, and
+  the current branch.
+  """
+
+  def __init__(self, branch, root, submodules):
+    self.branch = branch
+    self.root = root
+    self.submodules = submodules
+
+  @staticmethod
+  def take(repo, heads=None):
+    if heads is None:
+      heads = SubmoduleHeads(repo)
+    return Fingerprint(Branch(repo), HeadSha(repo.working_tree_dir), {name: sha for name, _, sha in heads})
+
+  @staticmethod
+  def read(location):
+    """
+    Reads a fingerprint from the file at location. Returns None if it does not exist or if it is in the old timestamp
+    and branch format.
+    """
+    if not os.path.isfile(location):
+      return None
+    with open(location, mode='r') as file:
+      try:
+        data = json.load(file)
+      except ValueError:
+        return None
+    if not isinstance(data, dict) or 'submodules' not in data:
+      raise RuntimeError('Invalid fingerprint file {}, please delete this file and retry'.format(location))
+    return Fingerprint.from_json(data)
+
+  def write(self, location, qualifier):
+    data = self.to_json()
+    data['qualifier'] = qualifier
+    _WriteJson(location, data)
+
+  @staticmethod
+  def from_json(data):
+    return Fingerprint(data.get('branch'), data.get('root'), data['submodules'])
+
+  def to_json(self):
+    return {'branch': self.branch, 'root': self.root, 'submodules': self.submodules}
+
+
+def _WriteJson(location, data):
+  temporary = '{}.tmp'.format(location)
+  with open(temporary, mode='w') as file:
+    json.dump(data, file, indent=2, sort_keys=True)
+  os.replace(temporary, location)
+
+
+class RepoChanges(object):
+  """
+  Differences between a stored fingerprint and the current fingerprint of a repository.
+  """
+
+  def __init__(self, qualifier, old, new):
+    self.qualifier = qualifier
+    self.initial = old is None
+    oldSubmodules = old.submodules if old else {}
+    self.branchChanged = old is None or old.branch != new.branch
+    self.rootChanged = old is None or old.root != new.root
+    self.added = sorted(name for name in new.submodules if name not in oldSubmodules)
+    self.removed = sorted(name for name in oldSubmodules if name not in new.submodules)
+    self.modified = {name: (oldSubmodules[name], sha) for name, sha in new.submodules.items() if
+                     name in oldSubmodules and oldSubmodules[name] != sha}
+    self.oldRoot = old.root if old else None
+    self.newRoot = new.root
+    self.oldBranch = old.branch if old else None
+    self.newBranch = new.branch
+
+  @property
+  def changed(self):
+    return self.branchChanged or self.rootChanged or bool(self.added or self.removed or self.modified)
+
+  @property
+  def changed_submodules(self):
+    return sorted(self.added + self.removed + list(self.modified))
+
+  def to_json(self):
+    return {
+      'changed'   : self.changed,
+      'initial'   : self.initial,
+      'qualifier' : self.qualifier,
+      'branch'    : {'old': self.oldBranch, 'new': self.newBranch},
+      'root'      : {'old': self.oldRoot, 'new': self.newRoot},
+      'submodules': {
+        'added'   : self.added,
+        'removed' : self.removed,
+        'modified': {name: {'old': old, 'new': new} for name, (old, new) in self.modified.items()},
+      },
+    }
+
+
+def repo_changes(repo, fingerprintLocation):
+  """
+  Compares the current fingerprint of repo with the fingerprint stored at fingerprintLocation, and stores the current
+  fingerprint there. Returns a RepoChanges object.
+  """
+  heads = SubmoduleHeads(repo)
+  timestamp = _QualifierDate(repo, heads)
+  new = Fingerprint.take(repo, heads)
+  old = Fingerprint.read(fingerprintLocation)
+  qualifier = _format_qualifier(timestamp, new.branch)
+  new.write(fingerprintLocation, qualifier)
+  return RepoChanges(qualifier, old, new)
+
+
+def _LsRemote(url, refs, retries=defaultRetries):
+  git = Git()
+  output = _Retry('Querying {}'.format(url), lambda: git.ls_remote(url, *refs), retries)
+  tips = {}
+  for line in output.splitlines():
+    sha, _, ref = line.partition('\t')
+    tips[ref] = sha
+  return tips
+
+
+def _ResolveUrl(baseUrl, url):
+  if not url.startswith('./') and not url.startswith('../'):
+    return url
+  base = baseUrl.rstrip('/')
+  for part in url.split('/'):
+    if part == '..':
+      base = base.rsplit('/', 1)[0]
+    elif part and part != '.':
+      base = '{}/{}'.format(base, part)
+  return base
+
+
+def _RemoteSubmodules(repo, remote, branch, sha, retries=defaultRetries):
+  """
+  Returns a dictionary from submodule name to (URL, ref) of the branch it tracks, as configured in the .gitmodules file
+  of commit sha. Fetches branch of the root repository if sha is not available locally, which does not touch the
+  working tree.
+  """
+  try:
+    repo.git.cat_file('-e', sha)
+  except GitCommandError:
+    print('Fetching {} of the root repository'.format(branch), file=sys.stderr)
+    _Retry('Fetching {}'.format(branch), lambda: repo.git.fetch(remote.name, branch), retries)
+  try:
+    output = repo.git.config('--blob', '{}:.gitmodules'.format(sha), '--null', '--get-regexp',
+      r'^submodule\..*\.(url|branch)$')
+  except GitCommandError:
+    return {}
+  urls = {}
+  branches = {}
+  for entry in output.split('\0'):
+    if not entry:
+      continue
+    key, _, value = entry.partition('\n')
+    name, _, field = key[len('submodule.'):].rpartition('.')
+    if field == 'url':
+      urls[name] = _ResolveUrl(remote.url, value)
+    else:
+      branches[name] = value
+  submodules = {}
+  for name, url in urls.items():
+    submoduleBranch = branches.get(name)
+    if submoduleBranch == '.':
+      submoduleBranch = branch
+    submodules[name] = (url, 'refs/heads/{}'.format(submoduleBranch) if submoduleBranch else 'HEAD')
+  return submodules
+
+
+def RemoteFingerprints(repo, branches, jobs=None, retries=defaultRetries):
+  """
+  Returns a dictionary from each of given branches of the root repository to the fingerprint of its remote tip, where
+  each submodule is identified by the remote tip of the branch it tracks. Queries remotes with git ls-remote, one
+  query per repository for all branches, using at most jobs concurrent connections.
+  """
+  remote = repo.remote()
+  rootTips = _LsRemote(remote.url, ['refs/heads/{}'.format(branch) for branch in branches], retries)
+  roots = {}
+  wanted = {}
+  refsPerUrl = {}
+  for branch in branches:
+    root = rootTips.get('refs/heads/{}'.format(branch))
+    if not root:
+      raise RuntimeError('Branch {} does not exist in {}'.format(branch, remote.url))
+    roots[branch] = root
+    wanted[branch] = _RemoteSubmodules(repo, remote, branch, root, retries)
+    for url, ref in wanted[branch].values():
+      refsPerUrl.setdefault(url, set()).add(ref)
+
+  tips = RunParallel(((url, partial(_LsRemote, url, sorted(refs), retries)) for url, refs in refsPerUrl.items()),
+    jobs=jobs)
+
+  fingerprints = {}
+  for branch in branches:
+    submodules = {}
+    for name, (url, ref) in wanted[branch].items():
+      sha = tips[url].get(ref)
+      if sha:
+        submodules[name] = sha
+      else:
+        print('WARNING: {} does not exist in {} of submodule {}'.format(ref, url, name), file=sys.stderr)
+    fingerprints[branch] = Fingerprint(branch, roots[branch], submodules)
+  return fingerprints
+
+
+def remote_changes(repo, branches, remoteFingerprintLocation, fingerprintLocation=None, jobs=None,
+    retries=defaultRetries):
+  """
+  Compares the remote fingerprints of given branches with the remote fingerprints stored at
+  remoteFingerprintLocation, and stores the new remote fingerprints there. A branch without a stored remote fingerprint
+  is compared with the working tree fingerprint at fingerprintLocation if that was taken on the same branch. Returns a
+  dictionary from branch to RepoChanges, without qualifiers since those require fetching commits. An unreadable or
+  malformed file at remoteFingerprintLocation is treated as if no remote fingerprints were stored, and is overwritten.
+  """
+  stored = {}
+  if os.path.isfile(remoteFingerprintLocation):
+    try:
+      with open(remoteFingerprintLocation, mode='r') as file:
+        stored = {branch: Fingerprint.from_json(data) for branch, data in json.load(file).items()}
+    except (OSError, ValueError, KeyError, TypeError, AttributeError):
+      stored = {}
+  local = Fingerprint.read(fingerprintLocation) if fingerprintLocation else None
+
+  fingerprints = RemoteFingerprints(repo, branches, jobs=jobs, retries=retries)
+
+  changes = {}
+  for branch, fingerprint in fingerprints.items():
+    old = stored.get(branch)
+    if old is None and local is not None and local.branch == branch:
+      old = local
+    changes[branch] = RepoChanges(None, old, fingerprint)
+    stored[branch] = fingerprint
+  _WriteJson(remoteFingerprintLocation, {branch: fingerprint.to_json() for branch, fingerprint in stored.items()})
+  return changes
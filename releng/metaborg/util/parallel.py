@@ -0,0 +1,233 @@
+import os
+import sys
+import threading
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, as_completed, wait
+from contextlib import contextmanager
+from io import StringIO
+
+
+def DefaultJobs():
+  """
+  Default number of concurrent jobs, used when no number of jobs is given.
+  """
+  return os.cpu_count() or 1
+
+
+class ParallelError(RuntimeError):
+  """
+  Raised when one or more tasks run by RunParallel failed. Holds a list of (name, exception) tuples in failures.
+  """
+
+  def __init__(self, failures, numTasks):
+    self.failures = failures
+    self.numTasks = numTasks
+    lines = ['{} of {} tasks failed:'.format(len(failures), numTasks)]
+    for name, error in failures:
+      description = str(error).strip().replace('\n', '\n    ')
+      lines.append('  {}: {}'.format(name, description))
+    super().__init__('\n'.join(lines))
+
+
+class _ThreadOutput(object):
+  """
+  Stream that redirects writes to a buffer of the current thread if it has one, and to the wrapped stream otherwise.
+  """
+
+  def __init__(self, stream):
+    self.stream = stream
+    self.local = threading.local()
+
+  def write(self, text):
+    buffer = getattr(self.local, 'buffer', None)
+    if buffer is not None:
+      return buffer.write(text)
+    return self.stream.write(text)
+
+  def flush(self):
+    if getattr(self.local, 'buffer', None) is None:
+      self.stream.flush()
+
+  def __getattr__(self, name):
+    return getattr(self.stream, name)
+
+
+_printLock = threading.Lock()
+
+
+class _PrefixWriter(object):
+  """
+  Writes complete lines to stream, each prefixed with prefix. Incomplete lines are held back until they are completed
+  or flushed.
+  """
+
+  def __init__(self, stream, prefix):
+    self.stream = stream
+    self.prefix = prefix
+    self.pending = ''
+
+  def write(self, text):
+    lines = (self.pending + text).split('\n')
+    self.pending = lines.pop()
+    if lines:
+      with _printLock:
+        self.stream.write(''.join('{}{}\n'.format(self.prefix, line) for line in lines))
+        self.stream.flush()
+    return len(text)
+
+  def flush(self):
+    if self.pending:
+      self.write('\n')
+
+
+@contextmanager
+def _InstalledThreadOutput():
+  installed = not isinstance(sys.stdout, _ThreadOutput)
+  if installed:
+    sys.stdout = _ThreadOutput(sys.stdout)
+  output = sys.stdout
+  try:
+    yield output
+  finally:
+    if installed:
+      sys.stdout = output.stream
+
+
+@contextmanager
+def PrefixedThreadOutput(prefix):
+  """
+  Prefixes each line that the current thread prints with prefix, and prints it immediately, while inside the context.
+  Has no effect outside of RunParallel and RunGraph.
+  """
+  output = sys.stdout
+  if not isinstance(output, _ThreadOutput):
+    yield
+    return
+  previous = getattr(output.local, 'buffer', None)
+  writer = _PrefixWriter(output.stream, prefix)
+  output.local.buffer = writer
+  try:
+    yield
+  finally:
+    writer.flush()
+    output.local.buffer = previous
+
+
+def RunParallel(tasks, jobs=None):
+  """
+  Runs given (name, function) tasks on a bounded pool of worker threads. Output that a task prints is buffered and
+  printed in one piece when the task is done, such that the output of different tasks does not interleave. A failing
+  task does not stop other tasks; all failures are raised together as a ParallelError after all tasks are done.
+  Returns a dictionary from task name to the value returned by its function.
+  """
+  tasks = list(tasks)
+  if not jobs:
+    jobs = DefaultJobs()
+
+  results = {}
+  failures = []
+
+  if jobs == 1 or len(tasks) <= 1:
+    for name, func in tasks:
+      try:
+        results[name] = func()
+      except Exception as detail:
+        failures.append((name, detail))
+  else:
+    with _InstalledThreadOutput() as output:
+      def Run(func):
+        output.local.buffer = StringIO()
+        try:
+          return func()
+        finally:
+          text = output.local.buffer.getvalue()
+          output.local.buffer = None
+          if text:
+            with _printLock:
+              output.stream.write(text)
+              output.stream.flush()
+
+      with ThreadPoolExecutor(max_workers=min(jobs, len(tasks))) as executor:
+        futures = {executor.submit(Run, func): name for name, func in tasks}
+        try:
+          for future in as_completed(futures):
+            name = futures[future]
+            try:
+              results[name] = future.result()
+            except Exception as detail:
+              failures.append((name, detail))
+        except KeyboardInterrupt:
+          for future in futures:
+            future.cancel()
+          raise
+
+  if failures:
+    order = [name for name, _ in tasks]
+    failures.sort(key=lambda failure: order.index(failure[0]))
+    raise ParallelError(failures, len(tasks))
+
+  return results
+
+
+def RunGraph(tasks, deps, jobs=None, costs=None, budget=None):
+  """
+  Runs given (name, function) tasks on a bounded pool of worker threads, starting a task once all tasks it depends on
+  have completed. Deps is a dictionary from task name to the names of the tasks it depends on; dependencies that are not
+  a given task are ignored. Ready tasks are started in the given order. If budget is given, tasks are only started
+  while the sum of the costs of running tasks, from the costs dictionary, stays within budget; a task that exceeds the
+  budget by itself runs alone. Each line a task prints is immediately printed, prefixed with the name of the task.
+  After a task fails no new tasks are started, and all failures are raised as a ParallelError once running tasks are
+  done. Returns a dictionary from task name to the value returned by its function.
+  """
+  tasks = list(tasks)
+  if not jobs:
+    jobs = DefaultJobs()
+  costs = costs or {}
+  functions = dict(tasks)
+  waiting = {name: set(dep for dep in deps.get(name, ()) if dep in functions) for name in functions}
+  pending = [name for name, _ in tasks]
+
+  results = {}
+  failures = []
+  running = {}
+  used = 0
+
+  def Run(name, func):
+    with PrefixedThreadOutput('[{}] '.format(name)):
+      return func()
+
+  with _InstalledThreadOutput(), ThreadPoolExecutor(max_workers=jobs) as executor:
+    try:
+      while True:
+        if not failures:
+          for name in [name for name in pending if not waiting[name]]:
+            if len(running) >= jobs:
+              break
+            cost = costs.get(name, 0)
+            if budget is not None and running and used + cost > budget:
+              continue
+            pending.remove(name)
+            used += cost
+            running[executor.submit(Run, name, functions[name])] = name
+        if not running:
+          break
+        done, _ = wait(running, return_when=FIRST_COMPLETED)
+        for future in done:
+          name = running.pop(future)
+          used -= costs.get(name, 0)
+          try:
+            results[name] = future.result()
+          except Exception as detail:
+            failures.append((name, detail))
+            continue
+          for dependencies in waiting.values():
+            dependencies.discard(name)
+    except KeyboardInterrupt:
+      for future in running:
+        future.cancel()
+      raise
+
+  if failures:
+    raise ParallelError(failures, len(tasks))
+  if pending:
+    raise RuntimeError('Tasks {} have cyclic dependencies'.format(', '.join(pending)))
+  return results
@@ -1,3 +1,5 @@
+import os
+import re
 from itertools import takewhile
 
 
@@ -13,3 +15,95 @@ def CommonPrefix(paths, sep='/'):
     return all(n == name[0] for n in name[1:])
 
   return sep.join(x[0] for x in takewhile(AllNamesEqual, byDirectoryLevels))
+
+
+def DiskUsage(path):
+  """
+  Returns the number of bytes that given file or directory occupies on disk, without following symbolic links.
+  """
+  def Usage(stat):
+    blocks = getattr(stat, 'st_blocks', None)
+    return blocks * 512 if blocks is not None else stat.st_size
+
+  try:
+    stat = os.lstat(path)
+  except OSError:
+    return 0
+  if not os.path.isdir(path) or os.path.islink(path):
+    return Usage(stat)
+
+  total = Usage(stat)
+  stack = [path]
+  while stack:
+    try:
+      entries = os.scandir(stack.pop())
+    except OSError:
+      continue
+    with entries:
+      for entry in entries:
+        try:
+          total += Usage(entry.stat(follow_symlinks=False))
+          if entry.is_dir(follow_symlinks=False):
+            stack.append(entry.path)
+        except OSError:
+          pass
+  return total
+
+
+def FormatSize(numBytes):
+  """
+  Formats given number of bytes as a human readable size.
+  """
+  size = float(numBytes)
+  for unit in ['B', 'KiB', 'MiB', 'GiB']:
+    if size < 1024:
+      return '{:.0f} {}'.format(size, unit) if unit == 'B' else '{:.1f} {}'.format(size, unit)
+    size /= 1024
+  return '{:.1f} TiB'.format(size)
+
+
+_sizeRegex = re.compile(r'^(\d+)([kKmMgGtT]?)$')
+
+
+def ParseSize(size):
+  """
+  Parses a size in the format of JVM memory options, e.g. 512M or 24G, into a number of bytes. Raises ValueError if
+  given size is not in that format.
+  """
+  match = _sizeRegex.match(size.strip())
+  if not match:
+    raise ValueError('Invalid size {}, expected a number optionally followed by K, M, G, or T'.format(size))
+  return int(match.group(1)) * 1024 ** ' kmgt'.index(match.group(2).lower() or ' ')
+
+
+class PathTrie(object):
+  """
+  Trie of file system paths, mapping paths to values. Finds the value of the longest inserted path that is a prefix of
+  a given path in time proportional to the depth of that path, independent of the number of inserted paths.
+  """
+
+  def __init__(self):
+    self.root = {}
+
+  @staticmethod
+  def _components(path):
+    return [component for component in os.path.normpath(path).split(os.sep) if component]
+
+  def insert(self, path, value):
+    node = self.root
+    for component in self._components(path):
+      node = node.setdefault(component, {})
+    node[None] = value
+
+  def longest_prefix(self, path, default=None):
+    """
+    Returns the value of the longest inserted path that equals or contains given path, or default if there is none.
+    """
+    node = self.root
+    value = node.get(None, default)
+    for component in self._components(path):
+      node = node.get(component)
+      if node is None:
+        break
+      value = node.get(None, value)
+    return value